@@ -0,0 +1,27 @@
+import os
+from contextlib import contextmanager
+
+
+def setup_django():
+    # Benchmarks run from the expense_sharing directory against the configured database.
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'expense_sharing.settings')
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    # A throwaway database created like the test runner does, for benchmarks that
+    # seed their own data instead of using the configured one.
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
@@ -0,0 +1,80 @@
+"""Split allocation throughput: the previous per-split Decimal loop against the
+integer-cent batch mode used for bulk creates.
+
+Usage (from the expense_sharing directory):
+
+    python -m benchmarks.allocation
+    python -m benchmarks.allocation --expenses 1000000 --max-splits 8
+
+Also reports how many expenses the Decimal loop leaves with splits that do not
+add up to the expense amount once rounded to cents, as DecimalField stores them.
+"""
+import argparse
+import random
+import time
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from expenses.allocation import allocate_many
+
+CENT = Decimal('0.01')
+
+
+def random_rows(count, max_splits, rng):
+    rows = []
+    for _ in range(count):
+        splits = rng.randint(2, max_splits)
+        total = rng.randint(1, 10_000_00)
+        if rng.random() < 0.5:
+            rows.append(('EQUAL', total, [None] * splits))
+        else:
+            # Percentages in basis points that add up to 100%.
+            cuts = sorted(rng.sample(range(1, 10000), splits - 1))
+            rows.append(('PERCENTAGE', total, [b - a for a, b in zip([0, *cuts], [*cuts, 10000])]))
+    return rows
+
+
+def decimal_loop(rows):
+    # What ExpenseSerializer.validate used to do, followed by the rounding the
+    # DecimalField applies on save.
+    mismatched = 0
+    for split_type, total, values in rows:
+        amount = Decimal(total) / 100
+        if split_type == 'EQUAL':
+            split_amount = amount / len(values)
+            splits = [split_amount for _ in values]
+        else:
+            splits = [(Decimal(value) / 10000) * amount for value in values]
+        stored = [split.quantize(CENT, rounding=ROUND_HALF_EVEN) for split in splits]
+        if sum(stored) != amount:
+            mismatched += 1
+    return mismatched
+
+
+def integer_batch(rows):
+    mismatched = 0
+    for (_, total, _), cents in zip(rows, allocate_many(rows)):
+        if sum(cents) != total:
+            mismatched += 1
+    return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--expenses', type=int, default=200_000)
+    parser.add_argument('--max-splits', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = random_rows(args.expenses, args.max_splits, random.Random(args.seed))
+    splits = sum(len(values) for _, _, values in rows)
+    print(f'{args.expenses} expenses, {splits} splits')
+    print(f"{'method':>14} {'seconds':>10} {'splits/s':>12} {'mismatched':>11}")
+    for name, func in [('decimal loop', decimal_loop), ('integer batch', integer_batch)]:
+        started = time.perf_counter()
+        mismatched = func(rows)
+        elapsed = time.perf_counter() - started
+        print(f'{name:>14} {elapsed:>10.3f} {splits / elapsed:>12.0f} {mismatched:>11}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+"""Reproducible API benchmark: seed, drive the real endpoints, write JSON, compare.
+
+Seeds synthetic users, expenses and splits with seed_expenses (fixed --seed, so
+every run sees the same data), then times create, retrieve, user_expenses,
+overall_expenses and download_balance_sheet through the full middleware and
+DRF stack. Per endpoint it reports throughput, p50/p95/p99 latency, SQL
+queries per request and the peak RSS of this process so far.
+
+By default everything runs in-process through Django's test client against a
+throwaway database created on the configured engine (SQLite, or PostgreSQL
+when DATABASES points there). Run from the expense_sharing directory:
+
+    python -m benchmarks.api_suite --splits 100000 --output results.json
+    python -m benchmarks.api_suite --splits 100000 --compare results.json
+
+--compare exits with status 1 when a case got slower, lost throughput or runs
+more queries per request than in the earlier run, so it can gate a build.
+
+To measure a real server instead, seed the configured database and point the
+suite at the server; query counts are then read from the Server-Timing header
+(EXPENSES_SERVER_TIMING = True on the server):
+
+    python manage.py migrate
+    python -m benchmarks.api_suite --database configured --splits 10000000 --base-url http://127.0.0.1:8000
+"""
+import argparse
+import http.client
+import json
+import math
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from io import StringIO
+from urllib.parse import urlsplit
+
+from benchmarks import setup_django, test_database
+
+CASES = ['create', 'retrieve', 'user_expenses', 'overall_expenses', 'download_balance_sheet']
+
+SERVER_TIMING_QUERIES = re.compile(r'db;desc="(\d+) queries"')
+
+
+class ClientDriver:
+    # In-process requests through django.test.Client. Queries are counted with an
+    # execute wrapper, which costs far less than capturing them.
+
+    def __init__(self):
+        from django.test import Client
+
+        self.client = Client()
+
+    def request(self, method, path, token, data=None):
+        from django.db import connection
+
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            response = self.client.generic(
+                method, path, json.dumps(data) if data is not None else '',
+                content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}',
+            )
+            if response.streaming:
+                size = sum(len(chunk) for chunk in response.streaming_content)
+            else:
+                size = len(response.content)
+        return response.status_code, size, queries
+
+
+class HTTPDriver:
+    # One persistent HTTP/1.1 connection to a running server.
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=600)
+        self.prefix = parts.path.rstrip('/')
+
+    def request(self, method, path, token, data=None):
+        body = json.dumps(data).encode() if data is not None else None
+        headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+        self.connection.request(method, self.prefix + path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        size = len(response.read())
+        match = SERVER_TIMING_QUERIES.search(response.getheader('Server-Timing') or '')
+        return response.status, size, int(match.group(1)) if match else None
+
+
+@contextmanager
+def configured_database():
+    # The configured database as is; the test environment only makes the test
+    # client's host name acceptable.
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    try:
+        yield
+    finally:
+        teardown_test_environment()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list.
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def measure(driver, token, method, path_for, requests, warmup, data=None):
+    for i in range(warmup):
+        driver.request(method, path_for(i), token, data)
+
+    latencies, queries, sizes = [], [], 0
+    started = time.perf_counter()
+    for i in range(requests):
+        request_started = time.perf_counter()
+        status, size, query_count = driver.request(method, path_for(warmup + i), token, data)
+        latencies.append(time.perf_counter() - request_started)
+        if status >= 300:
+            raise SystemExit(f'{method} {path_for(warmup + i)} returned {status}')
+        sizes += size
+        queries.append(query_count)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+        'mean_ms': round(sum(latencies) / requests * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'queries_per_request': None if None in queries else round(sum(queries) / requests, 2),
+        'bytes_per_request': sizes // requests,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def seed(args):
+    from django.core.management import call_command
+
+    expenses = max(1, args.splits // args.splits_per_expense)
+    users = args.users or max(args.splits_per_expense, args.splits // 100)
+    started = time.perf_counter()
+    call_command(
+        'seed_expenses', users=users, expenses=expenses, splits_per_expense=args.splits_per_expense,
+        batch_size=args.batch_size, seed=args.seed, prefix='api_suite', stdout=StringIO(),
+    )
+    return round(time.perf_counter() - started, 1)
+
+
+def run_cases(args, driver):
+    from django.contrib.auth.models import User
+    from django.db.models import Count
+
+    from expenses import caching
+    from expenses.models import Expense
+    from expenses.serializers import ClaimsTokenObtainPairSerializer
+
+    # The user who created the most expenses owns the listing and retrieve cases.
+    busiest = (
+        Expense.objects.values('created_by').annotate(count=Count('id')).order_by('-count', 'created_by').first()
+    )
+    if busiest is None:
+        raise SystemExit('No expenses found; seed the database first.')
+    owner = User.objects.get(pk=busiest['created_by'])
+    admin, _ = User.objects.get_or_create(username='api_suite_admin', defaults={'is_staff': True, 'password': '!'})
+    owner_token = str(ClaimsTokenObtainPairSerializer.get_token(owner).access_token)
+    admin_token = str(ClaimsTokenObtainPairSerializer.get_token(admin).access_token)
+
+    owned_ids = list(Expense.objects.filter(created_by=owner).order_by('id').values_list('id', flat=True)[:1000])
+    split_users = list(
+        User.objects.filter(username__startswith='api_suite_').order_by('id').values_list('id', flat=True)[:5]
+    )
+    new_expense = {
+        'title': 'Benchmark dinner', 'amount': '100.00', 'split_type': 'EQUAL',
+        'splits': [{'user': user_id} for user_id in split_users],
+    }
+    page = f'?page_size={args.page_size}'
+
+    cases = {
+        'create': (owner_token, 'POST', lambda i: '/api/expenses/', args.requests, new_expense),
+        # Cycles through the owner's expenses; the first pass misses the cache.
+        'retrieve': (owner_token, 'GET', lambda i: f'/api/expenses/{owned_ids[i % len(owned_ids)]}/',
+                     args.requests, None),
+        'user_expenses': (owner_token, 'GET', lambda i: f'/api/expenses/user_expenses/{page}', args.requests, None),
+        'overall_expenses': (admin_token, 'GET', lambda i: f'/api/expenses/overall_expenses/{page}',
+                             args.requests, None),
+        'download_balance_sheet': (admin_token, 'GET', lambda i: '/api/expenses/download_balance_sheet/',
+                                   args.sheet_requests, None),
+    }
+
+    caching.clear()
+    results = {}
+    for name in args.cases:
+        token, method, path_for, requests, data = cases[name]
+        warmup = args.warmup if name != 'download_balance_sheet' else 0
+        results[name] = measure(driver, token, method, path_for, requests, warmup, data)
+        print_case(name, results[name])
+    return results
+
+
+def print_case(name, result):
+    queries = result['queries_per_request']
+    print(
+        f"{name:<24} {result['throughput_rps']:>9.1f} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+        f"{result['p99_ms']:>9.2f} {'-' if queries is None else f'{queries:.2f}':>8} {result['peak_rss_mb']:>9.1f}"
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, tolerance, query_tolerance):
+    # Regressions of `current` against `baseline`, as human-readable lines. Only
+    # cases present in both runs are compared.
+    regressions = []
+    for name, result in current['cases'].items():
+        before = baseline['cases'].get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} ms -> {result['p95_ms']} ms")
+        if result['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if None not in (result['queries_per_request'], before['queries_per_request']):
+            if result['queries_per_request'] > before['queries_per_request'] + query_tolerance:
+                regressions.append(
+                    f"{name}: queries/request {before['queries_per_request']} -> {result['queries_per_request']}"
+                )
+    if current['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+        regressions.append(f"peak RSS {baseline['peak_rss_mb']} MB -> {current['peak_rss_mb']} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--splits', type=int, default=10000, help='Splits to seed (10k to 10M).')
+    parser.add_argument('--splits-per-expense', type=int, default=5)
+    parser.add_argument('--users', type=int, help='Users to seed (default: one per 100 splits).')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', choices=['test', 'configured'], default='test',
+                        help='Seed a throwaway test database (default) or use the configured one.')
+    parser.add_argument('--no-seed', action='store_true', help='Use the data already in the configured database.')
+    parser.add_argument('--base-url', help='Send requests to this running server instead of the test client.')
+    parser.add_argument('--cases', type=lambda value: value.split(','), default=CASES,
+                        help=f"Comma-separated subset of {','.join(CASES)}.")
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--sheet-requests', type=int, default=3,
+                        help='Requests for download_balance_sheet, which reads every split.')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Earlier JSON results; exit 1 on regression.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative p95/throughput/RSS change before --compare fails (default 0.2).')
+    parser.add_argument('--query-tolerance', type=float, default=0.0,
+                        help='Allowed increase in queries per request before --compare fails (default 0).')
+    args = parser.parse_args()
+
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    if args.database == 'test' and (args.base_url or args.no_seed):
+        parser.error('--base-url and --no-seed need --database configured')
+
+    setup_django()
+    import django
+    from django.conf import settings
+    from django.db import connection
+
+    # DEBUG would keep every query in connection.queries.
+    settings.DEBUG = False
+
+    database = test_database() if args.database == 'test' else configured_database()
+    with database:
+        seed_seconds = None if args.no_seed else seed(args)
+        driver = HTTPDriver(args.base_url) if args.base_url else ClientDriver()
+        print(f"{'case':<24} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'RSS MB':>9}")
+        cases = run_cases(args, driver)
+        vendor = connection.vendor
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': vendor,
+            'driver': 'http' if args.base_url else 'client',
+            'splits': None if args.no_seed else args.splits,
+            'splits_per_expense': args.splits_per_expense,
+            'seed': args.seed,
+            'requests': args.requests,
+            'page_size': args.page_size,
+        },
+        'seed_seconds': seed_seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        'cases': cases,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        for key in ('splits', 'driver', 'database'):
+            if baseline['meta'].get(key) != results['meta'][key]:
+                print(f"warning: {key} differs from the baseline ({baseline['meta'].get(key)} vs {results['meta'][key]})")
+        regressions = compare(results, baseline, args.tolerance, args.query_tolerance)
+        if regressions:
+            print(f"Regressions against {baseline['meta'].get('commit') or args.compare}:")
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        print('No regressions.')
+
+
+if __name__ == '__main__':
+    main()
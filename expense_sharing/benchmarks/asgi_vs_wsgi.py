@@ -0,0 +1,132 @@
+"""Latency percentiles and throughput of an endpoint under many concurrent clients.
+
+Point it at a running server to compare the WSGI views with their async
+counterparts under ASGI, for example:
+
+    gunicorn expense_sharing.wsgi -w 4 --threads 8 -b 127.0.0.1:8000
+    uvicorn expense_sharing.asgi:application --workers 4 --port 8001
+
+    python -m benchmarks.asgi_vs_wsgi --url http://127.0.0.1:8000/api/balances/ \\
+        --username alice --password secret --concurrency 1000
+    python -m benchmarks.asgi_vs_wsgi --url http://127.0.0.1:8001/api/async/balances/ \\
+        --username alice --password secret --concurrency 1000
+
+Each client keeps one HTTP/1.1 connection open and sends requests back to back
+until --requests have been sent in total. Only the standard library is used, so
+the load generator itself does not need Django.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+
+
+def obtain_token(url, username, password):
+    request = urllib.request.Request(
+        urljoin(url, '/api/token/'),
+        data=json.dumps({'username': username, 'password': password}).encode(),
+        headers={'Content-Type': 'application/json'},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)['access']
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by server')
+    status = int(status_line.split()[1])
+    length, chunked = 0, False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+
+    if not chunked:
+        await reader.readexactly(length)
+        return status
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        await reader.readexactly(size + 2)
+        if size == 0:
+            return status
+
+
+async def client(url, headers, remaining, latencies, errors):
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    request = (
+        f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n{headers}Connection: keep-alive\r\n\r\n'
+    ).encode()
+
+    reader = writer = None
+    while remaining[0] > 0:
+        remaining[0] -= 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            writer.write(request)
+            status = await read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            errors['connection'] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        latencies.append(time.perf_counter() - started)
+        if status >= 400:
+            errors[status] = errors.get(status, 0) + 1
+    if writer is not None:
+        writer.close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(url, token, concurrency, requests):
+    headers = f'Authorization: Bearer {token}\r\n' if token else ''
+    remaining, latencies, errors = [requests], [], {'connection': 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(client(url, headers, remaining, latencies, errors) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return sorted(latencies), errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', required=True)
+    parser.add_argument('--token', help='Access token; obtained from /api/token/ if omitted')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    token = args.token
+    if token is None and args.username:
+        token = obtain_token(args.url, args.username, args.password)
+
+    latencies, errors, elapsed = asyncio.run(run(args.url, token, args.concurrency, args.requests))
+    if not latencies:
+        raise SystemExit(f'No successful requests: {errors}')
+    print(f'{args.url} with {args.concurrency} concurrent clients')
+    print(f'  requests     {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s)')
+    print(f'  mean latency {statistics.mean(latencies) * 1000:.1f} ms')
+    print(f'  p50 latency  {percentile(latencies, 0.50) * 1000:.1f} ms')
+    print(f'  p99 latency  {percentile(latencies, 0.99) * 1000:.1f} ms')
+    print(f'  errors       {errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Queries per request and throughput under each authentication mode.
+
+Modes:
+  jwt        simplejwt's JWTAuthentication: one User query per request
+  cached     CachedJWTAuthentication with the in-process user cache
+  stateless  cached mode plus token claims on read-only endpoints
+
+Run from the expense_sharing directory:
+
+    python -m benchmarks.auth_queries --requests 1000
+"""
+import argparse
+import time
+from unittest import mock
+
+from benchmarks import setup_django, test_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import override_settings
+    from rest_framework.test import APIClient
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+
+    from expenses import caching
+    from expenses.authentication import CachedJWTAuthentication, user_cache
+    from expenses.models import Expense
+    from expenses.serializers import ClaimsTokenObtainPairSerializer
+    from expenses.views import BalanceViewSet, ExpenseViewSet
+
+    modes = [
+        ('jwt', JWTAuthentication, False),
+        ('cached', CachedJWTAuthentication, False),
+        ('stateless', CachedJWTAuthentication, True),
+    ]
+
+    with test_database():
+        user = User.objects.create_user(username='bench', password='!')
+        # A full first page, so every mode serializes the same amount of data.
+        Expense.objects.bulk_create(
+            [Expense(title='Lunch', amount_cents=1000, split_type='EQUAL', created_by=user) for _ in range(60)]
+        )
+        client = APIClient()
+        token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        expense = {'title': 'Lunch', 'amount': '10.00', 'split_type': 'EQUAL', 'splits': [{'user': user.id}]}
+        cases = [
+            ('GET /api/expenses/user_expenses/', 'get', '/api/expenses/user_expenses/', {}),
+            ('GET /api/balances/', 'get', '/api/balances/', {}),
+            ('POST /api/expenses/', 'post', '/api/expenses/', {'data': expense, 'format': 'json'}),
+        ]
+
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        print(f"{'mode':<10} {'endpoint':<34} {'req/s':>8} {'queries/req':>12}")
+        for mode, authentication, stateless in modes:
+            with mock.patch.object(ExpenseViewSet, 'authentication_classes', [authentication]), \
+                    mock.patch.object(BalanceViewSet, 'authentication_classes', [authentication]), \
+                    override_settings(EXPENSES_STATELESS_READS=stateless):
+                for name, method, url, kwargs in cases:
+                    # Measure the endpoint itself, not the response cache in front of it.
+                    with mock.patch.object(caching, 'get_balances', return_value=None):
+                        user_cache.clear()
+                        queries = 0
+                        with connection.execute_wrapper(count_queries):
+                            started = time.perf_counter()
+                            for _ in range(args.requests):
+                                response = getattr(client, method)(url, **kwargs)
+                            elapsed = time.perf_counter() - started
+                    assert response.status_code < 300, (url, response.status_code)
+                    print(f'{mode:<10} {name:<34} {args.requests / elapsed:>8.0f} {queries / args.requests:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Requests/second and queries/request for the user and expense detail endpoints.
+
+Requests go through the full middleware and DRF stack with a real JWT in the
+Authorization header, against a throwaway database. Run from the
+expense_sharing directory:
+
+    python -m benchmarks.detail_endpoints --requests 2000
+"""
+import argparse
+import time
+
+from benchmarks import setup_django, test_database
+
+
+def run(client, method, url, requests, **kwargs):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = getattr(client, method)(url, **kwargs)
+        elapsed = time.perf_counter() - started
+    assert response.status_code < 300, (url, response.status_code, response.content)
+    return requests / elapsed, len(queries) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--splits', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from rest_framework.test import APIClient
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    from expenses import caching, ledger, rollups
+    from expenses.models import Expense, ExpenseSplit
+
+    with test_database():
+        users = [User.objects.create_user(username=f'bench{i}', password='!') for i in range(args.splits)]
+        owner = users[0]
+        admin = User.objects.create_superuser(username='bench_admin', password='!')
+        expense = Expense.objects.create(title='Dinner', amount_cents=10000, split_type='EQUAL', created_by=owner)
+        splits = ExpenseSplit.objects.bulk_create(
+            [ExpenseSplit(expense=expense, user=user, amount_cents=1000) for user in users]
+        )
+        # Updates apply deltas to the ledger and rollups, so they must hold the expense.
+        ledger.record_expense(expense, splits)
+        rollups.record_expense(expense, splits)
+
+        def client_for(user):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+            return client
+
+        owner_client, admin_client = client_for(owner), client_for(admin)
+        update = {'title': 'Dinner', 'amount': '100.00', 'split_type': 'EQUAL', 'splits': [{'user': owner.id}]}
+        cases = [
+            ('GET /api/users/{id}/', owner_client, 'get', f'/api/users/{owner.id}/', {}),
+            ('GET /api/expenses/{id}/ (cached)', owner_client, 'get', f'/api/expenses/{expense.id}/', {}),
+            ('PATCH /api/expenses/{id}/', admin_client, 'patch', f'/api/expenses/{expense.id}/',
+             {'data': update, 'format': 'json'}),
+        ]
+
+        caching.clear()
+        print(f"{'endpoint':<36} {'req/s':>10} {'queries/req':>12}")
+        for name, client, method, url, kwargs in cases:
+            rps, queries = run(client, method, url, args.requests, **kwargs)
+            print(f'{name:<36} {rps:>10.0f} {queries:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
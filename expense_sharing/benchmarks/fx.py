@@ -0,0 +1,138 @@
+"""Currency conversion throughput on the export and balance paths.
+
+Seeds a throwaway database with expenses and ledger rows in the currencies of
+settings.EXPENSES_FX_RATES_FILE, spread over the dates it covers, then times:
+
+  convert   amounts converted one by one: a scan of the parsed rate rows with
+            Decimal math (what converting without an index costs) against
+            fx.RateTable and its date-indexed cache; results must agree
+  export    the CSV balance sheet with and without a converted amount column
+  balances  ledger rows read natively and converted by pair_balances_in_cents
+
+Run from the expense_sharing directory:
+
+    python -m benchmarks.fx
+    python -m benchmarks.fx --expenses 100000 --conversions 1000000
+"""
+import argparse
+import csv
+import datetime
+import random
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from benchmarks import setup_django, test_database
+
+
+def scan_convert(rows, reference, cents, from_currency, to_currency, on):
+    # rows: [(date, currency, Decimal rate)] as read from the file.
+    def rate(currency):
+        if currency == reference:
+            return Decimal(1)
+        found = None
+        for date, row_currency, value in rows:
+            if row_currency == currency and date <= on and (found is None or date >= found[0]):
+                found = (date, value)
+        if found is None:
+            raise LookupError(f'No {currency} exchange rate on or before {on}')
+        return found[1]
+
+    if from_currency == to_currency:
+        return cents
+    return int((cents * rate(from_currency) / rate(to_currency)).quantize(Decimal(1), ROUND_HALF_UP))
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--expenses', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--conversions', type=int, default=200000)
+    parser.add_argument('--to', default='EUR', help='Currency to convert into.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+
+    from expenses import fx, ledger
+    from expenses.exports import iter_balance_sheet
+    from expenses.models import Balance, Expense, ExpenseSplit
+
+    rng = random.Random(args.seed)
+    reference = settings.EXPENSES_CURRENCY
+    with open(settings.EXPENSES_FX_RATES_FILE, newline='') as lines:
+        reader = csv.reader(lines)
+        next(reader)
+        raw = [(datetime.date.fromisoformat(date), currency, Decimal(rate)) for date, currency, rate in reader]
+    table = fx.rate_table()
+    first = min(date for date, _, _ in raw)
+    days = (max(date for date, _, _ in raw) - first).days + 90
+    currencies = sorted(table.currencies)
+    if args.to not in currencies:
+        raise SystemExit(f"--to must be one of {', '.join(currencies)}")
+
+    samples = [
+        (rng.randint(1, 1_000_000), rng.choice(currencies), first + datetime.timedelta(days=rng.randrange(days)))
+        for _ in range(args.conversions)
+    ]
+    scan_seconds, scanned = timed(
+        lambda: [scan_convert(raw, reference, cents, currency, args.to, on) for cents, currency, on in samples]
+    )
+    cached_seconds, cached = timed(lambda: [table.convert(cents, currency, args.to, on) for cents, currency, on in samples])
+    if scanned != cached:
+        raise SystemExit('Scanned and cached conversions differ')
+    print(f'{args.conversions} conversions into {args.to}')
+    print(f'{"convert":>10} scan {args.conversions / scan_seconds:>12,.0f}/s  '
+          f'cached {args.conversions / cached_seconds:>12,.0f}/s  {scan_seconds / cached_seconds:.0f}x')
+
+    with test_database():
+        users = User.objects.bulk_create([User(username=f'fx{i}') for i in range(args.users)])
+        expenses = Expense.objects.bulk_create([
+            Expense(
+                title=f'Expense {i}', amount_cents=2 * rng.randint(100, 100_000), split_type='EQUAL',
+                currency=rng.choice(currencies), created_by=rng.choice(users),
+            )
+            for i in range(args.expenses)
+        ], batch_size=5000)
+        start = timezone.make_aware(datetime.datetime.combine(first, datetime.time()))
+        for expense in expenses:
+            expense.created_at = start + datetime.timedelta(days=rng.randrange(days))
+        Expense.objects.bulk_update(expenses, ['created_at'], batch_size=5000)
+        splits = [
+            [ExpenseSplit(expense=expense, user=user, amount_cents=expense.amount_cents // 2)
+             for user in rng.sample(users, 2)]
+            for expense in expenses
+        ]
+        ExpenseSplit.objects.bulk_create([split for pair in splits for split in pair], batch_size=5000)
+        ledger.record_expenses(zip(expenses, splits))
+
+        def export(currency):
+            return sum(1 for _ in iter_balance_sheet(currency=currency)) - 1
+
+        native_seconds, rows = timed(export, None)
+        converted_seconds, _ = timed(export, args.to)
+        print(f'{"export":>10} native {rows / native_seconds:>10,.0f} rows/s  '
+              f'converted {rows / converted_seconds:>10,.0f} rows/s')
+
+        def balances(currency):
+            if currency is None:
+                rows = Balance.objects.exclude(amount_cents=0).values_list('creditor_id', 'debtor_id', 'amount_cents')
+                return sum(1 for _ in rows.iterator())
+            return sum(1 for _ in ledger.pair_balances_in_cents(currency=currency))
+
+        native_seconds, rows = timed(balances, None)
+        converted_seconds, _ = timed(balances, args.to)
+        print(f'{"balances":>10} native {rows / native_seconds:>10,.0f} rows/s  '
+              f'converted {rows / converted_seconds:>10,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Money arithmetic: Decimal amounts, as the models used to hold them, against the
+integer cents of expenses.money, on the steps every split goes through.
+
+Usage (from the expense_sharing directory):
+
+    python -m benchmarks.money
+    python -m benchmarks.money --expenses 500000 --max-splits 10
+
+Stages:
+  parse      API input strings to amounts (DecimalField vs money.parse_cents)
+  validate   EXACT splits checked against the expense total
+  aggregate  ledger deltas summed per (creditor, debtor) pair
+  export     amounts read from the database and formatted for the CSV balance
+             sheet; DecimalField values go through the converter Django's
+             SQLite backend applies to every Decimal column it reads
+
+Both paths must agree on every result; the script exits with an error if not.
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+from decimal import Context, Decimal
+
+from expenses.money import format_cents, parse_cents
+
+CENT = Decimal('0.01')
+
+
+def random_expenses(count, max_splits, users, rng):
+    # [(creditor, total, [(debtor, split amount string)])], EXACT splits that add up.
+    expenses = []
+    for _ in range(count):
+        total = rng.randint(100, 10_000_00)
+        parts = rng.randint(2, max_splits)
+        cuts = sorted(rng.sample(range(1, total), parts - 1))
+        amounts = [b - a for a, b in zip([0, *cuts], [*cuts, total])]
+        expenses.append((
+            rng.randrange(users),
+            format_cents(total),
+            [(rng.randrange(users), format_cents(amount)) for amount in amounts],
+        ))
+    return expenses
+
+
+def decimal_parse(expenses):
+    # DRF's DecimalField: Decimal() then a check of the decimal places.
+    parsed = []
+    for creditor, total, splits in expenses:
+        amounts = []
+        for debtor, amount in splits:
+            value = Decimal(amount)
+            if value.quantize(CENT) != value:
+                raise ValueError(amount)
+            amounts.append((debtor, value))
+        parsed.append((creditor, Decimal(total), amounts))
+    return parsed
+
+
+def cents_parse(expenses):
+    return [
+        (creditor, parse_cents(total), [(debtor, parse_cents(amount)) for debtor, amount in splits])
+        for creditor, total, splits in expenses
+    ]
+
+
+def validate(parsed):
+    return sum(1 for _, total, splits in parsed if sum(amount for _, amount in splits) == total)
+
+
+def decimal_validate(parsed):
+    # Per-split Decimal construction, as the serializer used to sum them.
+    return sum(
+        1 for _, total, splits in parsed if sum((Decimal(amount) for _, amount in splits), Decimal('0.00')) == total
+    )
+
+
+def aggregate(parsed, zero):
+    deltas = defaultdict(lambda: zero)
+    for creditor, _, splits in parsed:
+        for debtor, amount in splits:
+            if debtor != creditor:
+                deltas[(creditor, debtor)] += amount
+    return deltas
+
+
+def column_values(parsed):
+    # What the database hands back: REAL for SQLite decimal columns, ints for cents.
+    return [[total / 100, *(amount / 100 for _, amount in splits)] for _, total, splits in parsed]
+
+
+def decimal_export(rows):
+    create_decimal = Context(prec=15).create_decimal_from_float
+    context = Context(prec=14)
+    return [[str(create_decimal(value).quantize(CENT, context=context)) for value in row] for row in rows]
+
+
+def cents_export(parsed):
+    return [[format_cents(total), *(format_cents(amount) for _, amount in splits)] for _, total, splits in parsed]
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--expenses', type=int, default=200_000)
+    parser.add_argument('--max-splits', type=int, default=6)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    expenses = random_expenses(args.expenses, args.max_splits, args.users, random.Random(args.seed))
+    splits = sum(len(split_list) for _, _, split_list in expenses)
+    print(f'{args.expenses} expenses, {splits} splits')
+    print(f"{'stage':>10} {'decimal s':>10} {'cents s':>10} {'speedup':>8}")
+
+    decimal_seconds, decimals = timed(decimal_parse, expenses)
+    cents_seconds, cents = timed(cents_parse, expenses)
+    stages = [('parse', decimal_seconds, cents_seconds, None)]
+
+    decimal_seconds, decimal_valid = timed(decimal_validate, decimals)
+    cents_seconds, cents_valid = timed(validate, cents)
+    stages.append(('validate', decimal_seconds, cents_seconds, decimal_valid == cents_valid == len(expenses)))
+
+    decimal_seconds, decimal_deltas = timed(aggregate, decimals, Decimal('0.00'))
+    cents_seconds, cents_deltas = timed(aggregate, cents, 0)
+    same = {pair: int(amount.scaleb(2)) for pair, amount in decimal_deltas.items()} == dict(cents_deltas)
+    stages.append(('aggregate', decimal_seconds, cents_seconds, same))
+
+    decimal_seconds, decimal_rows = timed(decimal_export, column_values(cents))
+    cents_seconds, cents_rows = timed(cents_export, cents)
+    stages.append(('export', decimal_seconds, cents_seconds, decimal_rows == cents_rows))
+
+    mismatched = []
+    for name, decimal_seconds, cents_seconds, agrees in stages:
+        print(f'{name:>10} {decimal_seconds:>10.3f} {cents_seconds:>10.3f} {decimal_seconds / cents_seconds:>7.1f}x')
+        if agrees is False:
+            mismatched.append(name)
+    if mismatched:
+        raise SystemExit(f"Decimal and cents results differ in: {', '.join(mismatched)}")
+
+
+if __name__ == '__main__':
+    main()
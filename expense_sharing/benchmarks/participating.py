@@ -0,0 +1,73 @@
+"""Query plans and timings for the participating-expenses listing.
+
+Seed a database first, for example 10M splits:
+
+    python manage.py migrate
+    python manage.py seed_expenses --users 100000 --expenses 2000000 --splits-per-expense 5
+
+then run (from the expense_sharing directory):
+
+    python -m benchmarks.participating --pages 10 --compare-or
+"""
+import argparse
+import time
+
+from benchmarks import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--user', type=int, help='User id to list expenses for (defaults to a seeded user).')
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--compare-or', action='store_true', help='Also time the naive OR-across-join query.')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db.models import Q
+
+    from expenses.models import Expense, ExpenseSplit
+    from expenses.pagination import KeysetPagination
+
+    user_id = args.user or ExpenseSplit.objects.values_list('user_id', flat=True).order_by('-id').first()
+    if user_id is None:
+        raise SystemExit('No splits found; run seed_expenses first.')
+
+    paginator = KeysetPagination()
+    arms = [
+        Expense.objects.filter(created_by_id=user_id),
+        Expense.objects.filter(id__in=ExpenseSplit.objects.filter(user_id=user_id).values('expense_id')),
+    ]
+    print(f'user {user_id}')
+    for arm in arms:
+        print(paginator.apply_cursor(arm, None)[:args.page_size + 1].explain())
+        print()
+
+    cursor = None
+    rows = 0
+    started = time.perf_counter()
+    for _ in range(args.pages):
+        merged = {}
+        for arm in arms:
+            for expense in paginator.apply_cursor(arm, cursor)[:args.page_size + 1]:
+                merged[expense.pk] = expense
+        page = sorted(merged.values(), key=lambda expense: (expense.created_at, expense.pk), reverse=True)
+        page = page[:args.page_size]
+        rows += len(page)
+        if len(page) < args.page_size:
+            break
+        cursor = (page[-1].created_at, page[-1].pk)
+    elapsed = time.perf_counter() - started
+    print(f'keyset union: {rows} rows in {elapsed * 1000:.1f} ms')
+
+    if args.compare_or:
+        naive = Expense.objects.filter(Q(created_by_id=user_id) | Q(splits__user_id=user_id)).distinct()
+        naive = naive.order_by('-created_at', '-id')[:args.page_size]
+        print(naive.explain())
+        started = time.perf_counter()
+        list(naive)
+        print(f'OR across join, first page: {(time.perf_counter() - started) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
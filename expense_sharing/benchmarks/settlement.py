@@ -0,0 +1,57 @@
+"""Runtime of the debt-simplification engine as the group grows.
+
+Usage (from the expense_sharing directory):
+
+    python -m benchmarks.settlement
+    python -m benchmarks.settlement --sizes 10 1000 100000 --repeat 5
+"""
+import argparse
+import random
+import time
+
+from expenses.settlement import EXACT_SOLVER_LIMIT, exact_settle, greedy_settle
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def random_positions(size, rng):
+    # Net positions in cents that sum to zero.
+    amounts = [rng.randint(-500000, 500000) for _ in range(size - 1)]
+    amounts.append(-sum(amounts))
+    return dict(enumerate(amounts))
+
+
+def timed(func, positions, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        transfers = func(positions)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(transfers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'participants':>12} {'solver':>7} {'transfers':>10} {'naive':>14} {'seconds':>10}")
+    for size in args.sizes:
+        positions = random_positions(size, rng)
+        debtors = sum(1 for cents in positions.values() if cents < 0)
+        # Clients settling every debtor against every creditor directly.
+        naive = debtors * (size - debtors)
+        solvers = [('greedy', greedy_settle)]
+        if size <= EXACT_SOLVER_LIMIT:
+            solvers.append(('exact', exact_settle))
+        for name, func in solvers:
+            seconds, transfers = timed(func, positions, args.repeat)
+            print(f'{size:>12} {name:>7} {transfers:>10} {naive:>14} {seconds:>10.5f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Expense write throughput on SQLite with N writer processes.
+
+Every writer creates expenses through ExpenseSerializer, the path POST
+/api/expenses/ takes, including the ledger, rollup and change feed writes. All
+writers share one SQLite file and start together. Each mode gets a fresh copy of
+the same seeded database:
+
+  stock   SQLite defaults (rollback journal) and plain BEGIN
+  wal     settings.EXPENSES_SQLITE_PRAGMAS, plain BEGIN
+  tuned   the pragmas and BEGIN IMMEDIATE for expense writes (the default)
+
+Writes that fail with "database is locked" are counted, not retried. Run from
+the expense_sharing directory (forks the writers, so POSIX only):
+
+    python -m benchmarks.sqlite_writers
+    python -m benchmarks.sqlite_writers --writers 1,4,16 --writes 500
+"""
+import argparse
+import multiprocessing
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks import setup_django
+
+MODES = {
+    'stock': {'EXPENSES_SQLITE_PRAGMAS': {}, 'EXPENSES_SQLITE_IMMEDIATE_WRITES': False},
+    'wal': {'EXPENSES_SQLITE_IMMEDIATE_WRITES': False},
+    'tuned': {},
+}
+
+
+_mode_settings = []
+
+
+def use_database(path, mode):
+    from django.db import connections
+    from django.test.utils import override_settings
+
+    connections.close_all()
+    connections['default'].settings_dict['NAME'] = str(path)
+    while _mode_settings:
+        _mode_settings.pop().disable()
+    _mode_settings.append(override_settings(**MODES[mode]))
+    _mode_settings[-1].enable()
+
+
+def seed_template(path, users):
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connections
+
+    use_database(path, 'stock')
+    call_command('migrate', verbosity=0)
+    User.objects.bulk_create([User(username=f'writer{i}') for i in range(users)])
+    connections.close_all()
+
+
+def writer(path, mode, index, writes, start, results):
+    from django.contrib.auth.models import User
+    from django.db import OperationalError
+
+    from expenses.serializers import ExpenseSerializer
+
+    use_database(path, mode)
+    rng = random.Random(index)
+    users = list(User.objects.all())
+    ok, locked, latencies = 0, 0, []
+    start.wait()
+    for i in range(writes):
+        creator = rng.choice(users)
+        data = {
+            'title': f'Writer {index} expense {i}', 'amount': '30.00', 'split_type': 'EQUAL',
+            'splits': [{'user': user.pk} for user in rng.sample(users, 3)],
+        }
+        started = time.perf_counter()
+        try:
+            serializer = ExpenseSerializer(data=data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save(created_by=creator)
+            ok += 1
+        except OperationalError as error:
+            if 'locked' not in str(error):
+                raise
+            locked += 1
+        latencies.append(time.perf_counter() - started)
+    results.put((ok, locked, latencies))
+
+
+def run(template, directory, mode, writers, writes):
+    path = Path(directory) / f'{mode}-{writers}.sqlite3'
+    shutil.copy(template, path)
+    context = multiprocessing.get_context('fork')
+    start, results = context.Event(), context.Queue()
+    processes = [
+        context.Process(target=writer, args=(path, mode, index, writes, start, results)) for index in range(writers)
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(0.5)  # let every writer connect before the clock starts
+    started = time.perf_counter()
+    start.set()
+    outcomes = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    ok = sum(outcome[0] for outcome in outcomes)
+    locked = sum(outcome[1] for outcome in outcomes)
+    latencies = sorted(latency for outcome in outcomes for latency in outcome[2])
+    return ok / elapsed, locked, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', default='1,2,4,8', help='Comma separated writer process counts.')
+    parser.add_argument('--writes', type=int, default=200, help='Expenses created by each writer.')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+    modes = args.modes.split(',')
+    unknown = sorted(set(modes) - MODES.keys())
+    if unknown:
+        raise SystemExit(f"Unknown modes: {', '.join(unknown)}")
+
+    setup_django()
+    with tempfile.TemporaryDirectory() as directory:
+        template = Path(directory) / 'template.sqlite3'
+        seed_template(template, args.users)
+        print(f"{'mode':>6} {'writers':>8} {'writes/s':>10} {'locked':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for writers in [int(count) for count in args.writers.split(',')]:
+            for mode in modes:
+                throughput, locked, p50, p99 = run(template, directory, mode, writers, args.writes)
+                print(f'{mode:>6} {writers:>8} {throughput:>10.1f} {locked:>8} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'expenses.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,7 +75,7 @@ WSGI_APPLICATION = 'expense_sharing.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'expenses.authentication.CachedJWTAuthentication',
     )
 }
 
@@ -82,19 +84,149 @@ from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'expenses.serializers.ClaimsTokenObtainPairSerializer',
 }
 
+# Read-only expense and balance endpoints can trust the username/is_staff claims
+# in the token instead of loading the user. A demoted or deactivated admin then
+# keeps admin reads (overall_expenses, the balance sheet) until their token
+# expires, so only turn this on together with a short ACCESS_TOKEN_LIFETIME.
+EXPENSES_STATELESS_READS = False
+
+# In-process cache of users resolved from tokens on the other endpoints. Entries
+# are dropped when the user is saved or deleted in this process, and expire
+# after the TTL (seconds) everywhere else.
+EXPENSES_USER_CACHE_SIZE = 10000
+EXPENSES_USER_CACHE_TTL = 60
+
+# Maximum number of expenses accepted by a single POST /api/expenses/bulk/ request.
+EXPENSES_BULK_MAX_ITEMS = 5000
+
+# Default and maximum page sizes for the cursor-paginated expense listings.
+EXPENSES_PAGE_SIZE = 50
+EXPENSES_MAX_PAGE_SIZE = 500
+
+# ISO 4217 code of the default currency of expenses, in which balances are
+# reported unless a request asks for another one. Amounts are stored as integer
+# cents (see expenses/money.py).
+EXPENSES_CURRENCY = 'USD'
+
+# CSV of exchange rates ("date,currency,rate", one unit of currency in
+# EXPENSES_CURRENCY), re-read when it changes; see expenses/fx.py. Expenses can
+# only be recorded in EXPENSES_CURRENCY and the currencies it lists.
+EXPENSES_FX_RATES_FILE = BASE_DIR / 'fx_rates.csv'
+
+# Expense updates and deletes honour If-Match (see expenses/conditional.py). When
+# True, requests without it are refused with 428 instead of going ahead.
+EXPENSES_REQUIRE_IF_MATCH = False
+
+# /api/expenses/changes/ only returns changes at least this old (seconds). Sequence
+# numbers are handed out at insert time, so on databases with concurrent writers
+# (PostgreSQL) a transaction can commit a lower number after a client has synced
+# past it; a delay longer than any expense write transaction closes that gap.
+# SQLite serializes writes, so no delay is needed.
+EXPENSES_CHANGES_SETTLE_SECONDS = 0
+
+# Report jobs (see expenses/reports.py). A job RUNNING for longer than the timeout
+# (seconds) is assumed to belong to a dead worker and is retried, at most
+# EXPENSES_REPORT_MAX_ATTEMPTS times in total.
+EXPENSES_REPORT_TIMEOUT = 3600
+EXPENSES_REPORT_MAX_ATTEMPTS = 3
+
+# Request metrics (see expenses/metrics.py), served in the Prometheus text format
+# at /metrics. When EXPENSES_METRICS_TOKEN is set, scrapers must send it as
+# "Authorization: Bearer <token>"; while it is unset, only admins can read
+# /metrics, with their JWT.
+EXPENSES_METRICS_TOKEN = None
+# Adds a Server-Timing header (time in SQL, the rest of the request and the total)
+# to every response, for browser dev tools. Off by default as it reveals timings.
+EXPENSES_SERVER_TIMING = False
+# Queries and requests slower than these (milliseconds) are logged as warnings to
+# the expenses.sql and expenses.requests loggers. None turns a log off.
+EXPENSES_SLOW_QUERY_MS = 100
+EXPENSES_SLOW_REQUEST_MS = 1000
+# Characters of SQL included in a slow query log line.
+EXPENSES_SLOW_QUERY_SQL_LENGTH = 1000
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Connections are kept open for CONN_MAX_AGE seconds and checked before reuse
+# instead of being opened per request. On PostgreSQL (psycopg 3) use Django's
+# connection pool instead: 'OPTIONS': {'pool': {'min_size': 2, 'max_size': 10}}
+# with CONN_MAX_AGE set to 0.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+# Read replica, configured only when the EXPENSES_REPLICA_DB environment variable
+# names its SQLite file. Locally a copy of the primary stands in for one (cp
+# db.sqlite3 db.replica.sqlite3) and lags until it is copied again.
+EXPENSES_REPLICA_DB = os.environ.get('EXPENSES_REPLICA_DB')
+if EXPENSES_REPLICA_DB:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': EXPENSES_REPLICA_DB,
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
+
+# PRAGMAs run on every new SQLite connection (see expenses/sqlite.py). WAL lets
+# reads proceed during a write. synchronous=normal is safe in WAL mode: a power
+# loss can lose the last commits but never corrupts the file. busy_timeout is in
+# milliseconds. A negative cache_size is in KiB per connection. mmap_size is in
+# bytes. Set to {} to keep SQLite's defaults.
+EXPENSES_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -32000,
+    'mmap_size': 268435456,
+}
+# Expense writes on SQLite start with BEGIN IMMEDIATE and wait up to busy_timeout
+# for the write lock, instead of failing with "database is locked" when another
+# writer got there first.
+EXPENSES_SQLITE_IMMEDIATE_WRITES = True
+
+# Expense retrieve, user_expenses, overall_expenses, the balance sheet exports
+# and analytics read from this DATABASES alias when set (see expenses/routers.py);
+# everything else uses 'default'. Set to 'replica' when EXPENSES_REPLICA_DB is
+# given. After a user's own write, their reads stay on 'default' for
+# EXPENSES_REPLICA_STICKY_SECONDS, which should exceed the replica's lag.
+DATABASE_ROUTERS = ['expenses.routers.ReadReplicaRouter']
+EXPENSES_READ_REPLICA = 'replica' if EXPENSES_REPLICA_DB else None
+EXPENSES_REPLICA_STICKY_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# Expense payloads and balance summaries are cached in their own alias (see
+# expenses/caching.py). Point it at a shared backend such as
+# django.core.cache.backends.redis.RedisCache when running several workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'expenses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'expenses',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
 
+EXPENSES_CACHE_ALIAS = 'expenses'
+# Seconds a cached expense or balance summary may be served before it is rebuilt.
+EXPENSES_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -132,6 +264,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded and generated files; finished report jobs are stored under reports/.
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -17,16 +17,30 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from expenses.views import UserViewSet, ExpenseViewSet
+from expenses.views import (
+    UserViewSet, ExpenseViewSet, BalanceViewSet, ReportJobViewSet, GroupViewSet, AnalyticsViewSet, metrics_view,
+)
+from expenses import async_views
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
 router.register(r'expenses', ExpenseViewSet)
+router.register(r'balances', BalanceViewSet, basename='balance')
+router.register(r'reports', ReportJobViewSet)
+router.register(r'groups', GroupViewSet)
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metrics', metrics_view, name='metrics'),
+    # Async-native read endpoints for ASGI deployments (see expenses/async_views.py).
+    path('api/async/expenses/<int:pk>/', async_views.expense_detail, name='async_expense_detail'),
+    path('api/async/expenses/user_expenses/', async_views.user_expenses, name='async_user_expenses'),
+    path('api/async/expenses/download_balance_sheet/', async_views.download_balance_sheet,
+         name='async_download_balance_sheet'),
+    path('api/async/balances/', async_views.balances, name='async_balances'),
 ]
\ No newline at end of file
@@ -0,0 +1,107 @@
+# expenses/allocation.py
+# Splitting an expense amount between participants, in integer cents so the
+# shares always add up to the total exactly. Kept free of Django so it can be
+# used from serializers, management commands and benchmarks alike.
+from decimal import Decimal
+
+# Per-split input each split type allocates from, as named on ExpenseSplit.
+# EQUAL needs none.
+VALUE_FIELDS = {
+    'EXACT': 'amount_cents',
+    'PERCENTAGE': 'percentage',
+    'SHARES': 'shares',
+    'ADJUSTMENT': 'adjustment_cents',
+}
+
+# Percentages are handled as basis points (1% == 100), so two decimal places of
+# percentage are exact integers too.
+FULL_PERCENTAGE = 10000
+
+
+def to_cents(amount):
+    # Decimal('12.34') -> 1234. Works for amounts and two-decimal percentages alike;
+    # amounts arriving through the API are parsed by money.parse_cents instead.
+    cents = Decimal(amount).scaleb(2)
+    if cents != cents.to_integral_value():
+        raise ValueError(f'{amount} has more than two decimal places')
+    return int(cents)
+
+
+def equal(total, count):
+    # Equal shares; the leftover cents go to the first participants, so the
+    # result matches largest_remainder() with equal weights.
+    base, leftover = divmod(total, count)
+    return [base + 1] * leftover + [base] * (count - leftover)
+
+
+def largest_remainder(total, weights):
+    # Shares proportional to `weights` (non-negative ints). Every share is rounded
+    # down, then the cents still missing go one each to the shares with the
+    # largest remainders, ties broken by position (Hamilton's method).
+    weight_sum = sum(weights)
+    sign = -1 if total < 0 else 1
+    total = abs(total)
+
+    shares, remainders = [], []
+    for weight in weights:
+        share, remainder = divmod(total * weight, weight_sum)
+        shares.append(share)
+        remainders.append(remainder)
+
+    leftover = total - sum(shares)
+    if leftover:
+        # sorted() is stable, so equal remainders keep their original order.
+        for index in sorted(range(len(weights)), key=remainders.__getitem__, reverse=True)[:leftover]:
+            shares[index] += 1
+    return [sign * share for share in shares]
+
+
+def check(split_type, total, values):
+    # Raises ValueError when `values` cannot be allocated under `split_type`.
+    if not values:
+        raise ValueError('An expense needs at least one split')
+    if split_type == 'EXACT':
+        if sum(values) != total:
+            raise ValueError('Sum of split amounts must equal the total expense amount')
+    elif split_type == 'PERCENTAGE':
+        if sum(values) != FULL_PERCENTAGE:
+            raise ValueError('Sum of percentages must be 100%')
+        if min(values) < 0:
+            raise ValueError('Percentages cannot be negative')
+    elif split_type == 'SHARES':
+        if min(values) < 0 or not sum(values):
+            raise ValueError('Shares must be non-negative and not all zero')
+    elif split_type == 'ADJUSTMENT':
+        if sum(values) > total:
+            raise ValueError('Adjustments cannot exceed the total expense amount')
+        if min(values) + (total - sum(values)) // len(values) < 0:
+            raise ValueError('Adjustments cannot make a split negative')
+    elif split_type != 'EQUAL':
+        raise ValueError(f'Unknown split type: {split_type}')
+
+
+def shares(split_type, total, values):
+    # Split amounts in cents for already checked input. `values` are cents for
+    # EXACT and ADJUSTMENT, basis points for PERCENTAGE and share counts for SHARES.
+    if split_type == 'EQUAL':
+        return equal(total, len(values))
+    if split_type == 'EXACT':
+        return list(values)
+    if split_type in ('PERCENTAGE', 'SHARES'):
+        return largest_remainder(total, values)
+    # ADJUSTMENT: each participant pays their adjustment plus an equal part of
+    # what is left.
+    return [adjustment + share for adjustment, share in zip(values, equal(total - sum(values), len(values)))]
+
+
+def allocate(split_type, total, values):
+    check(split_type, total, values)
+    return shares(split_type, total, values)
+
+
+def allocate_many(rows):
+    # Batch mode for bulk writes: `rows` is an iterable of (split_type, total,
+    # values) in cents, already checked. Yields one list of split cents per row.
+    # Everything stays in Python ints; no Decimal is created per split.
+    for split_type, total, values in rows:
+        yield shares(split_type, total, values)
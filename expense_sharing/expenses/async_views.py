@@ -0,0 +1,124 @@
+# expenses/async_views.py
+"""Async-native versions of the hot read endpoints, mounted under /api/async/.
+
+Served by an ASGI server (expense_sharing.asgi) these run on the event loop
+instead of occupying a thread per request. Database access goes through
+Django's async ORM interface, which still executes queries in a worker thread,
+so the gain is in connections waiting on the network (slow clients, streamed
+exports) rather than in query throughput. Responses match their DRF
+counterparts in expenses.views.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, PermissionDenied
+from rest_framework.request import Request
+from rest_framework_simplejwt.models import TokenUser
+
+from . import caching, conditional, ledger, routers
+from .authentication import CachedJWTAuthentication, has_user_claims
+from .exports import aiter_balance_sheet, balance_sheet_queryset
+from .models import Expense
+from .pagination import KeysetPagination
+from .permissions import IsExpenseOwner
+from .serializers import BalanceSummarySerializer, ExpenseSerializer
+from .views import conversion_params, converting
+
+
+async def authenticate(request):
+    # Same rules as the DRF views' safe methods: token claims when present and
+    # settings.EXPENSES_STATELESS_READS is on, otherwise the cached user lookup
+    # (run in a thread, as it may hit the database), which rejects inactive users
+    # and reads is_staff from the database.
+    authenticator = CachedJWTAuthentication()
+    header = authenticator.get_header(request)
+    raw_token = authenticator.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        raise NotAuthenticated()
+    validated_token = authenticator.get_validated_token(raw_token)
+    if settings.EXPENSES_STATELESS_READS and has_user_claims(validated_token):
+        return TokenUser(validated_token)
+    return await sync_to_async(authenticator.get_user)(validated_token)
+
+
+def async_api_view(view):
+    # Authenticates the request, passes the user to the view and renders DRF
+    # exceptions the way DRF would.
+    @require_GET
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user = await authenticate(request)
+            return await view(request, user, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            return JsonResponse(detail, status=exc.status_code, safe=False)
+
+    return wrapper
+
+
+@async_api_view
+async def expense_detail(request, user, pk):
+    cached = await caching.aget_expense(pk)
+    if cached is None:
+        alias = await routers.aread_alias(user.pk)
+        try:
+            expense = await Expense.objects.with_splits().using(alias).aget(pk=pk)
+        except Expense.DoesNotExist:
+            raise NotFound()
+        cached = {'created_by': expense.created_by_id, 'data': ExpenseSerializer(expense).data}
+        # As in ExpenseViewSet.retrieve: replica reads are cached only while it may lag.
+        timeout = settings.EXPENSES_REPLICA_STICKY_SECONDS if alias != DEFAULT_DB_ALIAS else None
+        await caching.aset_expense(pk, cached, timeout)
+
+    if cached['created_by'] != user.pk:
+        raise PermissionDenied(IsExpenseOwner.message)
+    version = cached['data']['version']
+    if conditional.not_modified(request, version):
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(cached['data'])
+    response['ETag'] = conditional.etag(version)
+    return response
+
+
+@async_api_view
+async def user_expenses(request, user):
+    paginator = KeysetPagination()
+    alias = await routers.aread_alias(user.pk)
+    page = await paginator.apaginate_queryset(
+        Expense.objects.with_splits().using(alias).filter(created_by_id=user.pk), Request(request)
+    )
+    return JsonResponse({'next': paginator.get_next_link(), 'results': ExpenseSerializer(page, many=True).data})
+
+
+@async_api_view
+async def balances(request, user):
+    # As BalanceViewSet.list: only the default conversion is cached.
+    currency, on = conversion_params(Request(request))
+    default = currency is None and on is None
+    cached = await caching.aget_balances(user.pk) if default else None
+    if cached is not None:
+        return JsonResponse(cached)
+
+    with converting():
+        balances = await ledger.anet_balances(user.pk, currency, on)
+    data = BalanceSummarySerializer(ledger.balance_summary(user.pk, balances, currency)).data
+    if default:
+        await caching.aset_balances(user.pk, data)
+    return JsonResponse(data)
+
+
+@async_api_view
+async def download_balance_sheet(request, user):
+    if not user.is_staff:
+        raise PermissionDenied()
+    currency, _ = conversion_params(Request(request))
+    queryset = balance_sheet_queryset().using(await routers.aread_alias(user.pk))
+    response = StreamingHttpResponse(aiter_balance_sheet(queryset, currency=currency), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="balance_sheet.csv"'
+    return response
@@ -0,0 +1,105 @@
+# expenses/authentication.py
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+# Claims added to every token by ClaimsTokenObtainPairSerializer. A token carrying
+# all of them can be trusted on read-only endpoints without loading the user.
+USER_CLAIMS = ('username', 'is_staff')
+
+
+def has_user_claims(validated_token):
+    return api_settings.USER_ID_CLAIM in validated_token and all(claim in validated_token for claim in USER_CLAIMS)
+
+
+class TTLCache:
+    """Thread-safe in-process cache bounded both by size (least recently used
+    entries are evicted first) and by age."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+user_cache = TTLCache(settings.EXPENSES_USER_CACHE_SIZE, settings.EXPENSES_USER_CACHE_TTL)
+
+
+def invalidate_user(user_id):
+    # Only affects this process; other workers drop the entry after
+    # EXPENSES_USER_CACHE_TTL seconds.
+    user_cache.delete(user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # Resolves the token's user through user_cache, so repeated requests from the
+    # same user skip the User query until the entry expires or is invalidated.
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = user_cache.get(user_id) if user_id is not None else None
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+        # Hand out a copy so one request cannot leak changes into another.
+        return copy.copy(user)
+
+
+class TokenClaimsJWTAuthentication(CachedJWTAuthentication):
+    # Builds request.user from the signed id/username/is_staff claims without any
+    # database access. Tokens issued before the claims were added fall back to the
+    # cached lookup.
+
+    def get_user(self, validated_token):
+        if has_user_claims(validated_token):
+            return TokenUser(validated_token)
+        return super().get_user(validated_token)
+
+
+class StatelessReadsMixin:
+    # For viewsets: authenticate GET/HEAD/OPTIONS requests from token claims when
+    # settings.EXPENSES_STATELESS_READS is on. Views using this must only rely on
+    # request.user.id / .pk / .username / .is_staff for safe methods.
+
+    def get_authenticators(self):
+        if settings.EXPENSES_STATELESS_READS and self.request.method in SAFE_METHODS:
+            return [TokenClaimsJWTAuthentication()]
+        return super().get_authenticators()
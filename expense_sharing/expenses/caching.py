@@ -0,0 +1,114 @@
+# expenses/caching.py
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Serialized expense payloads and per-user balance summaries, stored in the cache
+# alias named by settings.EXPENSES_CACHE_ALIAS. Any Django cache backend works;
+# entries expire after settings.EXPENSES_CACHE_TIMEOUT and eviction is left to the
+# backend (LocMemCache culls least recently used entries, Redis should run with
+# an allkeys-lru maxmemory policy).
+
+# v2: payloads include the version used as ETag. v3: and the currency.
+EXPENSE_KEY = 'expense:v3:{}'
+BALANCES_KEY = 'balances:{}'
+
+# Hit/miss counters are per process so that counting never costs a cache round-trip.
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[settings.EXPENSES_CACHE_ALIAS]
+
+
+def _record(kind, hit):
+    with _stats_lock:
+        _stats[(kind, 'hits' if hit else 'misses')] += 1
+
+
+def stats():
+    with _stats_lock:
+        snapshot = dict(_stats)
+    result = {}
+    for kind in ('expense', 'balances'):
+        hits, misses = snapshot.get((kind, 'hits'), 0), snapshot.get((kind, 'misses'), 0)
+        total = hits + misses
+        result[kind] = {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+    return result
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _get(kind, key):
+    value = get_cache().get(key)
+    _record(kind, value is not None)
+    return value
+
+
+async def _aget(kind, key):
+    value = await get_cache().aget(key)
+    _record(kind, value is not None)
+    return value
+
+
+def _invalidate(keys):
+    # Delete now, and again once the surrounding transaction commits, so a reader
+    # that repopulated the entry from pre-commit data does not leave it stale.
+    keys = list(keys)
+    if not keys:
+        return
+    get_cache().delete_many(keys)
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def get_expense(expense_id):
+    return _get('expense', EXPENSE_KEY.format(expense_id))
+
+
+def set_expense(expense_id, payload, timeout=None):
+    get_cache().set(EXPENSE_KEY.format(expense_id), payload, settings.EXPENSES_CACHE_TIMEOUT if timeout is None else timeout)
+
+
+async def aget_expense(expense_id):
+    return await _aget('expense', EXPENSE_KEY.format(expense_id))
+
+
+async def aset_expense(expense_id, payload, timeout=None):
+    await get_cache().aset(EXPENSE_KEY.format(expense_id), payload, settings.EXPENSES_CACHE_TIMEOUT if timeout is None else timeout)
+
+
+def invalidate_expenses(expense_ids):
+    _invalidate(EXPENSE_KEY.format(expense_id) for expense_id in expense_ids)
+
+
+def get_balances(user_id):
+    return _get('balances', BALANCES_KEY.format(user_id))
+
+
+def set_balances(user_id, payload):
+    get_cache().set(BALANCES_KEY.format(user_id), payload, settings.EXPENSES_CACHE_TIMEOUT)
+
+
+async def aget_balances(user_id):
+    return await _aget('balances', BALANCES_KEY.format(user_id))
+
+
+async def aset_balances(user_id, payload):
+    await get_cache().aset(BALANCES_KEY.format(user_id), payload, settings.EXPENSES_CACHE_TIMEOUT)
+
+
+def invalidate_balances(user_ids):
+    _invalidate(BALANCES_KEY.format(user_id) for user_id in user_ids)
+
+
+def clear():
+    # Used after bulk rewrites such as a ledger rebuild. The cache alias should be
+    # dedicated to this module.
+    get_cache().clear()
@@ -0,0 +1,66 @@
+# expenses/cascades.py
+from django.db.models import Q
+
+from . import caching, changes, rollups
+from .models import Expense
+from .sqlite import write_transaction
+
+# Deleting a group or a user cascades to expenses and splits in the database,
+# past the bookkeeping ExpenseViewSet.perform_destroy does for each expense.
+# The functions here bring the derived tables in line first, in the transaction
+# of the delete: spending rollups are reverted and the change feed gets
+# tombstones, so delta sync clients drop the expenses. The ledger needs nothing:
+# its rows reference the group and both users, so they cascade too.
+
+
+def expenses_with_splits(expenses):
+    return [(expense, list(expense.splits.all())) for expense in expenses.prefetch_related('splits')]
+
+
+def participant_ids(rows):
+    return {
+        user_id
+        for expense, splits in rows
+        for user_id in (expense.created_by_id, *(split.user_id for split in splits))
+    }
+
+
+def forget_expenses(deleted, gone_user_id=None):
+    # deleted: [(expense, splits)] about to be removed by a cascade. Rollup rows
+    # and feed entries of `gone_user_id` are themselves deleted, so they are left
+    # alone.
+    deltas = rollups.new_deltas()
+    for expense, splits in deleted:
+        rollups.expense_deltas(expense, splits, sign=-1, deltas=deltas)
+    rollups.apply_deltas({key: values for key, values in deltas.items() if key[2] != gone_user_id})
+    changes.apply({
+        (expense.id, user_id): True
+        for expense, splits in deleted
+        for user_id in changes.participants(expense, splits) - {gone_user_id}
+    })
+    caching.invalidate_expenses(expense.id for expense, _ in deleted)
+    caching.invalidate_balances(participant_ids(deleted))
+
+
+def delete_group(group):
+    with write_transaction():
+        forget_expenses(expenses_with_splits(Expense.objects.filter(group_id=group.pk)))
+        group.delete()
+
+
+def delete_user(user):
+    # The expenses the user created, and those of the groups they created
+    # (Group.created_by cascades as well), are deleted. Other expenses they took
+    # part in lose their split.
+    with write_transaction():
+        created = Q(created_by_id=user.pk) | Q(group__created_by_id=user.pk)
+        forget_expenses(expenses_with_splits(Expense.objects.filter(created)), gone_user_id=user.pk)
+        changed = expenses_with_splits(Expense.objects.filter(splits__user_id=user.pk).exclude(created).distinct())
+        changes.apply({
+            (expense.id, user_id): False
+            for expense, splits in changed
+            for user_id in changes.participants(expense, splits) - {user.pk}
+        })
+        caching.invalidate_expenses(expense.id for expense, _ in changed)
+        caching.invalidate_balances(participant_ids(changed))
+        user.delete()
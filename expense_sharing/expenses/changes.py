@@ -0,0 +1,75 @@
+# expenses/changes.py
+from django.db import transaction
+from django.db.models import Q
+
+from .conflicts import retry_on_conflict
+from .models import Expense, ExpenseChange, ExpenseSplit
+
+# The change feed: for each user, one ExpenseChange row per expense they take
+# part in (as creator or with a split), re-inserted on every write so its id,
+# the change sequence, grows. Users who drop out of an expense, and everyone
+# when it is deleted, get a tombstone instead. Every expense write records its
+# changes here next to the balance ledger and spending rollups.
+
+
+def participants(expense, splits):
+    return {expense.created_by_id, *(split.user_id for split in splits)}
+
+
+@retry_on_conflict
+def apply(changes, replace=True):
+    # changes: {(expense_id, user_id): deleted}. Existing rows for the same pairs
+    # are deleted first, unless the expenses are new (replace=False).
+    if not changes:
+        return
+    if replace:
+        by_expense = {}
+        for expense_id, user_id in changes:
+            by_expense.setdefault(expense_id, []).append(user_id)
+        pairs = Q()
+        for expense_id, user_ids in by_expense.items():
+            pairs |= Q(expense_id=expense_id, user_id__in=user_ids)
+        ExpenseChange.objects.filter(pairs).delete()
+    ExpenseChange.objects.bulk_create([
+        ExpenseChange(expense_id=expense_id, user_id=user_id, deleted=deleted)
+        for (expense_id, user_id), deleted in changes.items()
+    ])
+
+
+def record_expense(expense, splits):
+    apply({(expense.id, user_id): False for user_id in participants(expense, splits)}, replace=False)
+
+
+def record_expenses(expenses_with_splits):
+    changes = {}
+    for expense, splits in expenses_with_splits:
+        changes.update({(expense.id, user_id): False for user_id in participants(expense, splits)})
+    apply(changes, replace=False)
+
+
+def replace_expense(expense, old_splits, new_splits):
+    # Everyone still taking part sees the update, users who dropped out a tombstone.
+    current = participants(expense, new_splits)
+    changes = {(expense.id, user_id): True for user_id in participants(expense, old_splits) - current}
+    changes.update({(expense.id, user_id): False for user_id in current})
+    apply(changes)
+
+
+def revert_expense(expense, splits):
+    apply({(expense.id, user_id): True for user_id in participants(expense, splits)})
+
+
+def rebuild(batch_size=1000):
+    # Re-creates the feed from Expense and ExpenseSplit, for backfills. Tombstones
+    # are lost, so clients that synced before must start again from since=0.
+    with transaction.atomic():
+        ExpenseChange.objects.all().delete()
+        pairs = {
+            *Expense.objects.values_list('id', 'created_by_id').iterator(),
+            *ExpenseSplit.objects.values_list('expense_id', 'user_id').iterator(),
+        }
+        ExpenseChange.objects.bulk_create(
+            (ExpenseChange(expense_id=expense_id, user_id=user_id) for expense_id, user_id in sorted(pairs)),
+            batch_size=batch_size,
+        )
+    return len(pairs)
@@ -0,0 +1,49 @@
+# expenses/conditional.py
+from django.conf import settings
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Conditional requests on expenses. The ETag of an expense is its version, which
+# every update and delete through the API compares and increments atomically
+# (ExpenseQuerySet.bump_version), so concurrent writers cannot overwrite each
+# other: the loser gets 412 and has to re-read the expense.
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The expense has been modified since you read it'
+    default_code = 'precondition_failed'
+
+
+class PreconditionRequired(APIException):
+    status_code = status.HTTP_428_PRECONDITION_REQUIRED
+    default_detail = 'Send the ETag of the expense in an If-Match header'
+    default_code = 'precondition_required'
+
+
+def etag(version):
+    return quote_etag(str(version))
+
+
+def check_if_match(request, version):
+    # Raises unless If-Match names the current version (or is "*"). Without the
+    # header the write goes ahead, unless settings.EXPENSES_REQUIRE_IF_MATCH is on.
+    header = request.headers.get('If-Match')
+    if header is None:
+        if settings.EXPENSES_REQUIRE_IF_MATCH:
+            raise PreconditionRequired()
+        return
+    etags = parse_etags(header)
+    # Strong comparison: weak validators never match If-Match.
+    if etags != ['*'] and etag(version) not in etags:
+        raise PreconditionFailed()
+
+
+def not_modified(request, version):
+    # True when If-None-Match names the current version; weak comparison.
+    header = request.headers.get('If-None-Match')
+    if header is None:
+        return False
+    etags = [tag.removeprefix('W/') for tag in parse_etags(header)]
+    return etags == ['*'] or etag(version) in etags
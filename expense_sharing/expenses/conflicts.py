@@ -0,0 +1,38 @@
+# expenses/conflicts.py
+from functools import wraps
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+
+# The balance ledger, spending rollups and change feed update the rows they
+# find under a lock and insert the ones that are missing. Two transactions can
+# both find the same key missing; once the first commits, the second's insert
+# fails on the unique constraint. Retrying in a fresh savepoint then finds the
+# row and updates it instead.
+
+ATTEMPTS = 3
+
+
+def retry_on_conflict(func):
+    # func must be safe to run again: it is retried from the start, and its
+    # writes in the failed attempt are rolled back.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, ATTEMPTS + 1):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except IntegrityError:
+                if attempt == ATTEMPTS:
+                    raise
+    return wrapper
+
+
+def lock_table(model, using=None):
+    # For rebuilds, which read the expenses and rewrite `model` wholesale: other
+    # writers of `model` wait until the transaction ends, so none of their
+    # changes can fall between the read and the rewrite. On SQLite,
+    # write_transaction() already holds the database's write lock.
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {connection.ops.quote_name(model._meta.db_table)} IN EXCLUSIVE MODE')
@@ -0,0 +1,103 @@
+# expenses/exports.py
+import csv
+
+from django.db.models import Prefetch
+
+from . import fx
+from .models import Expense, ExpenseSplit
+from .money import format_cents
+
+# Group is the id of the expense's group, empty for expenses outside any group.
+BALANCE_SHEET_HEADER = ['Title', 'Amount', 'Currency', 'Split Type', 'Created By', 'Created At', 'Split Info', 'Group']
+
+# Number of expenses fetched per round-trip while streaming. Each chunk costs a
+# fixed number of queries (expenses + creators, then splits + users).
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object whose write() returns the value instead of storing it,
+    so csv.writer can be used to produce one line at a time."""
+
+    def write(self, value):
+        return value
+
+
+def balance_sheet_queryset():
+    splits = ExpenseSplit.objects.select_related('user').order_by('id')
+    return (
+        Expense.objects
+        .select_related('created_by')
+        .prefetch_related(Prefetch('splits', queryset=splits))
+        .order_by('id')
+    )
+
+
+def format_split(split):
+    # "alice: 50.00 (None%)", followed by " shares=2" and " adjustment=5.00" when
+    # the split has them, so SHARES and ADJUSTMENT expenses keep their input.
+    text = f"{split.user.username}: {format_cents(split.amount_cents)} ({split.percentage}%)"
+    if split.shares is not None:
+        text += f" shares={split.shares}"
+    if split.adjustment_cents is not None:
+        text += f" adjustment={format_cents(split.adjustment_cents)}"
+    return text
+
+
+def format_split_info(splits):
+    return "; ".join(format_split(split) for split in splits)
+
+
+def balance_sheet_header(currency=None):
+    return BALANCE_SHEET_HEADER + [f'Amount ({currency})'] if currency else BALANCE_SHEET_HEADER
+
+
+def converted_amount(expense, table, currency):
+    # The amount in `currency` at the rate of the expense's date; empty when the
+    # rates file has no rate for that date.
+    try:
+        return format_cents(table.convert(expense.amount_cents, expense.currency, currency, fx.rate_date(expense.created_at)))
+    except fx.UnknownRate:
+        return ''
+
+
+def balance_sheet_row(expense, table=None, currency=None):
+    row = [
+        expense.title,
+        format_cents(expense.amount_cents),
+        expense.currency,
+        expense.get_split_type_display(),
+        expense.created_by.username,
+        expense.created_at,
+        format_split_info(expense.splits.all()),
+        expense.group_id or '',
+    ]
+    if currency:
+        row.append(converted_amount(expense, table, currency))
+    return row
+
+
+def iter_balance_sheet(queryset=None, chunk_size=EXPORT_CHUNK_SIZE, currency=None):
+    # Yields the balance sheet as CSV lines. iterator() keeps only one chunk of
+    # expenses (and their prefetched splits) in memory at a time. With `currency`,
+    # a last column holds every amount converted into it.
+    if queryset is None:
+        queryset = balance_sheet_queryset()
+
+    table = fx.rate_table() if currency else None
+    writer = csv.writer(Echo())
+    yield writer.writerow(balance_sheet_header(currency))
+    for expense in queryset.iterator(chunk_size=chunk_size):
+        yield writer.writerow(balance_sheet_row(expense, table, currency))
+
+
+async def aiter_balance_sheet(queryset=None, chunk_size=EXPORT_CHUNK_SIZE, currency=None):
+    # Async variant of iter_balance_sheet for StreamingHttpResponse under ASGI.
+    if queryset is None:
+        queryset = balance_sheet_queryset()
+
+    table = fx.rate_table() if currency else None
+    writer = csv.writer(Echo())
+    yield writer.writerow(balance_sheet_header(currency))
+    async for expense in queryset.aiterator(chunk_size=chunk_size):
+        yield writer.writerow(balance_sheet_row(expense, table, currency))
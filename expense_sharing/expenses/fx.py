@@ -0,0 +1,131 @@
+# expenses/fx.py
+import csv
+import datetime
+import os
+import threading
+from bisect import bisect_right
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.utils import timezone
+
+# Exchange rates come from a local CSV file (settings.EXPENSES_FX_RATES_FILE),
+# never from a live service. Each line "date,currency,rate" says that one unit
+# of `currency` is worth `rate` units of settings.EXPENSES_CURRENCY from that
+# date until the next rate of the same currency. Rates between any two
+# currencies are derived from those.
+#
+# The file is read once per process and held in memory, indexed by currency and
+# date, and read again when it changes on disk. Conversions never query the
+# database, and each (currency, date) pair is resolved once, so converting
+# millions of amounts costs one dict lookup per amount.
+
+RATES_HEADER = ['date', 'currency', 'rate']
+
+# Rates are held as ints scaled by this, so conversions stay in integer math.
+RATE_SCALE = 10 ** 12
+
+
+class UnknownRate(LookupError):
+    pass
+
+
+def _round_div(numerator, denominator):
+    # Rounds half away from zero, as amounts are rounded to cents elsewhere.
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if 2 * remainder >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+class RateTable:
+    def __init__(self, reference, rates):
+        # rates: {currency: [(date, Decimal rate), ...]}, in any order.
+        self.reference = reference
+        self._dates = {}
+        self._rates = {}
+        for currency, entries in rates.items():
+            entries = sorted(entries)
+            self._dates[currency] = [date for date, _ in entries]
+            self._rates[currency] = [int(rate * RATE_SCALE) for _, rate in entries]
+        self._resolved = {}
+
+    @classmethod
+    def from_csv(cls, lines, reference):
+        rates = {}
+        reader = csv.reader(lines)
+        if next(reader, None) != RATES_HEADER:
+            raise ValueError(f"Expected header {','.join(RATES_HEADER)}")
+        for line, row in enumerate(reader, start=2):
+            try:
+                date, currency, rate = row
+                rate = Decimal(rate)
+                if rate <= 0:
+                    raise ValueError()
+                rates.setdefault(currency.upper(), []).append((datetime.date.fromisoformat(date), rate))
+            except (ValueError, InvalidOperation):
+                raise ValueError(f'Invalid exchange rate on line {line}: {row!r}')
+        rates.pop(reference, None)
+        return cls(reference, rates)
+
+    @property
+    def currencies(self):
+        return {self.reference, *self._dates}
+
+    def rate(self, currency, on):
+        # Value of one unit of `currency` in the reference currency on date `on`,
+        # scaled by RATE_SCALE: the latest rate on or before that date.
+        key = (currency, on)
+        rate = self._resolved.get(key)
+        if rate is None:
+            if currency == self.reference:
+                rate = RATE_SCALE
+            else:
+                dates = self._dates.get(currency)
+                index = bisect_right(dates, on) - 1 if dates else -1
+                if index < 0:
+                    raise UnknownRate(f'No {currency} exchange rate on or before {on}')
+                rate = self._rates[currency][index]
+            self._resolved[key] = rate
+        return rate
+
+    def convert(self, cents, from_currency, to_currency, on):
+        if from_currency == to_currency or not cents:
+            return cents
+        return _round_div(cents * self.rate(from_currency, on), self.rate(to_currency, on))
+
+
+_lock = threading.Lock()
+_loaded = {'key': None, 'table': None}
+
+
+def rate_table():
+    # The RateTable of the configured file, re-read when its path, size or
+    # modification time changes. Without a file only same-currency conversions work.
+    path = settings.EXPENSES_FX_RATES_FILE
+    try:
+        stat = os.stat(path) if path else None
+    except FileNotFoundError:
+        stat = None
+    key = (path, settings.EXPENSES_CURRENCY, stat and (stat.st_mtime_ns, stat.st_size))
+    if _loaded['key'] != key:
+        with _lock:
+            if _loaded['key'] != key:
+                if stat is None:
+                    table = RateTable(settings.EXPENSES_CURRENCY, {})
+                else:
+                    with open(path, newline='') as lines:
+                        table = RateTable.from_csv(lines, settings.EXPENSES_CURRENCY)
+                _loaded['table'], _loaded['key'] = table, key
+    return _loaded['table']
+
+
+def check_currency(currency):
+    # Raises ValueError unless amounts in `currency` can be converted.
+    if currency not in rate_table().currencies:
+        raise ValueError(f'Unknown currency {currency!r}; add its exchange rates to the rates file')
+
+
+def rate_date(moment):
+    # Expenses are converted at the rate of the day they were created.
+    return timezone.localtime(moment).date()
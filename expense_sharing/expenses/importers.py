@@ -0,0 +1,298 @@
+# expenses/importers.py
+import csv
+import re
+import time
+from decimal import Decimal, InvalidOperation
+from typing import NamedTuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils.dateparse import parse_datetime
+
+from . import allocation, changes, fx, ledger, rollups
+from .exports import BALANCE_SHEET_HEADER
+from .models import Expense, ExpenseSplit, GroupMembership
+from .money import parse_cents
+from .sqlite import write_transaction
+
+# Rows parsed, looked up and inserted per transaction. Memory use is bounded by
+# this, not by the size of the file.
+IMPORT_CHUNK_SIZE = 1000
+
+# Only the first errors are kept so a badly broken file cannot exhaust memory.
+MAX_REPORTED_ERRORS = 100
+
+SPLIT_INFO_RE = re.compile(
+    r'^(?P<username>.+?): (?P<amount>\S+) \((?P<percentage>\S+)%\)'
+    r'(?: shares=(?P<shares>\S+))?(?: adjustment=(?P<adjustment>\S+))?$'
+)
+SPLIT_TYPES = {label: value for value, label in Expense.SPLIT_CHOICES}
+SPLIT_TYPES.update({value: value for value, _ in Expense.SPLIT_CHOICES})
+
+# Balance sheets exported before expenses had a group, whose expenses are
+# imported outside any group, and before they had a currency, whose amounts are
+# imported in settings.EXPENSES_CURRENCY.
+UNGROUPED_HEADER = [column for column in BALANCE_SHEET_HEADER if column != 'Group']
+LEGACY_HEADER = [column for column in UNGROUPED_HEADER if column != 'Currency']
+HEADERS = (BALANCE_SHEET_HEADER, UNGROUPED_HEADER, LEGACY_HEADER)
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    @property
+    def seconds(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        seconds = self.seconds
+        return self.rows / seconds if seconds else 0.0
+
+    def add_error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+        }
+
+
+def parse_decimal(value, field):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'Invalid {field}: {value!r}')
+
+
+def parse_amount(value, field):
+    try:
+        return parse_cents(value)
+    except ValueError:
+        raise ValueError(f'Invalid {field}: {value!r}')
+
+
+def parse_shares(value):
+    if not value.isdigit():
+        raise ValueError(f'Invalid split shares: {value!r}')
+    return int(value)
+
+
+class ParsedSplit(NamedTuple):
+    username: str
+    cents: int
+    percentage: Decimal | None
+    shares: int | None
+    adjustment_cents: int | None
+
+
+def parse_split_info(value):
+    # "alice: 50.00 (None%) shares=2; bob: 30.00 (37.50%)" -> [ParsedSplit]
+    splits = []
+    for part in value.split('; ') if value else []:
+        match = SPLIT_INFO_RE.match(part)
+        if not match:
+            raise ValueError(f'Invalid split: {part!r}')
+        percentage, shares, adjustment = match['percentage'], match['shares'], match['adjustment']
+        splits.append(ParsedSplit(
+            match['username'],
+            parse_amount(match['amount'], 'split amount'),
+            None if percentage == 'None' else parse_decimal(percentage, 'split percentage'),
+            None if shares is None else parse_shares(shares),
+            None if adjustment is None else parse_amount(adjustment, 'split adjustment'),
+        ))
+    return splits
+
+
+def fill_legacy_inputs(split_type, splits):
+    # Split Info exported before it carried shares and adjustments has neither.
+    # Each split's amount then stands in for them, which allocates back to the
+    # same amounts.
+    if split_type == 'SHARES' and all(split.shares is None for split in splits):
+        return [split._replace(shares=split.cents) for split in splits]
+    if split_type == 'ADJUSTMENT' and all(split.adjustment_cents is None for split in splits):
+        return [split._replace(adjustment_cents=split.cents) for split in splits]
+    return splits
+
+
+def parse_currency(value):
+    currency = value.upper()
+    try:
+        fx.check_currency(currency)
+    except ValueError as error:
+        raise ValueError(str(error))
+    return currency
+
+
+def parse_group(value):
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'Invalid group: {value!r}')
+
+
+def check_splits(split_type, total, splits):
+    # The checks the API runs on new expenses. Amounts are already allocated, so
+    # they must also add up to the total.
+    usernames = [split.username for split in splits]
+    if len(set(usernames)) != len(usernames):
+        raise ValueError('Each user can only have one split')
+    if split_type == 'EXACT':
+        values = [split.cents for split in splits]
+    elif split_type == 'PERCENTAGE':
+        values = [allocation.to_cents(split.percentage or 0) for split in splits]
+    elif split_type == 'SHARES':
+        values = [split.shares for split in splits]
+    elif split_type == 'ADJUSTMENT':
+        values = [split.adjustment_cents for split in splits]
+    else:
+        values = [None] * len(splits)
+    if None in values and split_type != 'EQUAL':
+        field = allocation.VALUE_FIELDS[split_type].replace('_cents', '')
+        raise ValueError(f'Every {split_type} split needs its {field}')
+    allocation.check(split_type, total, values)
+    if sum(split.cents for split in splits) != total:
+        raise ValueError('Sum of split amounts must equal the total expense amount')
+
+
+def parse_row(row, header=BALANCE_SHEET_HEADER):
+    if len(row) != len(header):
+        raise ValueError(f'Expected {len(header)} columns, got {len(row)}')
+    values = dict(zip(header, row))
+    title, amount, split_type = values['Title'], values['Amount'], values['Split Type']
+    created_by, created_at, split_info = values['Created By'], values['Created At'], values['Split Info']
+    currency = parse_currency(values['Currency']) if 'Currency' in values else settings.EXPENSES_CURRENCY
+
+    if split_type not in SPLIT_TYPES:
+        raise ValueError(f'Unknown split type: {split_type!r}')
+    parsed_created_at = parse_datetime(created_at)
+    if parsed_created_at is None:
+        raise ValueError(f'Invalid created at: {created_at!r}')
+
+    amount_cents = parse_amount(amount, 'amount')
+    splits = fill_legacy_inputs(SPLIT_TYPES[split_type], parse_split_info(split_info))
+    check_splits(SPLIT_TYPES[split_type], amount_cents, splits)
+    return {
+        'title': title,
+        'amount_cents': amount_cents,
+        'currency': currency,
+        'split_type': SPLIT_TYPES[split_type],
+        'created_by': created_by,
+        'created_at': parsed_created_at,
+        'splits': splits,
+        'group': parse_group(values.get('Group')),
+    }
+
+
+def import_chunk(rows, result):
+    # rows: [(line, parsed_row)]. Usernames and group members for the whole chunk
+    # are resolved with one query each and everything is written in a single
+    # transaction. Like the API, a group's expenses may only involve its members.
+    usernames = set()
+    for _, row in rows:
+        usernames.add(row['created_by'])
+        usernames.update(split.username for split in row['splits'])
+    user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+    group_ids = {row['group'] for _, row in rows} - {None}
+    members = {}
+    for group_id, user_id in GroupMembership.objects.filter(group_id__in=group_ids).values_list('group_id', 'user_id'):
+        members.setdefault(group_id, set()).add(user_id)
+
+    expenses, splits, created_at = [], [], []
+    for line, row in rows:
+        participants = {row['created_by'], *(split.username for split in row['splits'])}
+        missing = sorted(participants - user_ids.keys())
+        if missing:
+            result.add_error(line, f"Unknown users: {', '.join(missing)}")
+            continue
+        group_id = row['group']
+        if group_id is not None:
+            if group_id not in members:
+                result.add_error(line, f'Unknown group: {group_id}')
+                continue
+            outsiders = sorted(username for username in participants if user_ids[username] not in members[group_id])
+            if outsiders:
+                result.add_error(line, f"Users {', '.join(outsiders)} are not members of group {group_id}")
+                continue
+        expenses.append(Expense(
+            title=row['title'],
+            amount_cents=row['amount_cents'],
+            currency=row['currency'],
+            split_type=row['split_type'],
+            created_by_id=user_ids[row['created_by']],
+            group_id=group_id,
+        ))
+        created_at.append(row['created_at'])
+        splits.append([
+            ExpenseSplit(
+                user_id=user_ids[split.username], amount_cents=split.cents, percentage=split.percentage,
+                shares=split.shares, adjustment_cents=split.adjustment_cents, group_id=group_id,
+            )
+            for split in row['splits']
+        ])
+
+    if not expenses:
+        return
+
+    with write_transaction():
+        Expense.objects.bulk_create(expenses)
+        # created_at is auto_now_add, so bulk_create stamps the current time;
+        # put the exported timestamps back.
+        for expense, timestamp in zip(expenses, created_at):
+            expense.created_at = timestamp
+        Expense.objects.bulk_update(expenses, ['created_at'])
+
+        for expense, expense_splits in zip(expenses, splits):
+            for split in expense_splits:
+                split.expense = expense
+        ExpenseSplit.objects.bulk_create([split for expense_splits in splits for split in expense_splits])
+        ledger.record_expenses(zip(expenses, splits))
+        rollups.record_expenses(zip(expenses, splits))
+        changes.record_expenses(zip(expenses, splits))
+
+    result.imported += len(expenses)
+
+
+def import_balance_sheet(stream, chunk_size=IMPORT_CHUNK_SIZE, on_chunk=None):
+    # Imports a text stream in the format written by exports.iter_balance_sheet
+    # (without a converted amount column), or by one of its older versions (see
+    # HEADERS). `on_chunk(result)` is called after every chunk, e.g. to report
+    # progress.
+    result = ImportResult()
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header not in HEADERS:
+        raise ValueError(f"Expected header {','.join(BALANCE_SHEET_HEADER)}")
+
+    chunk = []
+    for line, row in enumerate(reader, start=2):
+        result.rows += 1
+        try:
+            chunk.append((line, parse_row(row, header)))
+        except ValueError as error:
+            result.add_error(line, str(error))
+        if len(chunk) >= chunk_size:
+            import_chunk(chunk, result)
+            chunk = []
+            if on_chunk:
+                on_chunk(result)
+
+    if chunk:
+        import_chunk(chunk, result)
+        if on_chunk:
+            on_chunk(result)
+    return result
@@ -0,0 +1,206 @@
+# expenses/ledger.py
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from . import caching, fx
+from .conflicts import lock_table, retry_on_conflict
+from .models import Balance, ExpenseSplit
+from .sqlite import write_transaction
+
+# The creator of an expense paid for it, so every other participant owes the
+# creator their split amount. Balances are kept per group, directed (creditor,
+# debtor) pair and currency, keyed (group_id, creditor, debtor, currency) with
+# group_id None for expenses outside any group. Amounts are int cents in their
+# own currency; reads convert them into one currency (see expenses/fx.py) and
+# net them there.
+
+
+def expense_deltas(expense, splits, sign=1, deltas=None):
+    if deltas is None:
+        deltas = defaultdict(int)
+    for split in splits:
+        if split.user_id == expense.created_by_id:
+            continue
+        deltas[(expense.group_id, expense.created_by_id, split.user_id, expense.currency)] += sign * split.amount_cents
+    return deltas
+
+
+@retry_on_conflict
+def apply_deltas(deltas):
+    deltas = {pair: amount for pair, amount in deltas.items() if amount}
+    if not deltas:
+        return
+
+    groups = {group for group, _, _, _ in deltas}
+    creditors = {creditor for _, creditor, _, _ in deltas}
+    debtors = {debtor for _, _, debtor, _ in deltas}
+    currencies = {currency for _, _, _, currency in deltas}
+    in_groups = Q(group_id__in=groups - {None})
+    if None in groups:
+        in_groups |= Q(group__isnull=True)
+
+    existing = (
+        Balance.objects
+        .select_for_update()
+        .filter(in_groups, creditor_id__in=creditors, debtor_id__in=debtors, currency__in=currencies)
+    )
+    to_update = []
+    for balance in existing:
+        key = (balance.group_id, balance.creditor_id, balance.debtor_id, balance.currency)
+        if key in deltas:
+            balance.amount_cents += deltas.pop(key)
+            to_update.append(balance)
+
+    if to_update:
+        Balance.objects.bulk_update(to_update, ['amount_cents'])
+    if deltas:
+        Balance.objects.bulk_create([
+            Balance(group_id=group, creditor_id=creditor, debtor_id=debtor, currency=currency, amount_cents=amount)
+            for (group, creditor, debtor, currency), amount in deltas.items()
+        ])
+    caching.invalidate_balances(creditors | debtors)
+
+
+def record_expense(expense, splits):
+    apply_deltas(expense_deltas(expense, splits))
+
+
+def record_expenses(expenses_with_splits):
+    # Bulk variant of record_expense: deltas for all expenses are merged so each
+    # affected pair is written once.
+    deltas = defaultdict(int)
+    for expense, splits in expenses_with_splits:
+        expense_deltas(expense, splits, deltas=deltas)
+    apply_deltas(deltas)
+
+
+def revert_expense(expense, splits):
+    apply_deltas(expense_deltas(expense, splits, sign=-1))
+
+
+def replace_expense(old_expense, old_splits, new_expense, new_splits):
+    # Net the old and new splits first so participants whose share did not
+    # change cause no writes at all. An update can change the currency, so
+    # `old_expense` is a copy taken before the update was saved.
+    deltas = expense_deltas(old_expense, old_splits, sign=-1)
+    expense_deltas(new_expense, new_splits, deltas=deltas)
+    apply_deltas(deltas)
+
+
+def expected_balances():
+    # Ledger recomputed from scratch out of ExpenseSplit, as {(group, creditor, debtor, currency): amount}.
+    rows = (
+        ExpenseSplit.objects
+        .exclude(user_id=F('expense__created_by_id'))
+        .values('expense__group', 'expense__created_by', 'user', 'expense__currency')
+        .annotate(total=Sum('amount_cents'))
+        .order_by()
+    )
+    return {
+        (row['expense__group'], row['expense__created_by'], row['user'], row['expense__currency']): row['total']
+        for row in rows.iterator()
+        if row['total']
+    }
+
+
+def current_balances():
+    rows = (
+        Balance.objects
+        .exclude(amount_cents=0)
+        .values_list('group_id', 'creditor_id', 'debtor_id', 'currency', 'amount_cents')
+    )
+    return {tuple(row[:4]): row[4] for row in rows.iterator()}
+
+
+def rebuild(batch_size=1000):
+    # Expenses written while the ledger is read would be lost by the rewrite, so
+    # writers wait for it.
+    with write_transaction():
+        lock_table(Balance)
+        expected = expected_balances()
+        Balance.objects.all().delete()
+        Balance.objects.bulk_create(
+            (
+                Balance(group_id=group, creditor_id=creditor, debtor_id=debtor, currency=currency, amount_cents=amount)
+                for (group, creditor, debtor, currency), amount in expected.items()
+            ),
+            batch_size=batch_size,
+        )
+    caching.clear()
+    return len(expected)
+
+
+def conversion(currency=None, on=None):
+    # (rate table, target currency, rate date) for the balance reads below: into
+    # settings.EXPENSES_CURRENCY at today's rates unless asked otherwise.
+    return fx.rate_table(), currency or settings.EXPENSES_CURRENCY, on or timezone.localdate()
+
+
+def _counterparty_rows(user_id):
+    fields = ('currency', 'amount_cents')
+    owed = Balance.objects.filter(creditor_id=user_id).values_list('debtor_id', 'debtor__username', *fields)
+    due = Balance.objects.filter(debtor_id=user_id).values_list('creditor_id', 'creditor__username', *fields)
+    return ((owed, 1), (due, -1))
+
+
+def _add_counterparty(result, other_id, username, cents):
+    entry = result.setdefault(other_id, {'username': username, 'cents': 0})
+    entry['cents'] += cents
+
+
+def net_balances(user_id, currency=None, on=None):
+    # {counterparty_id: {'username': ..., 'cents': ...}} where a positive amount
+    # means the counterparty owes `user_id`, negative means `user_id` owes them.
+    # Balances in other currencies are converted with the rates of date `on`;
+    # raises fx.UnknownRate when one is missing.
+    table, currency, on = conversion(currency, on)
+    result = {}
+    for rows, sign in _counterparty_rows(user_id):
+        for other_id, username, row_currency, cents in rows:
+            _add_counterparty(result, other_id, username, sign * table.convert(cents, row_currency, currency, on))
+    return result
+
+
+async def anet_balances(user_id, currency=None, on=None):
+    table, currency, on = conversion(currency, on)
+    result = {}
+    for rows, sign in _counterparty_rows(user_id):
+        async for other_id, username, row_currency, cents in rows:
+            _add_counterparty(result, other_id, username, sign * table.convert(cents, row_currency, currency, on))
+    return result
+
+
+def pair_balances_in_cents(user_ids=None, group_id=None, currency=None, on=None, party=None):
+    # Ledger rows as (creditor, debtor, cents) converted like net_balances(),
+    # optionally restricted to pairs where both sides are in `user_ids`, to pairs
+    # `party` is one side of, or to one group. A pair owing in several currencies
+    # yields one row for each. Feeds expenses.settlement.
+    table, currency, on = conversion(currency, on)
+    balances = Balance.objects.exclude(amount_cents=0)
+    if user_ids is not None:
+        balances = balances.filter(creditor_id__in=user_ids, debtor_id__in=user_ids)
+    if party is not None:
+        balances = balances.filter(Q(creditor_id=party) | Q(debtor_id=party))
+    if group_id is not None:
+        balances = balances.filter(group_id=group_id)
+    rows = balances.values_list('creditor_id', 'debtor_id', 'currency', 'amount_cents')
+    for creditor, debtor, row_currency, cents in rows.iterator():
+        yield creditor, debtor, table.convert(cents, row_currency, currency, on)
+
+
+def balance_summary(user_id, balances, currency=None):
+    # Shape of the /api/balances/ response, from net_balances() output.
+    results = [
+        {'user': other_id, 'username': entry['username'], 'cents': entry['cents']}
+        for other_id, entry in sorted(balances.items())
+        if entry['cents']
+    ]
+    return {
+        'user': user_id,
+        'currency': currency or settings.EXPENSES_CURRENCY,
+        'net_cents': sum(entry['cents'] for entry in results),
+        'balances': results,
+    }
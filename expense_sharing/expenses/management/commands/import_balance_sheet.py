@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import importers
+
+
+class Command(BaseCommand):
+    help = 'Import expenses from a balance sheet CSV as written by download_balance_sheet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=importers.IMPORT_CHUNK_SIZE)
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument(
+            '--progress-interval',
+            type=float,
+            default=5.0,
+            help='Seconds between progress lines.',
+        )
+
+    def handle(self, *args, **options):
+        last_report = time.monotonic()
+
+        def report(result):
+            nonlocal last_report
+            now = time.monotonic()
+            if now - last_report >= options['progress_interval']:
+                last_report = now
+                self.stdout.write(f'{result.rows} rows, {result.rows_per_second:.0f} rows/s')
+
+        try:
+            with open(options['path'], encoding=options['encoding'], newline='') as stream:
+                result = importers.import_balance_sheet(stream, chunk_size=options['chunk_size'], on_chunk=report)
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+
+        for error in result.errors:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.imported} of {result.rows} rows ({result.skipped} skipped) '
+            f'in {result.seconds:.1f}s, {result.rows_per_second:.0f} rows/s.'
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import ledger
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the balance ledger from ExpenseSplit rows, or verify it with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Compare the ledger against a full recomputation without modifying it.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            count = ledger.rebuild(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt ledger with {count} balances.'))
+            return
+
+        expected = ledger.expected_balances()
+        current = ledger.current_balances()
+        mismatches = 0
+        # Rows outside any group (group None) sort first.
+        keys = sorted(expected.keys() | current.keys(), key=lambda key: (key[0] is not None, key[0] or 0, *key[1:]))
+        for key in keys:
+            want, have = expected.get(key, 0), current.get(key, 0)
+            if want != have:
+                mismatches += 1
+                group, creditor, debtor, currency = key
+                self.stdout.write(
+                    f'group={group} creditor={creditor} debtor={debtor} {currency}: expected {want}, ledger has {have}'
+                )
+
+        if mismatches:
+            raise CommandError(f'{mismatches} ledger balances do not match the expense splits.')
+        self.stdout.write(self.style.SUCCESS(f'Ledger verified: {len(expected)} balances match.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from expenses import changes
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the expense change feed from Expense and ExpenseSplit rows. Run once after upgrading; '
+        'existing tombstones are dropped, so clients that already synced must sync again from since=0.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = changes.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the change feed: {count} expense participants.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses import rollups
+
+
+class Command(BaseCommand):
+    help = 'Build the spending rollups from Expense and ExpenseSplit rows, or verify them with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Compare the rollups against a full recomputation without modifying them.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            count = rollups.rebuild(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} spending rollups.'))
+            return
+
+        expected = rollups.expected_rollups()
+        current = rollups.current_rollups()
+        mismatches = 0
+        for key in sorted(expected.keys() | current.keys()):
+            want, have = expected.get(key), current.get(key)
+            if want != have:
+                mismatches += 1
+                period, start, user, split_type, currency = key
+                self.stdout.write(
+                    f'{period} {start} user={user} split_type={split_type} {currency}: '
+                    f'expected {want}, rollup has {have}'
+                )
+
+        if mismatches:
+            raise CommandError(f'{mismatches} spending rollups do not match the expenses.')
+        self.stdout.write(self.style.SUCCESS(f'Rollups verified: {len(expected)} buckets match.'))
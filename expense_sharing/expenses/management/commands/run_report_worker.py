@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from expenses import reports, workers
+
+
+class Command(BaseCommand):
+    help = 'Process queued report jobs, rendering them in parallel across a pool of processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Jobs rendered at the same time. With 1, jobs run in this process.',
+        )
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between polls of an empty queue.')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            self.run_inline(options['poll_interval'], options['once'])
+        else:
+            self.run_pool(options['processes'], options['poll_interval'], options['once'])
+
+    def report(self, job_id, status):
+        style = self.style.SUCCESS if status == 'DONE' else self.style.ERROR
+        self.stdout.write(style(f'Job {job_id}: {status}'))
+
+    def run_inline(self, poll_interval, once):
+        while True:
+            reports.requeue_stale_jobs()
+            job_id = reports.claim_job()
+            if job_id is None:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+            self.report(*reports.run_job(job_id))
+
+    def run_pool(self, processes, poll_interval, once):
+        # This process claims jobs and the pool renders them. Only as many jobs as
+        # there are idle processes are claimed, leaving the rest of the queue to
+        # other workers.
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(processes, mp_context=context, initializer=workers.init_process) as pool:
+            running = set()
+            while True:
+                reports.requeue_stale_jobs()
+                while len(running) < processes:
+                    job_id = reports.claim_job()
+                    if job_id is None:
+                        break
+                    running.add(pool.submit(workers.run_report_job, job_id))
+
+                if not running:
+                    if once:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+
+                done, running = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.report(*future.result())
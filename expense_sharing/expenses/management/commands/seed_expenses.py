@@ -0,0 +1,77 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from expenses import changes, ledger, rollups
+from expenses.models import Expense, ExpenseSplit
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed synthetic users, expenses and splits for benchmarks. Uses only the ORM, '
+        'so it works against SQLite and PostgreSQL alike.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--expenses', type=int, default=10000)
+        parser.add_argument('--splits-per-expense', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='bench', help='Username prefix of the seeded users.')
+        parser.add_argument(
+            '--no-ledger', action='store_true',
+            help='Skip rebuilding the balance ledger, spending rollups and change feed.',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        started = time.monotonic()
+
+        first = User.objects.filter(username__startswith=f"{options['prefix']}_").count()
+        users = User.objects.bulk_create(
+            [
+                # '!' marks an unusable password without paying for hashing.
+                User(username=f"{options['prefix']}_{first + i}", password='!')
+                for i in range(options['users'])
+            ],
+            batch_size=batch_size,
+        )
+        user_ids = [user.id for user in users]
+        per_expense = min(options['splits_per_expense'], len(user_ids))
+        split_cents = 1000
+
+        created = 0
+        while created < options['expenses']:
+            count = min(batch_size, options['expenses'] - created)
+            expenses = Expense.objects.bulk_create([
+                Expense(
+                    title=f'Expense {created + i}',
+                    amount_cents=split_cents * per_expense,
+                    split_type='EQUAL',
+                    created_by_id=rng.choice(user_ids),
+                )
+                for i in range(count)
+            ])
+            ExpenseSplit.objects.bulk_create(
+                [
+                    ExpenseSplit(expense_id=expense.id, user_id=user_id, amount_cents=split_cents)
+                    for expense in expenses
+                    for user_id in rng.sample(user_ids, per_expense)
+                ],
+                batch_size=batch_size,
+            )
+            created += count
+            self.stdout.write(f'{created} expenses, {created * per_expense} splits')
+
+        if not options['no_ledger']:
+            ledger.rebuild()
+            rollups.rebuild()
+            changes.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(user_ids)} users, {created} expenses and {created * per_expense} splits "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,209 @@
+# expenses/metrics.py
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from . import caching
+
+# Per-process request metrics, rendered in the Prometheus text format by the
+# /metrics endpoint. Like the cache counters, every worker process keeps its own
+# numbers; scrape each worker, or sum them in Prometheus.
+
+slow_query_logger = logging.getLogger('expenses.sql')
+slow_request_logger = logging.getLogger('expenses.requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, zip(self.labelnames, labels), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames, buckets):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # {labels: [per-bucket counts (non-cumulative, last one is +Inf), sum, count]}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            pairs = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', [*pairs, ('le', str(bound))], cumulative
+            yield f'{self.name}_sum', pairs, total
+            yield f'{self.name}_count', pairs, count
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+requests_total = Counter(
+    'expenses_http_requests_total', 'HTTP requests by view, method and status code.',
+    ('view', 'method', 'status'),
+)
+request_duration = Histogram(
+    'expenses_http_request_duration_seconds', 'Time from the first middleware to the response.',
+    ('view', 'method'), LATENCY_BUCKETS,
+)
+request_db_duration = Histogram(
+    'expenses_http_request_db_duration_seconds', 'Time spent executing SQL per request.',
+    ('view', 'method'), LATENCY_BUCKETS,
+)
+request_queries = Histogram(
+    'expenses_http_request_queries', 'SQL queries executed per request.',
+    ('view', 'method'), QUERY_COUNT_BUCKETS,
+)
+response_size = Histogram(
+    'expenses_http_response_size_bytes', 'Response body size; streamed responses are not counted.',
+    ('view', 'method'), SIZE_BUCKETS,
+)
+slow_queries_total = Counter(
+    'expenses_slow_queries_total', 'Queries slower than EXPENSES_SLOW_QUERY_MS.',
+    ('view',),
+)
+cache_requests_total = Counter(
+    'expenses_cache_requests_total', 'Expense and balance cache lookups.',
+    ('cache', 'result'),
+)
+
+METRICS = [
+    requests_total, request_duration, request_db_duration, request_queries, response_size, slow_queries_total,
+]
+
+
+class RequestMetrics:
+    # Collected for one request. The current instance is held in a context
+    # variable so that queries run by sync_to_async threads of an async view are
+    # attributed to the request too.
+
+    __slots__ = ('view', 'queries', 'db_seconds', 'started')
+
+    def __init__(self):
+        self.view = '<unresolved>'
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.started = time.perf_counter()
+
+
+current_request = ContextVar('expenses_request_metrics', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    # Execute wrapper installed on every database connection (see signals.py).
+    # Outside a request it only forwards the call.
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        request_metrics.queries += 1
+        request_metrics.db_seconds += elapsed
+        threshold = settings.EXPENSES_SLOW_QUERY_MS
+        if threshold is not None and elapsed * 1000 >= threshold:
+            slow_queries_total.inc((request_metrics.view,))
+            slow_query_logger.warning(
+                'Slow query (%.1f ms) in %s: %s',
+                elapsed * 1000, request_metrics.view, sql[:settings.EXPENSES_SLOW_QUERY_SQL_LENGTH],
+            )
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def observe_response(request_metrics, request, response):
+    # Records a finished request; returns its total duration in seconds.
+    elapsed = time.perf_counter() - request_metrics.started
+    labels = (request_metrics.view, request.method)
+    requests_total.inc((*labels, str(response.status_code)))
+    request_duration.observe(labels, elapsed)
+    request_db_duration.observe(labels, request_metrics.db_seconds)
+    request_queries.observe(labels, request_metrics.queries)
+    if not response.streaming:
+        response_size.observe(labels, len(response.content))
+
+    threshold = settings.EXPENSES_SLOW_REQUEST_MS
+    if threshold is not None and elapsed * 1000 >= threshold:
+        slow_request_logger.warning(
+            'Slow request (%.1f ms, %d queries, %.1f ms in SQL): %s %s',
+            elapsed * 1000, request_metrics.queries, request_metrics.db_seconds * 1000, request.method, request.path,
+        )
+    return elapsed
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    cache_requests_total.clear()
+    for cache, counts in caching.stats().items():
+        cache_requests_total.inc((cache, 'hit'), counts['hits'])
+        cache_requests_total.inc((cache, 'miss'), counts['misses'])
+
+    lines = []
+    for metric in [*METRICS, cache_requests_total]:
+        kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {kind}')
+        for name, labels, value in metric.samples():
+            label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels)
+            lines.append(f'{name}{{{label_text}}} {_format(value)}' if label_text else f'{name} {_format(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for metric in METRICS:
+        metric.clear()
@@ -0,0 +1,60 @@
+# expenses/middleware.py
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+
+class RequestMetricsMiddleware:
+    # Records latency, SQL query count and time and response size per view (see
+    # expenses/metrics.py), and adds a Server-Timing header when
+    # settings.EXPENSES_SERVER_TIMING is on. Put it first in MIDDLEWARE so the
+    # timings cover the other middleware too. Works under WSGI and ASGI.
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current_request.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        return self.finish(request_metrics, request, response)
+
+    async def __acall__(self, request):
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current_request.set(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        return self.finish(request_metrics, request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Label by URL name ("expense-detail") rather than path, so the number of
+        # series stays bounded.
+        request_metrics = metrics.current_request.get()
+        if request_metrics is not None:
+            match = request.resolver_match
+            request_metrics.view = match.view_name or match._func_path
+        return None
+
+    def finish(self, request_metrics, request, response):
+        elapsed = metrics.observe_response(request_metrics, request, response)
+        if settings.EXPENSES_SERVER_TIMING:
+            db_ms = request_metrics.db_seconds * 1000
+            total_ms = elapsed * 1000
+            response['Server-Timing'] = (
+                f'db;desc="{request_metrics.queries} queries";dur={db_ms:.1f}, '
+                f'app;dur={max(total_ms - db_ms, 0):.1f}, total;dur={total_ms:.1f}'
+            )
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_reportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expensesplit',
+            name='adjustment',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='expensesplit',
+            name='shares',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='split_type',
+            field=models.CharField(choices=[('EQUAL', 'Equal'), ('EXACT', 'Exact'), ('PERCENTAGE', 'Percentage'), ('SHARES', 'Shares'), ('ADJUSTMENT', 'Adjustment')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_groups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('DAY', 'Day'), ('MONTH', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('split_type', models.CharField(choices=[('EQUAL', 'Equal'), ('EXACT', 'Exact'), ('PERCENTAGE', 'Percentage'), ('SHARES', 'Shares'), ('ADJUSTMENT', 'Adjustment')], max_length=10)),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('splits', models.PositiveIntegerField(default=0)),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expenses', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'period', 'period_start'], name='rollup_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'period_start', 'user', 'split_type'), name='unique_rollup_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_spending_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
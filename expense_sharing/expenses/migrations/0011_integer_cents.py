@@ -0,0 +1,107 @@
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+# Money columns move from DecimalField to integer cents. Each model gets the new
+# columns, the values are copied over in one UPDATE per table, and the decimal
+# columns are dropped. They are made nullable first so that the migration can be
+# reversed with data in the tables.
+MONEY_FIELDS = {
+    'expense': [('amount', 'amount_cents')],
+    'expensesplit': [('amount', 'amount_cents'), ('adjustment', 'adjustment_cents')],
+    'balance': [('amount', 'amount_cents')],
+    'spendingrollup': [('spent', 'spent_cents'), ('paid', 'paid_cents')],
+}
+
+
+def to_cents(apps, schema_editor):
+    for model_name, fields in MONEY_FIELDS.items():
+        model = apps.get_model('expenses', model_name)
+        model.objects.using(schema_editor.connection.alias).update(**{
+            cents: Cast(Round(F(decimal) * 100), models.BigIntegerField()) for decimal, cents in fields
+        })
+
+
+def from_cents(apps, schema_editor):
+    for model_name, fields in MONEY_FIELDS.items():
+        model = apps.get_model('expenses', model_name)
+        model.objects.using(schema_editor.connection.alias).update(**{
+            decimal: F(cents) / 100.0 for decimal, cents in fields
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0010_expense_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='amount_cents',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='expensesplit',
+            name='amount_cents',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='expensesplit',
+            name='adjustment_cents',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='balance',
+            name='amount_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spendingrollup',
+            name='spent_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spendingrollup',
+            name='paid_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='expensesplit',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(to_cents, from_cents),
+        migrations.RemoveField(
+            model_name='expense',
+            name='amount',
+        ),
+        migrations.RemoveField(
+            model_name='expensesplit',
+            name='amount',
+        ),
+        migrations.RemoveField(
+            model_name='expensesplit',
+            name='adjustment',
+        ),
+        migrations.RemoveField(
+            model_name='balance',
+            name='amount',
+        ),
+        migrations.RemoveField(
+            model_name='spendingrollup',
+            name='spent',
+        ),
+        migrations.RemoveField(
+            model_name='spendingrollup',
+            name='paid',
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:39
+
+import expenses.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0011_integer_cents'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='balance',
+            name='unique_balance_pair',
+        ),
+        migrations.RemoveConstraint(
+            model_name='balance',
+            name='unique_group_balance_pair',
+        ),
+        migrations.RemoveConstraint(
+            model_name='spendingrollup',
+            name='unique_rollup_bucket',
+        ),
+        migrations.AddField(
+            model_name='balance',
+            name='currency',
+            field=models.CharField(default=expenses.models.default_currency, max_length=3),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='currency',
+            field=models.CharField(default=expenses.models.default_currency, max_length=3),
+        ),
+        migrations.AddField(
+            model_name='spendingrollup',
+            name='currency',
+            field=models.CharField(default=expenses.models.default_currency, max_length=3),
+        ),
+        migrations.AddConstraint(
+            model_name='balance',
+            constraint=models.UniqueConstraint(condition=models.Q(('group__isnull', True)), fields=('creditor', 'debtor', 'currency'), name='unique_balance_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='balance',
+            constraint=models.UniqueConstraint(condition=models.Q(('group__isnull', False)), fields=('group', 'creditor', 'debtor', 'currency'), name='unique_group_balance_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='spendingrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start', 'user', 'split_type', 'currency'), name='unique_rollup_bucket'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:09
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+# A user can only have one split per expense. Rows written before this was
+# enforced are merged into the user's first split: amounts, percentages, shares
+# and adjustments are added up, so every user still owes the same amount and the
+# balance ledger stays correct. Spending rollups count splits, so run
+# `manage.py rebuild_rollups` afterwards if any were merged.
+SUMMED_FIELDS = ['amount_cents', 'percentage', 'shares', 'adjustment_cents']
+
+
+def merge_duplicate_splits(apps, schema_editor):
+    ExpenseSplit = apps.get_model('expenses', 'ExpenseSplit')
+    splits = ExpenseSplit.objects.using(schema_editor.connection.alias)
+    duplicates = list(
+        splits.values('expense_id', 'user_id').annotate(count=Count('id')).filter(count__gt=1).order_by()
+    )
+    for pair in duplicates:
+        kept, *merged = splits.filter(expense_id=pair['expense_id'], user_id=pair['user_id']).order_by('id')
+        for field in SUMMED_FIELDS:
+            values = [getattr(split, field) for split in (kept, *merged) if getattr(split, field) is not None]
+            setattr(kept, field, sum(values) if values else None)
+        kept.save(update_fields=SUMMED_FIELDS)
+        splits.filter(pk__in=[split.pk for split in merged]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0012_expense_currency'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_splits, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='expensesplit',
+            constraint=models.UniqueConstraint(fields=('expense', 'user'), name='unique_split_user'),
+        ),
+    ]
@@ -1,21 +1,231 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import User
 
+def default_currency():
+    return settings.EXPENSES_CURRENCY
+
+class ExpenseQuerySet(models.QuerySet):
+    def with_splits(self):
+        # Splits are serialized with every expense; fetch them for the whole page in
+        # one extra query. Split users are rendered as primary keys, so no join is needed.
+        return self.prefetch_related('splits')
+
+    def bump_version(self, expense):
+        # Compare-and-swap on the version `expense` was read with: succeeds only if
+        # nobody has written the expense since, and then holds its row lock until
+        # the surrounding transaction ends.
+        updated = self.filter(pk=expense.pk, version=expense.version).update(version=models.F('version') + 1)
+        if updated:
+            expense.version += 1
+        return bool(updated)
+
+class Group(models.Model):
+    # A set of users sharing expenses. Expenses, splits and balances of a group
+    # carry its id and are indexed by it first, so group-scoped queries only
+    # touch that group's rows however many groups there are.
+    name = models.CharField(max_length=100)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='groups_created')
+    created_at = models.DateTimeField(auto_now_add=True)
+    members = models.ManyToManyField(User, through='GroupMembership', related_name='expense_groups')
+
+class GroupMembership(models.Model):
+    MEMBER = 'MEMBER'
+    ADMIN = 'ADMIN'
+    ROLE_CHOICES = [
+        (MEMBER, 'Member'),
+        (ADMIN, 'Admin'),
+    ]
+
+    # Both indexed through the composite unique constraint and index below.
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='memberships', db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='group_memberships', db_index=False)
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=MEMBER)
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'user'], name='unique_group_member'),
+        ]
+        indexes = [
+            # "Groups this user belongs to".
+            models.Index(fields=['user', 'group'], name='group_member_user_idx'),
+        ]
+
 class Expense(models.Model):
     SPLIT_CHOICES = [
         ('EQUAL', 'Equal'),
         ('EXACT', 'Exact'),
         ('PERCENTAGE', 'Percentage'),
+        ('SHARES', 'Shares'),
+        ('ADJUSTMENT', 'Adjustment'),
     ]
 
     title = models.CharField(max_length=100)
-    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Money is stored in integer cents throughout (see expenses/money.py), in the
+    # expense's currency; splits share it.
+    amount_cents = models.BigIntegerField()
+    # ISO 4217 code; see expenses/fx.py for conversions.
+    currency = models.CharField(max_length=3, default=default_currency)
     split_type = models.CharField(max_length=10, choices=SPLIT_CHOICES)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expenses_created')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Null for expenses outside any group. Indexed through expense_group_created_idx.
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='expenses', db_index=False)
+    # Incremented by every update through the API; served as the ETag.
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ExpenseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination walks these in (created_at, id) order.
+            models.Index(fields=['created_at', 'id'], name='expense_created_idx'),
+            models.Index(fields=['created_by', 'created_at', 'id'], name='expense_creator_created_idx'),
+            models.Index(fields=['group', 'created_at', 'id'], name='expense_group_created_idx'),
+        ]
 
 class ExpenseSplit(models.Model):
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='splits')
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Indexed through split_user_expense_idx below, which also serves lookups by user alone.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    amount_cents = models.BigIntegerField()
     percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    # Inputs of SHARES and ADJUSTMENT splits; `amount_cents` holds the allocated result.
+    shares = models.PositiveIntegerField(null=True, blank=True)
+    adjustment_cents = models.BigIntegerField(null=True, blank=True)
+    # Copy of expense.group, so a group's splits can be scanned without the join.
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='+', db_index=False)
+
+    class Meta:
+        indexes = [
+            # "Expenses this user takes part in" is an index-only scan on this.
+            models.Index(fields=['user', 'expense'], name='split_user_expense_idx'),
+            models.Index(fields=['group', 'user', 'expense'], name='split_group_user_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['expense', 'user'], name='unique_split_user'),
+        ]
+
+class Balance(models.Model):
+    # Running total of what `debtor` owes `creditor` across the expenses of one
+    # group (or of no group) in one currency. Maintained incrementally by
+    # expenses.ledger; one row per (group, creditor, debtor, currency). Amounts in
+    # different currencies are only netted after conversion, when read.
+    creditor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balances_owed')
+    debtor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balances_due')
+    amount_cents = models.BigIntegerField(default=0)
+    currency = models.CharField(max_length=3, default=default_currency)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='+', db_index=False)
+
+    class Meta:
+        constraints = [
+            # NULLs never compare equal in a unique index, so rows outside any group
+            # get a constraint of their own.
+            models.UniqueConstraint(
+                fields=['creditor', 'debtor', 'currency'],
+                condition=models.Q(group__isnull=True),
+                name='unique_balance_pair',
+            ),
+            models.UniqueConstraint(
+                fields=['group', 'creditor', 'debtor', 'currency'],
+                condition=models.Q(group__isnull=False),
+                name='unique_group_balance_pair',
+            ),
+        ]
+
+class ReportJob(models.Model):
+    # A report queued for the run_report_worker command. The table is the queue:
+    # workers claim PENDING rows oldest first (see expenses.reports.claim_job).
+    BALANCE_SHEET_CSV = 'BALANCE_SHEET_CSV'
+    STATEMENT_PDF = 'STATEMENT_PDF'
+    KIND_CHOICES = [
+        (BALANCE_SHEET_CSV, 'Balance sheet (CSV)'),
+        (STATEMENT_PDF, 'User statement (PDF)'),
+    ]
+
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='report_jobs')
+    # The user a statement is for; unused for the balance sheet.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    file = models.FileField(upload_to='reports/', blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers poll for the oldest pending job.
+            models.Index(fields=['status', 'created_at', 'id'], name='reportjob_queue_idx'),
+            models.Index(fields=['requested_by', 'created_at', 'id'], name='reportjob_requester_idx'),
+        ]
+
+class SpendingRollup(models.Model):
+    # Spending per user, split type, currency and day or month, maintained
+    # incrementally by expenses.rollups so analytics never aggregate over ExpenseSplit.
+    DAY = 'DAY'
+    MONTH = 'MONTH'
+    PERIOD_CHOICES = [
+        (DAY, 'Day'),
+        (MONTH, 'Month'),
+    ]
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    # First day of the bucket (the day itself, or the first of the month).
+    period_start = models.DateField()
+    # Indexed through rollup_user_idx below.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    split_type = models.CharField(max_length=10, choices=Expense.SPLIT_CHOICES)
+    currency = models.CharField(max_length=3, default=default_currency)
+    # Sum and number of the user's splits (their share of expenses).
+    spent_cents = models.BigIntegerField(default=0)
+    splits = models.PositiveIntegerField(default=0)
+    # Sum and number of the expenses the user created (paid for).
+    paid_cents = models.BigIntegerField(default=0)
+    expenses = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also serves range scans over (period, period_start).
+            models.UniqueConstraint(
+                fields=['period', 'period_start', 'user', 'split_type', 'currency'], name='unique_rollup_bucket'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'period', 'period_start'], name='rollup_user_idx'),
+        ]
+
+class ExpenseChange(models.Model):
+    # Change feed behind /api/expenses/changes/ (see expenses/changes.py): the
+    # latest change of each expense for each user who takes part in it. The id is
+    # the change sequence; every write replaces the row, so it moves to the end.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    # Not a foreign key: tombstones outlive the expense.
+    expense_id = models.BigIntegerField()
+    # Tombstone: the expense was deleted, or the user no longer takes part in it.
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['expense_id', 'user'], name='unique_expense_change'),
+        ]
+        indexes = [
+            # A sync is a range scan over (user, id > since).
+            models.Index(fields=['user', 'id'], name='expensechange_feed_idx'),
+        ]
@@ -0,0 +1,54 @@
+# expenses/money.py
+from decimal import Decimal
+from typing import NamedTuple
+
+# Money is stored and computed as integer cents: hundredths of the currency
+# unit, as the two-decimal amounts the API accepts. Ledger, rollups, settlement
+# and exports add and compare plain ints and only the API edge (and the CSV and
+# PDF renderers) turn them into decimal strings, with format_cents() and
+# parse_cents() below rather than through Decimal.
+
+
+def parse_cents(value):
+    # '12.34' -> 1234, '-0.5' -> -50, 7 -> 700. Raises ValueError on anything
+    # that is not a number with at most two decimal places.
+    if isinstance(value, str):
+        text = value.strip()
+    elif isinstance(value, bool):
+        raise ValueError(f'{value!r} is not an amount')
+    elif isinstance(value, int):
+        return value * 100
+    elif isinstance(value, Decimal):
+        text = format(value, 'f')
+    elif isinstance(value, float):
+        text = repr(value)
+    else:
+        raise ValueError(f'{value!r} is not an amount')
+    units, _, fraction = text.partition('.')
+    digits = units[1:] if units[:1] in ('+', '-') else units
+    if not (
+        text.isascii() and len(fraction) <= 2
+        and (digits.isdigit() or not digits and fraction)
+        and (fraction.isdigit() or not fraction)
+    ):
+        raise ValueError(f'{value!r} is not an amount with at most two decimal places')
+    # The sign stays in front, so int() handles it: '-0.05' -> int('-005').
+    return int(units + fraction.ljust(2, '0'))
+
+
+def format_cents(cents):
+    # 1234 -> '12.34', -5 -> '-0.05'.
+    if cents < 0:
+        return '-%d.%02d' % divmod(-cents, 100)
+    return '%d.%02d' % divmod(cents, 100)
+
+
+class Money(NamedTuple):
+    # An amount in cents together with its ISO 4217 currency code, for the
+    # report renderers. Hot loops work on bare ints of one currency instead, so
+    # no object is created per split.
+    cents: int
+    currency: str
+
+    def __str__(self):
+        return f'{format_cents(self.cents)} {self.currency}'
@@ -0,0 +1,123 @@
+# expenses/pagination.py
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over (created_at, id), newest first.
+
+    The cursor holds the position of the last row of the previous page, so each
+    page is a range scan on the (created_at, id) indexes rather than an OFFSET
+    scan, and rows inserted while a client is paging never shift later pages.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = settings.EXPENSES_PAGE_SIZE
+        if self.page_size_query_param in request.query_params:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+            except ValueError:
+                pass
+        return max(1, min(page_size, settings.EXPENSES_MAX_PAGE_SIZE))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def encode_cursor(self, created_at, pk):
+        raw = f'{created_at.isoformat()}|{pk}'
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def apply_cursor(self, queryset, cursor):
+        queryset = queryset.order_by('-created_at', '-id')
+        if cursor is not None:
+            created_at, pk = cursor
+            # The OR alone gives the planner no range to start the index scan
+            # from; the redundant created_at <= bound does.
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk), created_at__lte=created_at
+            )
+        return queryset
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        # Fetch one extra row to know whether there is a next page.
+        results = list(self.apply_cursor(queryset, cursor)[:page_size + 1])
+        return self.finish_page(results, page_size)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # Async variant of paginate_queryset for views running on the event loop.
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        results = [obj async for obj in self.apply_cursor(queryset, cursor)[:page_size + 1]]
+        return self.finish_page(results, page_size)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        # Pages over the union of several querysets. Each one is paged on its own,
+        # so it can use its own index, and the pages are merged here. SQL UNION
+        # is avoided because SQLite does not allow LIMIT inside compound queries.
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        rows = {}
+        for queryset in querysets:
+            for obj in self.apply_cursor(queryset, cursor)[:page_size + 1]:
+                rows[obj.pk] = obj
+        results = sorted(rows.values(), key=lambda obj: (obj.created_at, obj.pk), reverse=True)
+        return self.finish_page(results[:page_size + 1], page_size)
+
+    def finish_page(self, results, page_size):
+        self.next_cursor = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            last = results[-1]
+            self.next_cursor = self.encode_cursor(last.created_at, last.pk)
+        return results
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
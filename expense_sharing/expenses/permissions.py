@@ -0,0 +1,47 @@
+# expenses/permissions.py
+from rest_framework.permissions import BasePermission, IsAdminUser
+
+from .models import GroupMembership
+
+# Object-level checks that rely on request.user, which DRF has already resolved
+# from the JWT, instead of validating the token a second time in the view.
+
+
+class IsSelf(BasePermission):
+    message = 'Token does not match the requested user'
+
+    def has_object_permission(self, request, view, obj):
+        return obj.pk == request.user.pk
+
+
+class IsExpenseOwner(BasePermission):
+    message = 'You do not have permission to view this expense'
+
+    def has_object_permission(self, request, view, obj):
+        return obj.created_by_id == request.user.pk
+
+
+class IsStaff(IsAdminUser):
+    message = 'Only admin can modify an expense'
+
+
+def group_role(group, user_id):
+    # The user's role in `group`, or None. Reads prefetched memberships when present.
+    for membership in group.memberships.all():
+        if membership.user_id == user_id:
+            return membership.role
+    return None
+
+
+class IsGroupMember(BasePermission):
+    message = 'You are not a member of this group'
+
+    def has_object_permission(self, request, view, obj):
+        return request.user.is_staff or group_role(obj, request.user.pk) is not None
+
+
+class IsGroupAdmin(BasePermission):
+    message = 'Only group admins can manage this group'
+
+    def has_object_permission(self, request, view, obj):
+        return request.user.is_staff or group_role(obj, request.user.pk) == GroupMembership.ADMIN
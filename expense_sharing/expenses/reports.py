@@ -0,0 +1,156 @@
+# expenses/reports.py
+import io
+import logging
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db.models import F
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from . import ledger
+from .exports import iter_balance_sheet
+from .models import ExpenseSplit, ReportJob
+from .money import Money, format_cents
+
+logger = logging.getLogger(__name__)
+
+# Jobs are claimed from this many of the oldest pending rows; a worker that loses
+# the race for one tries the next instead of polling again.
+CLAIM_CANDIDATES = 10
+
+# Rows per table in a PDF statement. reportlab lays out each table as a whole,
+# so long statements are split into several tables to keep layout time linear.
+STATEMENT_TABLE_ROWS = 500
+
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ('ALIGN', (-2, 1), (-1, -1), 'RIGHT'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+])
+
+
+def claim_job():
+    # Moves the oldest pending job to RUNNING and returns its id, or None when the
+    # queue is empty. The UPDATE only matches while the row is still PENDING, so
+    # when several workers race for the same job exactly one of them wins.
+    candidates = (
+        ReportJob.objects
+        .filter(status=ReportJob.PENDING)
+        .order_by('created_at', 'id')
+        .values_list('id', flat=True)[:CLAIM_CANDIDATES]
+    )
+    for job_id in candidates:
+        claimed = ReportJob.objects.filter(pk=job_id, status=ReportJob.PENDING).update(
+            status=ReportJob.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1
+        )
+        if claimed:
+            return job_id
+    return None
+
+
+def requeue_stale_jobs():
+    # Jobs left RUNNING by a worker that died are retried, up to
+    # EXPENSES_REPORT_MAX_ATTEMPTS times, once EXPENSES_REPORT_TIMEOUT has passed.
+    cutoff = timezone.now() - timedelta(seconds=settings.EXPENSES_REPORT_TIMEOUT)
+    stale = ReportJob.objects.filter(status=ReportJob.RUNNING, started_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=settings.EXPENSES_REPORT_MAX_ATTEMPTS).update(
+        status=ReportJob.FAILED, error='Timed out', finished_at=timezone.now()
+    )
+    requeued = stale.update(status=ReportJob.PENDING, started_at=None)
+    return requeued, failed
+
+
+def write_balance_sheet_csv(job, output):
+    text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+    for line in iter_balance_sheet():
+        text.write(line)
+    text.flush()
+    text.detach()
+
+
+def chunked_tables(header, rows, col_widths):
+    # One Table per STATEMENT_TABLE_ROWS rows, each repeating the header.
+    chunk, emitted = [], False
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == STATEMENT_TABLE_ROWS:
+            yield Table([header, *chunk], colWidths=col_widths, repeatRows=1, style=TABLE_STYLE)
+            chunk, emitted = [], True
+    if chunk or not emitted:
+        yield Table([header, *chunk], colWidths=col_widths, repeatRows=1, style=TABLE_STYLE)
+
+
+def write_statement_pdf(job, output):
+    user = job.user
+    styles = getSampleStyleSheet()
+    summary = ledger.balance_summary(user.id, ledger.net_balances(user.id))
+    splits = (
+        ExpenseSplit.objects
+        .filter(user=user)
+        .select_related('expense__created_by')
+        .order_by('expense__created_at', 'expense_id')
+    )
+
+    story = [
+        Paragraph(f'Expense statement for {user.username}', styles['Title']),
+        Paragraph(f'Generated {timezone.now():%Y-%m-%d %H:%M} UTC', styles['Normal']),
+        Spacer(1, 12),
+        Paragraph('Balances', styles['Heading2']),
+        Paragraph('Positive amounts are owed to you, negative amounts are owed by you.', styles['Normal']),
+        Spacer(1, 6),
+    ]
+    balance_rows = [[entry['username'], format_cents(entry['cents'])] for entry in summary['balances']]
+    story.extend(chunked_tables(['Counterparty', f"Amount ({summary['currency']})"], balance_rows, [300, 100]))
+    story.append(Paragraph(f"Net: {Money(summary['net_cents'], summary['currency'])}", styles['Heading3']))
+
+    story.extend([Spacer(1, 12), Paragraph('Expenses', styles['Heading2'])])
+    expense_rows = (
+        [
+            f'{split.expense.created_at:%Y-%m-%d}',
+            split.expense.title,
+            split.expense.created_by.username,
+            str(Money(split.expense.amount_cents, split.expense.currency)),
+            str(Money(split.amount_cents, split.expense.currency)),
+        ]
+        for split in splits.iterator(chunk_size=STATEMENT_TABLE_ROWS)
+    )
+    story.extend(
+        chunked_tables(['Date', 'Title', 'Paid by', 'Total', 'Your share'], expense_rows, [60, 180, 100, 70, 70])
+    )
+
+    SimpleDocTemplate(output, pagesize=A4, title=f'Statement {user.username}').build(story)
+
+
+RENDERERS = {
+    ReportJob.BALANCE_SHEET_CSV: (write_balance_sheet_csv, 'csv'),
+    ReportJob.STATEMENT_PDF: (write_statement_pdf, 'pdf'),
+}
+
+
+def run_job(job_id):
+    # Renders a claimed job into a temporary file, stores it in the default
+    # storage and records the outcome. Returns (job_id, status).
+    job = ReportJob.objects.select_related('user').get(pk=job_id)
+    render, extension = RENDERERS[job.kind]
+    try:
+        with tempfile.TemporaryFile() as output:
+            render(job, output)
+            output.seek(0)
+            job.file.save(f'{job.kind.lower()}-{job.id}.{extension}', File(output), save=False)
+    except Exception as error:
+        logger.exception('Report job %s failed', job_id)
+        job.status = ReportJob.FAILED
+        job.error = f'{type(error).__name__}: {error}'
+    else:
+        job.status = ReportJob.DONE
+        job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'file', 'error', 'finished_at'])
+    return job.id, job.status
@@ -0,0 +1,157 @@
+# expenses/rollups.py
+from collections import defaultdict
+
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .conflicts import lock_table, retry_on_conflict
+from .models import Expense, ExpenseSplit, SpendingRollup
+from .sqlite import write_transaction
+
+# Spending rollups are keyed (period, period_start, user_id, split_type,
+# currency) and hold [spent, splits, paid, expenses]: the user's share of
+# expenses and how many splits that is, and what they paid as creator and for
+# how many expenses, all ints (amounts in cents of that currency). Every expense
+# write applies its deltas here next to the balance ledger.
+
+FIELDS = ['spent_cents', 'splits', 'paid_cents', 'expenses']
+
+
+def new_deltas():
+    return defaultdict(lambda: [0, 0, 0, 0])
+
+
+def period_starts(created_at):
+    day = timezone.localtime(created_at).date()
+    return [(SpendingRollup.DAY, day), (SpendingRollup.MONTH, day.replace(day=1))]
+
+
+def expense_deltas(expense, splits, sign=1, deltas=None):
+    if deltas is None:
+        deltas = new_deltas()
+    for period, start in period_starts(expense.created_at):
+        paid = deltas[(period, start, expense.created_by_id, expense.split_type, expense.currency)]
+        paid[2] += sign * expense.amount_cents
+        paid[3] += sign
+        for split in splits:
+            spent = deltas[(period, start, split.user_id, expense.split_type, expense.currency)]
+            spent[0] += sign * split.amount_cents
+            spent[1] += sign
+    return deltas
+
+
+@retry_on_conflict
+def apply_deltas(deltas):
+    deltas = {key: values for key, values in deltas.items() if any(values)}
+    if not deltas:
+        return
+
+    starts = {start for _, start, _, _, _ in deltas}
+    users = {user for _, _, user, _, _ in deltas}
+
+    existing = (
+        SpendingRollup.objects
+        .select_for_update()
+        .filter(period_start__in=starts, user_id__in=users)
+    )
+    to_update = []
+    for rollup in existing:
+        key = (rollup.period, rollup.period_start, rollup.user_id, rollup.split_type, rollup.currency)
+        if key in deltas:
+            for field, delta in zip(FIELDS, deltas.pop(key)):
+                setattr(rollup, field, getattr(rollup, field) + delta)
+            to_update.append(rollup)
+
+    if to_update:
+        SpendingRollup.objects.bulk_update(to_update, FIELDS)
+    if deltas:
+        SpendingRollup.objects.bulk_create([
+            SpendingRollup(
+                period=period, period_start=start, user_id=user, split_type=split_type, currency=currency,
+                **dict(zip(FIELDS, values)),
+            )
+            for (period, start, user, split_type, currency), values in deltas.items()
+        ])
+
+
+def record_expense(expense, splits):
+    apply_deltas(expense_deltas(expense, splits))
+
+
+def record_expenses(expenses_with_splits):
+    deltas = new_deltas()
+    for expense, splits in expenses_with_splits:
+        expense_deltas(expense, splits, deltas=deltas)
+    apply_deltas(deltas)
+
+
+def revert_expense(expense, splits):
+    apply_deltas(expense_deltas(expense, splits, sign=-1))
+
+
+def replace_expense(old_expense, old_splits, new_expense, new_splits):
+    # An update can change the amount and split type as well as the splits, so
+    # `old_expense` is a copy taken before the update was saved.
+    deltas = expense_deltas(old_expense, old_splits, sign=-1)
+    expense_deltas(new_expense, new_splits, deltas=deltas)
+    apply_deltas(deltas)
+
+
+def expected_rollups():
+    # Rollups recomputed from scratch, as
+    # {(period, period_start, user, split_type, currency): [spent, splits, paid, expenses]}.
+    rollups = new_deltas()
+    truncations = [
+        (SpendingRollup.DAY, TruncDate),
+        (SpendingRollup.MONTH, lambda field: TruncMonth(field, output_field=DateField())),
+    ]
+    for period, trunc in truncations:
+        splits = (
+            ExpenseSplit.objects
+            .annotate(start=trunc('expense__created_at'))
+            .values('start', 'user', 'expense__split_type', 'expense__currency')
+            .annotate(total=Sum('amount_cents'), count=Count('id'))
+            .order_by()
+        )
+        for row in splits.iterator():
+            values = rollups[(period, row['start'], row['user'], row['expense__split_type'], row['expense__currency'])]
+            values[0] += row['total']
+            values[1] += row['count']
+
+        expenses = (
+            Expense.objects
+            .annotate(start=trunc('created_at'))
+            .values('start', 'created_by', 'split_type', 'currency')
+            .annotate(total=Sum('amount_cents'), count=Count('id'))
+            .order_by()
+        )
+        for row in expenses.iterator():
+            values = rollups[(period, row['start'], row['created_by'], row['split_type'], row['currency'])]
+            values[2] += row['total']
+            values[3] += row['count']
+    return dict(rollups)
+
+
+def current_rollups():
+    rows = SpendingRollup.objects.values_list('period', 'period_start', 'user_id', 'split_type', 'currency', *FIELDS)
+    return {tuple(row[:5]): list(row[5:]) for row in rows.iterator() if any(row[5:])}
+
+
+def rebuild(batch_size=1000):
+    # As in ledger.rebuild, writers wait until the rollups are rewritten.
+    with write_transaction():
+        lock_table(SpendingRollup)
+        expected = expected_rollups()
+        SpendingRollup.objects.all().delete()
+        SpendingRollup.objects.bulk_create(
+            (
+                SpendingRollup(
+                    period=period, period_start=start, user_id=user, split_type=split_type, currency=currency,
+                    **dict(zip(FIELDS, values)),
+                )
+                for (period, start, user, split_type, currency), values in expected.items()
+            ),
+            batch_size=batch_size,
+        )
+    return len(expected)
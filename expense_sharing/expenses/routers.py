@@ -0,0 +1,119 @@
+# expenses/routers.py
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+from . import caching
+
+# Read-heavy endpoints (expense retrieve, user_expenses, overall_expenses, the
+# balance sheet exports and analytics) may read from a replica, the database alias
+# named by settings.EXPENSES_READ_REPLICA. Everything else, and every write,
+# stays on the primary ('default').
+#
+# Routing is opt-in per request: views wrap their reads in replica_reads(), which
+# sets the alias ReadReplicaRouter hands out for reads. A replica lags behind the
+# primary, so a user who has just written keeps reading from the primary for
+# settings.EXPENSES_REPLICA_STICKY_SECONDS (read-your-writes). Writes are noted
+# in the expenses cache alias, so the window holds across workers when that alias
+# is shared.
+
+WROTE_KEY = 'wrote:{}'
+
+_read_alias = ContextVar('expenses_read_alias', default=None)
+
+
+def replica_alias():
+    return settings.EXPENSES_READ_REPLICA
+
+
+def reading_from_replica():
+    return _read_alias.get() is not None
+
+
+def record_write(user_id):
+    if replica_alias() and settings.EXPENSES_REPLICA_STICKY_SECONDS:
+        caching.get_cache().set(WROTE_KEY.format(user_id), True, settings.EXPENSES_REPLICA_STICKY_SECONDS)
+
+
+def read_alias(user_id):
+    # The alias reads of `user_id` should use: the replica, unless none is
+    # configured or the user wrote within the sticky window.
+    alias = replica_alias()
+    if alias and not caching.get_cache().get(WROTE_KEY.format(user_id)):
+        return alias
+    return DEFAULT_DB_ALIAS
+
+
+async def aread_alias(user_id):
+    alias = replica_alias()
+    if alias and not await caching.get_cache().aget(WROTE_KEY.format(user_id)):
+        return alias
+    return DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def using(alias):
+    # Routes reads within the block to `alias`, as returned by read_alias().
+    token = _read_alias.set(None if alias == DEFAULT_DB_ALIAS else alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def replica_reads(user_id):
+    with using(read_alias(user_id)):
+        yield
+
+
+def pinned(queryset):
+    # Streamed responses are evaluated after the view returns, outside
+    # replica_reads(); bind the queryset to the alias chosen now.
+    return queryset.using(queryset.db)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        if db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaReadsMixin:
+    # For viewsets: actions in `replica_actions` read from the replica (see
+    # replica_reads()), and successful writes by a user keep their reads on the
+    # primary for the sticky window.
+    replica_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions:
+            alias = read_alias(request.user.id)
+            self._replica_token = _read_alias.set(None if alias == DEFAULT_DB_ALIAS else alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._replica_token = None
+        if request.method not in SAFE_METHODS and response.status_code < 400 and request.user.is_authenticated:
+            record_write(request.user.id)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,8 +1,15 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
-from .models import Expense, ExpenseSplit
-from decimal import Decimal
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework.reverse import reverse
+from django.conf import settings
+import copy
+from .models import Expense, ExpenseSplit, Group, GroupMembership, ReportJob, SpendingRollup
+from . import allocation, caching, changes, fx, ledger, rollups
+from .money import format_cents, parse_cents
+from .sqlite import write_transaction
+from .conditional import PreconditionFailed
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
@@ -15,51 +22,450 @@ class UserSerializer(serializers.ModelSerializer):
         user = User.objects.create_user(**validated_data)
         return user
 
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    # Embeds the claims expenses.authentication.TokenClaimsJWTAuthentication reads,
+    # so read-only requests do not need a User query. Access tokens obtained from
+    # /api/token/refresh/ inherit them from the refresh token.
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['is_staff'] = user.is_staff
+        return token
+
+class PreloadedRelatedField(serializers.PrimaryKeyRelatedField):
+    # Looks objects up in context[context_key] ({id: object}) when the caller has
+    # already fetched them, instead of running one query per item.
+    context_key = None
+
+    def to_internal_value(self, data):
+        objects = self.context.get(self.context_key)
+        if objects is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return objects[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+class PreloadedUserField(PreloadedRelatedField):
+    context_key = 'users'
+
+class PreloadedGroupField(PreloadedRelatedField):
+    context_key = 'groups'
+
+class MoneyField(serializers.Field):
+    # A two-decimal amount such as "12.34" in the API, integer cents (1234) in
+    # validated data and on the models. Parsed and formatted without Decimal.
+    default_error_messages = {
+        'invalid': 'A valid number with at most 2 decimal places is required.',
+        'max_digits': 'Ensure that there are no more than {max_digits} digits in total.',
+    }
+
+    def __init__(self, max_digits=10, **kwargs):
+        self.max_digits = max_digits
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            cents = parse_cents(data)
+        except ValueError:
+            self.fail('invalid')
+        if abs(cents) >= 10 ** self.max_digits:
+            self.fail('max_digits', max_digits=self.max_digits)
+        return cents
+
+    def to_representation(self, value):
+        return format_cents(value)
+
+class CurrencyField(serializers.CharField):
+    # An ISO 4217 code that expenses.fx can convert: the default currency or one
+    # listed in the rates file.
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data).upper()
+        try:
+            fx.check_currency(value)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+        return value
+
 class ExpenseSplitSerializer(serializers.ModelSerializer):
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
-    amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    user = PreloadedUserField(queryset=User.objects.all())
+    amount = MoneyField(source='amount_cents', required=False)
     percentage = serializers.DecimalField(max_digits=5, decimal_places=2, required=False)
+    shares = serializers.IntegerField(min_value=0, required=False)
+    adjustment = MoneyField(source='adjustment_cents', required=False)
 
     class Meta:
         model = ExpenseSplit
-        fields = ['user', 'amount', 'percentage']
+        fields = ['user', 'amount', 'percentage', 'shares', 'adjustment']
+
+class SplitChangeSerializer(ExpenseSplitSerializer):
+    # One entry of a PATCH's split_changes: adds the user, changes the given fields
+    # of their split, or removes it.
+    remove = serializers.BooleanField(default=False)
+
+    class Meta(ExpenseSplitSerializer.Meta):
+        fields = ExpenseSplitSerializer.Meta.fields + ['remove']
+
+class BulkExpenseListSerializer(serializers.ListSerializer):
+    # Used by ExpenseSerializer(many=True) writes: all expenses and splits are
+    # inserted with bulk_create inside a single transaction.
+    batch_size = 1000
+
+    @staticmethod
+    def referenced_user_ids(data):
+        # Every split user id in a raw bulk payload, so they can be fetched at once.
+        user_ids = set()
+        for item in data if isinstance(data, list) else []:
+            for key in ('splits', 'split_changes'):
+                splits = item.get(key) if isinstance(item, dict) else None
+                for split in splits if isinstance(splits, list) else []:
+                    try:
+                        user_ids.add(int(split['user']))
+                    except (KeyError, TypeError, ValueError):
+                        continue
+        return user_ids
+
+    @staticmethod
+    def referenced_group_ids(data):
+        group_ids = set()
+        for item in data if isinstance(data, list) else []:
+            try:
+                group_ids.add(int(item['group']))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return group_ids
+
+    def validate(self, attrs):
+        # The items were checked one by one by ExpenseSerializer.validate; their
+        # split amounts are allocated here in a single integer pass.
+        rows = [(item['split_type'], item['amount_cents'], self.child.split_values(item)) for item in attrs]
+        for item, cents in zip(attrs, allocation.allocate_many(rows)):
+            ExpenseSerializer.assign_amounts(item['splits'], cents)
+        return attrs
+
+    def create(self, validated_data):
+        splits_data = [item.pop('splits') for item in validated_data]
+        with write_transaction():
+            expenses = Expense.objects.bulk_create(
+                [Expense(**item) for item in validated_data], batch_size=self.batch_size
+            )
+            splits = [
+                [ExpenseSplit(expense=expense, group_id=expense.group_id, **split_data) for split_data in expense_splits]
+                for expense, expense_splits in zip(expenses, splits_data)
+            ]
+            ExpenseSplit.objects.bulk_create(
+                [split for expense_splits in splits for split in expense_splits], batch_size=self.batch_size
+            )
+            ledger.record_expenses(zip(expenses, splits))
+            rollups.record_expenses(zip(expenses, splits))
+            changes.record_expenses(zip(expenses, splits))
+        return expenses
 
 class ExpenseSerializer(serializers.ModelSerializer):
     splits = ExpenseSplitSerializer(many=True)
+    # Updates only: the splits to add, change or remove, leaving the others as they are.
+    split_changes = SplitChangeSerializer(many=True, write_only=True, required=False)
+    group = PreloadedGroupField(queryset=Group.objects.all(), required=False, allow_null=True)
+    amount = MoneyField(source='amount_cents')
+    currency = CurrencyField(required=False)
+
+    # Split fields a write can set, by model name; `amount_cents` is always
+    # recomputed by allocation.
+    SPLIT_FIELDS = ['amount_cents', 'percentage', 'shares', 'adjustment_cents']
 
     class Meta:
         model = Expense
-        fields = ['id', 'title', 'amount', 'split_type', 'created_at', 'splits']
+        fields = [
+            'id', 'title', 'amount', 'currency', 'split_type', 'created_at', 'updated_at', 'group', 'version',
+            'splits', 'split_changes',
+        ]
+        read_only_fields = ['version']
+        list_serializer_class = BulkExpenseListSerializer
+
+    @staticmethod
+    def split_values(data):
+        # Per-split allocation input in integer units (see expenses.allocation).
+        field = allocation.VALUE_FIELDS.get(data['split_type'])
+        if field is None:
+            return [None] * len(data['splits'])
+        if field == 'percentage':
+            return [allocation.to_cents(split.get(field) or 0) for split in data['splits']]
+        # Shares and amounts are ints already.
+        return [split.get(field) or 0 for split in data['splits']]
+
+    @staticmethod
+    def assign_amounts(splits, cents):
+        for split, split_cents in zip(splits, cents):
+            split['amount_cents'] = split_cents
+
+    @staticmethod
+    def split_user_id(split):
+        # Validated splits carry the User; splits kept from the instance only its id.
+        return split['user'].pk if 'user' in split else split['user_id']
+
+    def merge_split_changes(self, data):
+        # Completes a partial update that touches the amount, split type or splits
+        # from the instance, applying split_changes to its current splits, so that
+        # validation and allocation always see the whole expense. Returns False
+        # when the splits are not affected at all.
+        changes = data.pop('split_changes', None)
+        if changes is not None and 'splits' in data:
+            raise serializers.ValidationError({'split_changes': 'Send either splits or split_changes, not both'})
+        if changes is None and not {'amount_cents', 'split_type', 'splits'} & data.keys():
+            return False
+
+        data.setdefault('amount_cents', self.instance.amount_cents)
+        data.setdefault('split_type', self.instance.split_type)
+        if 'splits' in data:
+            return True
+
+        splits = {
+            split.user_id: {'user_id': split.user_id, **{field: getattr(split, field) for field in self.SPLIT_FIELDS}}
+            for split in self.instance.splits.all()
+        }
+        changed = set()
+        for change in changes or []:
+            user_id = change['user'].pk
+            if user_id in changed:
+                raise serializers.ValidationError({'split_changes': f'User {user_id} is changed more than once'})
+            changed.add(user_id)
+            # Nested defaults are not applied in a PATCH, so `remove` may be missing.
+            if change.pop('remove', False):
+                if splits.pop(user_id, None) is None:
+                    raise serializers.ValidationError({'split_changes': f'User {user_id} has no split to remove'})
+            else:
+                splits.setdefault(user_id, {}).update(change)
+        data['splits'] = list(splits.values())
+        return True
+
+    def group_member_ids(self, group):
+        # Member ids per group, shared by all items of a bulk request.
+        members = self.context.setdefault('group_members', {})
+        if group.pk not in members:
+            members[group.pk] = set(group.memberships.values_list('user_id', flat=True))
+        return members[group.pk]
+
+    def validate_group_membership(self, data):
+        if self.instance is not None:
+            if 'group' in data and data['group'] != self.instance.group:
+                raise serializers.ValidationError({'group': 'The group of an expense cannot be changed'})
+            group = self.instance.group
+        else:
+            group = data.get('group')
+        if group is None:
+            return
+
+        members = self.group_member_ids(group)
+        request = self.context.get('request')
+        if request is not None and not request.user.is_staff and request.user.pk not in members:
+            raise serializers.ValidationError({'group': 'You are not a member of this group'})
+        outsiders = sorted({self.split_user_id(split) for split in data.get('splits', [])} - members)
+        if outsiders:
+            raise serializers.ValidationError(
+                {'splits': f"Users {', '.join(map(str, outsiders))} are not members of this group"}
+            )
 
     def validate(self, data):
-        split_type = data['split_type']
-        splits = data['splits']
-        total_amount = data['amount']
-
-        if split_type == 'EQUAL':
-            split_amount = total_amount / len(splits)
-            for split in splits:
-                split['amount'] = split_amount
-
-        elif split_type == 'EXACT':
-            total_split = sum(Decimal(split.get('amount', 0)) for split in splits)
-            if total_split != total_amount:
-                raise serializers.ValidationError("Sum of split amounts must equal the total expense amount")
-
-        elif split_type == 'PERCENTAGE':
-            total_percentage = sum(Decimal(split.get('percentage', 0)) for split in splits)
-            if total_percentage != 100:
-                raise serializers.ValidationError("Sum of percentages must be 100%")
-            for split in splits:
-                split['amount'] = (Decimal(split['percentage']) / 100) * total_amount
+        if self.instance is not None:
+            if not self.merge_split_changes(data):
+                self.validate_group_membership(data)
+                return data
+        elif 'split_changes' in data:
+            raise serializers.ValidationError({'split_changes': 'Only allowed when updating an expense'})
+
+        user_ids = [self.split_user_id(split) for split in data['splits']]
+        if len(set(user_ids)) != len(user_ids):
+            raise serializers.ValidationError({'splits': 'Each user can only have one split'})
+        self.validate_group_membership(data)
+
+        # Amounts are allocated in whole cents, giving leftover cents out by the
+        # largest-remainder method, so the splits always add up to the total.
+        total = data['amount_cents']
+        values = self.split_values(data)
+        try:
+            allocation.check(data['split_type'], total, values)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
 
+        if not isinstance(self.parent, BulkExpenseListSerializer):
+            self.assign_amounts(data['splits'], allocation.shares(data['split_type'], total, values))
         return data
 
     def create(self, validated_data):
         splits_data = validated_data.pop('splits')
-        expense = Expense.objects.create(**validated_data)
-        
+        with write_transaction():
+            expense = Expense.objects.create(**validated_data)
+
+            splits = [
+                ExpenseSplit.objects.create(expense=expense, group=expense.group, **split_data)
+                for split_data in splits_data
+            ]
+            ledger.record_expense(expense, splits)
+            rollups.record_expense(expense, splits)
+            changes.record_expense(expense, splits)
+            caching.invalidate_expenses([expense.id])
+
+        return expense
+
+    def update(self, instance, validated_data):
+        splits_data = validated_data.pop('splits', None)
+        with write_transaction():
+            # Keep the state before the update for the ledger and spending rollups.
+            before = copy.copy(instance)
+            old_splits = list(instance.splits.all())
+
+            # Fails when another update got in since the instance was read; the
+            # row stays locked until this transaction commits.
+            if not Expense.objects.bump_version(instance):
+                raise PreconditionFailed()
+            expense = super().update(instance, validated_data)
+
+            new_splits = old_splits
+            if splits_data is not None:
+                new_splits = self.apply_split_diff(expense, old_splits, splits_data)
+            ledger.replace_expense(before, old_splits, expense, new_splits)
+            rollups.replace_expense(before, old_splits, expense, new_splits)
+            changes.replace_expense(expense, old_splits, new_splits)
+            caching.invalidate_expenses([expense.id])
+
+        return expense
+
+    def apply_split_diff(self, expense, old_splits, splits_data):
+        # Matches the new splits to the existing rows by user: rows that changed
+        # are updated, new users inserted and missing ones deleted, one statement
+        # each however many splits the expense has. `old_splits` is left untouched.
+        # Extra rows of one user, which unique_split_user now rules out, are
+        # deleted as well.
+        old_by_user = {}
+        for split in old_splits:
+            old_by_user.setdefault(split.user_id, []).append(split)
+        new_splits, stale, to_create, to_update, changed_fields = [], [], [], [], set()
         for split_data in splits_data:
-            ExpenseSplit.objects.create(expense=expense, **split_data)
-        
-        return expense
\ No newline at end of file
+            user_splits = old_by_user.pop(self.split_user_id(split_data), [])
+            split = user_splits[0] if user_splits else None
+            stale.extend(user_splits[1:])
+            if split is None:
+                split = ExpenseSplit(expense=expense, group=expense.group, **split_data)
+                to_create.append(split)
+            else:
+                fields = [field for field in self.SPLIT_FIELDS if getattr(split, field) != split_data.get(field)]
+                if fields:
+                    split = copy.copy(split)
+                    for field in fields:
+                        setattr(split, field, split_data.get(field))
+                    to_update.append(split)
+                    changed_fields.update(fields)
+            new_splits.append(split)
+
+        stale.extend(split for user_splits in old_by_user.values() for split in user_splits)
+        if stale:
+            ExpenseSplit.objects.filter(pk__in=[split.pk for split in stale]).delete()
+        if to_update:
+            ExpenseSplit.objects.bulk_update(to_update, sorted(changed_fields))
+        if to_create:
+            ExpenseSplit.objects.bulk_create(to_create)
+        return new_splits
+
+class CounterpartyBalanceSerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    username = serializers.CharField()
+    amount = MoneyField(max_digits=14, source='cents')
+
+class BalanceSummarySerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    currency = serializers.CharField()
+    net = MoneyField(max_digits=14, source='net_cents')
+    balances = CounterpartyBalanceSerializer(many=True)
+
+class TransferSerializer(serializers.Serializer):
+    payer = serializers.IntegerField()
+    payee = serializers.IntegerField()
+    amount = MoneyField(max_digits=14, source='cents')
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'kind', 'user', 'status', 'error', 'created_at', 'started_at', 'finished_at', 'download_url']
+        read_only_fields = ['status', 'error', 'created_at', 'started_at', 'finished_at']
+
+    def get_download_url(self, job):
+        if job.status != ReportJob.DONE:
+            return None
+        return reverse('reportjob-download', args=[job.id], request=self.context.get('request'))
+
+class GroupMembershipSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GroupMembership
+        fields = ['user', 'role', 'joined_at']
+        read_only_fields = ['joined_at']
+
+class GroupSerializer(serializers.ModelSerializer):
+    members = GroupMembershipSerializer(source='memberships', many=True, read_only=True)
+
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'created_by', 'created_at', 'members']
+        read_only_fields = ['created_by', 'created_at']
+
+class PositionSerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    net = MoneyField(max_digits=14, source='net_cents')
+
+class GroupBalancesSerializer(serializers.Serializer):
+    group = serializers.IntegerField()
+    currency = serializers.CharField()
+    positions = PositionSerializer(many=True)
+    transfers = TransferSerializer(many=True)
+
+class ConversionQuerySerializer(serializers.Serializer):
+    # Query parameters of the balance and settlement endpoints: the currency to
+    # report in and the date of the exchange rates (today by default).
+    currency = CurrencyField(required=False)
+    date = serializers.DateField(required=False)
+
+class ChangesQuerySerializer(serializers.Serializer):
+    # Query parameters of /api/expenses/changes/. `since` is the next_since of the
+    # previous response; 0 asks for everything.
+    since = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_limit(self, value):
+        return min(value, settings.EXPENSES_MAX_PAGE_SIZE)
+
+class SpendingQuerySerializer(serializers.Serializer):
+    # Query parameters of /api/analytics/spending/.
+    GROUP_BY_CHOICES = ['user', 'split_type']
+
+    period = serializers.ChoiceField(choices=['day', 'month'], default='month')
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    user = serializers.IntegerField(required=False)
+    split_type = serializers.ChoiceField(choices=Expense.SPLIT_CHOICES, required=False)
+    group_by = serializers.CharField(required=False, default='user,split_type')
+
+    def validate_period(self, value):
+        return SpendingRollup.DAY if value == 'day' else SpendingRollup.MONTH
+
+    def validate_group_by(self, value):
+        group_by = [field for field in value.split(',') if field]
+        unknown = sorted(set(group_by) - set(self.GROUP_BY_CHOICES))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown fields: {', '.join(unknown)}")
+        return [field for field in self.GROUP_BY_CHOICES if field in group_by]
+
+class SpendingRowSerializer(serializers.Serializer):
+    period_start = serializers.DateField()
+    user = serializers.IntegerField(required=False)
+    split_type = serializers.CharField(required=False)
+    currency = serializers.CharField()
+    spent = MoneyField(max_digits=14, source='spent_total')
+    splits = serializers.IntegerField(source='split_count')
+    paid = MoneyField(max_digits=14, source='paid_total')
+    expenses = serializers.IntegerField(source='expense_count')
@@ -0,0 +1,109 @@
+# expenses/settlement.py
+"""Debt simplification.
+
+Works on net positions in integer cents: positive means the participant is owed
+money, negative means they owe money. Positions must sum to zero. Transfers are
+returned as (payer, payee, cents) tuples.
+
+This module has no Django dependencies so it can be benchmarked on its own
+(see benchmarks/settlement.py).
+"""
+import heapq
+from collections import defaultdict
+
+# Above this many non-zero participants the exact solver (exponential in the
+# number of participants) is replaced by the greedy one.
+EXACT_SOLVER_LIMIT = 12
+
+
+def net_positions(balances):
+    # balances: iterable of (creditor, debtor, cents) where debtor owes creditor.
+    positions = defaultdict(int)
+    for creditor, debtor, cents in balances:
+        positions[creditor] += cents
+        positions[debtor] -= cents
+    return {participant: cents for participant, cents in positions.items() if cents}
+
+
+def greedy_settle(positions):
+    # Repeatedly match the largest creditor with the largest debtor. Every transfer
+    # clears at least one of them, so n participants need at most n - 1 transfers.
+    # Runs in O(n log n).
+    creditors = [(-cents, participant) for participant, cents in positions.items() if cents > 0]
+    debtors = [(cents, participant) for participant, cents in positions.items() if cents < 0]
+    if sum(cents for cents, _ in debtors) + sum(-cents for cents, _ in creditors):
+        raise ValueError('Positions must sum to zero')
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, payee = heapq.heappop(creditors)
+        debt, payer = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((payer, payee, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, payee))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, payer))
+    return transfers
+
+
+def exact_settle(positions):
+    # The minimum number of transfers is n - k, where k is the largest number of
+    # disjoint zero-sum subsets the participants can be split into. Find that
+    # partition with a DP over subsets, then settle each subset greedily, which
+    # takes exactly (size - 1) transfers for a subset with no zero-sum split.
+    participants = [participant for participant, cents in positions.items() if cents]
+    amounts = [positions[participant] for participant in participants]
+    n = len(participants)
+    if sum(amounts):
+        raise ValueError('Positions must sum to zero')
+    if n == 0:
+        return []
+
+    full = (1 << n) - 1
+    sums = [0] * (full + 1)
+    groups = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + amounts[low.bit_length() - 1]
+        best = 0
+        rest = mask
+        while rest:
+            bit = rest & -rest
+            best = max(best, groups[mask ^ bit])
+            rest ^= bit
+        groups[mask] = best + (sums[mask] == 0)
+
+    # Walk back from the full set, removing one participant at a time along an
+    # optimal path; every time the remaining set sums to zero a group closes.
+    partition = []
+    current = []
+    mask = full
+    while mask:
+        if sums[mask] == 0 and current:
+            partition.append(current)
+            current = []
+        rest = mask
+        target = groups[mask] - (sums[mask] == 0)
+        while rest:
+            bit = rest & -rest
+            if groups[mask ^ bit] == target:
+                break
+            rest ^= bit
+        current.append(bit.bit_length() - 1)
+        mask ^= bit
+    partition.append(current)
+
+    transfers = []
+    for indexes in partition:
+        transfers.extend(greedy_settle({participants[i]: amounts[i] for i in indexes}))
+    return transfers
+
+
+def settle(positions, exact_limit=EXACT_SOLVER_LIMIT):
+    non_zero = {participant: cents for participant, cents in positions.items() if cents}
+    if len(non_zero) <= exact_limit:
+        return exact_settle(non_zero)
+    return greedy_settle(non_zero)
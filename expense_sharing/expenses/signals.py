@@ -0,0 +1,26 @@
+# expenses/signals.py
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import metrics, sqlite
+from .authentication import invalidate_user
+
+
+@receiver([post_save, post_delete], sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    # Covers UserViewSet.update/destroy as well as admin and shell edits.
+    invalidate_user(instance.pk)
+
+
+@receiver(connection_created)
+def record_queries(sender, connection, **kwargs):
+    # Fires again on reconnect; install() only adds the wrapper once.
+    metrics.install(connection)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        sqlite.apply_pragmas(connection)
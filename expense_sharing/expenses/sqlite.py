@@ -0,0 +1,51 @@
+# expenses/sqlite.py
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# Settings for running in production on SQLite. Every new SQLite connection
+# gets settings.EXPENSES_SQLITE_PRAGMAS (see expenses/signals.py): WAL lets
+# readers run alongside the writer, and busy_timeout makes a writer wait for the
+# lock instead of failing with "database is locked".
+#
+# SQLite has one writer at a time. A plain BEGIN takes the write lock only at
+# the transaction's first write. If another connection wrote in between, SQLite
+# cannot wait for the lock without risking a deadlock, so it fails straight away
+# and ignores busy_timeout. Expense writes read before they write (validation,
+# the ledger's SELECT ... FOR UPDATE), so they run in write_transaction(). That
+# starts with BEGIN IMMEDIATE and queues on the lock up front.
+
+
+def apply_pragmas(connection):
+    with connection.cursor() as cursor:
+        for name, value in settings.EXPENSES_SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def write_transaction(using=None):
+    # transaction.atomic() that takes SQLite's write lock when it begins. Nested
+    # blocks and other databases get a plain atomic().
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    immediate = (
+        settings.EXPENSES_SQLITE_IMMEDIATE_WRITES
+        and connection.vendor == 'sqlite'
+        and not connection.in_atomic_block
+    )
+    if not immediate:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    # The backend reads the mode when atomic() begins the transaction, and sets
+    # it from OPTIONS on connect, so connect first.
+    connection.ensure_connection()
+    previous = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = previous
+            yield
+    finally:
+        connection.transaction_mode = previous
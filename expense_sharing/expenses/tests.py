@@ -123,13 +123,32 @@
 #         self.assertEqual(response.status_code, status.HTTP_200_OK)
 #         self.assertEqual(len(response.data), 2)
 
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import IntegrityError, connection, connections
+from django.db.migrations.executor import MigrationExecutor
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from rest_framework import status
 from decimal import Decimal
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Expense, ExpenseSplit
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from io import StringIO
+from pathlib import Path
+import tempfile
+from unittest import mock
+from asgiref.sync import async_to_sync
+from datetime import date, timedelta
+from django.utils import timezone
+from .models import Expense, ExpenseChange, ExpenseSplit, Balance, Group, GroupMembership, ReportJob, SpendingRollup
+from . import allocation, caching, fx, ledger, metrics, pagination, reports, rollups, routers, settlement
+from .authentication import user_cache
+from .conditional import PreconditionFailed
+from .money import Money, format_cents, parse_cents
+from .serializers import ClaimsTokenObtainPairSerializer, ExpenseSerializer
 
 # expenses/test_tests.py
 
@@ -162,7 +181,7 @@ class ExpenseAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Expense.objects.count(), 1)
         self.assertEqual(ExpenseSplit.objects.count(), 2)
-        self.assertEqual(ExpenseSplit.objects.filter(amount=Decimal('50.00')).count(), 2)
+        self.assertEqual(ExpenseSplit.objects.filter(amount_cents=5000).count(), 2)
 
     def test_create_expense_exact_split(self):
         self.authenticate()
@@ -179,8 +198,8 @@ class ExpenseAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Expense.objects.count(), 1)
         self.assertEqual(ExpenseSplit.objects.count(), 2)
-        self.assertEqual(ExpenseSplit.objects.get(user=self.user1).amount, Decimal('60.00'))
-        self.assertEqual(ExpenseSplit.objects.get(user=self.user2).amount, Decimal('40.00'))
+        self.assertEqual(ExpenseSplit.objects.get(user=self.user1).amount_cents, 6000)
+        self.assertEqual(ExpenseSplit.objects.get(user=self.user2).amount_cents, 4000)
 
     def test_create_expense_percentage_split(self):
         self.authenticate()
@@ -197,8 +216,8 @@ class ExpenseAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Expense.objects.count(), 1)
         self.assertEqual(ExpenseSplit.objects.count(), 2)
-        self.assertEqual(ExpenseSplit.objects.get(user=self.user1).amount, Decimal('70.00'))
-        self.assertEqual(ExpenseSplit.objects.get(user=self.user2).amount, Decimal('30.00'))
+        self.assertEqual(ExpenseSplit.objects.get(user=self.user1).amount_cents, 7000)
+        self.assertEqual(ExpenseSplit.objects.get(user=self.user2).amount_cents, 3000)
 
     def test_invalid_percentage_split(self):
         self.authenticate()
@@ -214,15 +233,38 @@ class ExpenseAPITestCase(TestCase):
         response = self.client.post('/api/expenses/', data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_splits_always_add_up_to_the_amount(self):
+        self.authenticate()
+        user3 = User.objects.create_user(username='user3', password='password3')
+        data = {
+            'title': 'Test Expense',
+            'amount': '100.00',
+            'split_type': 'EQUAL',
+            'splits': [{'user': self.user1.id}, {'user': self.user2.id}, {'user': user3.id}],
+        }
+        response = self.client.post('/api/expenses/', data, format='json')
+        self.assertEqual([split['amount'] for split in response.data['splits']], ['33.34', '33.33', '33.33'])
+
+        data['split_type'] = 'SHARES'
+        data['splits'] = [{'user': self.user1.id, 'shares': 2}, {'user': self.user2.id, 'shares': 1}]
+        response = self.client.post('/api/expenses/', data, format='json')
+        self.assertEqual([split['amount'] for split in response.data['splits']], ['66.67', '33.33'])
+        self.assertEqual(response.data['splits'][0]['shares'], 2)
+
+        data['split_type'] = 'ADJUSTMENT'
+        data['splits'] = [{'user': self.user1.id, 'adjustment': '10.00'}, {'user': self.user2.id}]
+        response = self.client.post('/api/expenses/', data, format='json')
+        self.assertEqual([split['amount'] for split in response.data['splits']], ['55.00', '45.00'])
+
     def test_get_user_expenses(self):
         self.authenticate()
-        Expense.objects.create(title='User1 Expense', amount=100, split_type='EQUAL', created_by=self.user1)
-        Expense.objects.create(title='User2 Expense', amount=200, split_type='EQUAL', created_by=self.user2)
+        Expense.objects.create(title='User1 Expense', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+        Expense.objects.create(title='User2 Expense', amount_cents=20000, split_type='EQUAL', created_by=self.user2)
 
         response = self.client.get('/api/expenses/user_expenses/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['title'], 'User1 Expense')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['title'], 'User1 Expense')
 
     def test_get_overall_expenses(self):
         # Creating an admin user with necessary permissions
@@ -230,35 +272,35 @@ class ExpenseAPITestCase(TestCase):
         self.client.force_authenticate(user=admin_user)
 
         # Creating sample expenses
-        Expense.objects.create(title='User1 Expense', amount=100, split_type='EQUAL', created_by=self.user1)
-        Expense.objects.create(title='User2 Expense', amount=200, split_type='EQUAL', created_by=self.user2)
+        Expense.objects.create(title='User1 Expense', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+        Expense.objects.create(title='User2 Expense', amount_cents=20000, split_type='EQUAL', created_by=self.user2)
 
         # Accessing the overall expenses endpoint
         response = self.client.get('/api/expenses/overall_expenses/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
     def test_list_all_expenses_admin_only(self):
         admin_user = User.objects.create_superuser(username='admin', password='adminpass')
         self.client.force_authenticate(user=admin_user)
 
-        Expense.objects.create(title='User1 Expense', amount=100, split_type='EQUAL', created_by=self.user1)
-        Expense.objects.create(title='User2 Expense', amount=200, split_type='EQUAL', created_by=self.user2)
+        Expense.objects.create(title='User1 Expense', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+        Expense.objects.create(title='User2 Expense', amount_cents=20000, split_type='EQUAL', created_by=self.user2)
 
         response = self.client.get('/api/expenses/overall_expenses/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
     def test_user_expenses_admin_only(self):
         admin_user = User.objects.create_superuser(username='admin', password='adminpass')
         self.client.force_authenticate(user=admin_user)
 
-        Expense.objects.create(title='User1 Expense', amount=100, split_type='EQUAL', created_by=self.user1)
-        Expense.objects.create(title='User2 Expense', amount=200, split_type='EQUAL', created_by=self.user2)
+        Expense.objects.create(title='User1 Expense', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+        Expense.objects.create(title='User2 Expense', amount_cents=20000, split_type='EQUAL', created_by=self.user2)
 
         response = self.client.get('/api/expenses/user_expenses/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        # self.assertEqual(len(response.data), 2)
+        # self.assertEqual(len(response.data['results']), 2)
 
     def test_download_balance_sheet_admin_only(self):
         admin_user = User.objects.create_superuser(username='admin', password='adminpass')
@@ -267,3 +309,1557 @@ class ExpenseAPITestCase(TestCase):
         response = self.client.get('/api/expenses/download_balance_sheet/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response['Content-Disposition'], 'attachment; filename="balance_sheet.csv"')
+
+    def test_user_expenses_keyset_pagination(self):
+        for i in range(5):
+            Expense.objects.create(title=f'Expense {i}', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+
+        response = self.client.get('/api/expenses/user_expenses/', {'page_size': 2})
+        titles = [expense['title'] for expense in response.data['results']]
+        self.assertEqual(titles, ['Expense 4', 'Expense 3'])
+
+        # Rows inserted while paging land before the cursor and do not shift later pages.
+        Expense.objects.create(title='Late Expense', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            titles += [expense['title'] for expense in response.data['results']]
+        self.assertEqual(titles, ['Expense 4', 'Expense 3', 'Expense 2', 'Expense 1', 'Expense 0'])
+
+        response = self.client.get('/api/expenses/user_expenses/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_keyset_cursor_seeks_the_index(self):
+        # Later pages must start the index scan at the cursor, not walk every
+        # newer row and filter it out.
+        if connection.vendor != 'sqlite':
+            self.skipTest('checks the SQLite query plan')
+        queryset = pagination.KeysetPagination().apply_cursor(
+            Expense.objects.filter(created_by=self.user1), (timezone.now(), 1)
+        )
+        plan = queryset.order_by('-created_at', '-id')[:50].explain()
+        self.assertIn('USING INDEX expense_creator_created_idx (created_by_id=? AND created_at<?)', plan)
+
+    def test_participating_includes_created_and_split_expenses(self):
+        own = Expense.objects.create(title='Own', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+        shared = Expense.objects.create(title='Shared', amount_cents=10000, split_type='EQUAL', created_by=self.user2)
+        ExpenseSplit.objects.create(expense=shared, user=self.user1, amount_cents=5000)
+        ExpenseSplit.objects.create(expense=shared, user=self.user2, amount_cents=5000)
+        ExpenseSplit.objects.create(expense=own, user=self.user1, amount_cents=10000)
+        Expense.objects.create(title='Other', amount_cents=10000, split_type='EQUAL', created_by=self.user2)
+
+        response = self.client.get('/api/expenses/participating/', {'page_size': 1})
+        self.assertEqual([expense['title'] for expense in response.data['results']], ['Shared'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([expense['title'] for expense in response.data['results']], ['Own'])
+        self.assertIsNone(response.data['next'])
+
+    def test_download_balance_sheet_streams_rows(self):
+        admin_user = User.objects.create_superuser(username='admin', password='adminpass')
+        self.client.force_authenticate(user=admin_user)
+
+        for i in range(3):
+            expense = Expense.objects.create(title=f'Expense {i}', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+            ExpenseSplit.objects.create(expense=expense, user=self.user1, amount_cents=5000)
+            ExpenseSplit.objects.create(expense=expense, user=self.user2, amount_cents=5000)
+
+        response = self.client.get('/api/expenses/download_balance_sheet/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+
+        # One query for the expenses (with creators) and one for their splits (with users).
+        with self.assertNumQueries(2):
+            content = b''.join(response.streaming_content).decode()
+
+        lines = content.strip().splitlines()
+        self.assertEqual(lines[0], 'Title,Amount,Currency,Split Type,Created By,Created At,Split Info,Group')
+        self.assertEqual(len(lines), 4)
+        self.assertIn('user1: 50.00 (None%); user2: 50.00 (None%)', lines[1])
+
+
+class BalanceLedgerTestCase(TestCase):
+    def setUp(self):
+        caching.clear()
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username='user1', password='password1')
+        self.user2 = User.objects.create_user(username='user2', password='password2')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+
+    def authenticate_admin(self):
+        self.client.force_authenticate(user=self.admin)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.admin).access_token))
+
+    def create_expense(self, amount, splits):
+        self.client.force_authenticate(user=self.user1)
+        data = {'title': 'Dinner', 'amount': amount, 'split_type': 'EXACT', 'splits': splits}
+        response = self.client.post('/api/expenses/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def get_balances(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/balances/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_create_update_destroy_maintain_ledger(self):
+        expense_id = self.create_expense('100.00', [
+            {'user': self.user1.id, 'amount': '40.00'},
+            {'user': self.user2.id, 'amount': '60.00'},
+        ])
+        data = self.get_balances(self.user2)
+        self.assertEqual(data['net'], '-60.00')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_balances(self.user2), data)
+        self.assertEqual(data['balances'], [{'user': self.user1.id, 'username': 'user1', 'amount': '-60.00'}])
+        self.assertEqual(self.get_balances(self.user1)['net'], '60.00')
+
+        self.authenticate_admin()
+        response = self.client.put(f'/api/expenses/{expense_id}/', {
+            'title': 'Dinner', 'amount': '100.00', 'split_type': 'EXACT',
+            'splits': [{'user': self.user1.id, 'amount': '75.00'}, {'user': self.user2.id, 'amount': '25.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_balances(self.user2)['net'], '-25.00')
+
+        self.authenticate_admin()
+        response = self.client.delete(f'/api/expenses/{expense_id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.get_balances(self.user2)['balances'], [])
+
+    def test_rebuild_balances_command(self):
+        self.create_expense('30.00', [{'user': self.user2.id, 'amount': '30.00'}])
+        Balance.objects.update(amount_cents=0)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+        call_command('rebuild_balances', stdout=StringIO())
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+        self.assertEqual(Balance.objects.get(creditor=self.user1, debtor=self.user2).amount_cents, 3000)
+
+    def test_settle_balances(self):
+        user3 = User.objects.create_user(username='user3', password='password3')
+        # user2 owes user1 30, user3 owes user2 30: user3 can pay user1 directly.
+        self.create_expense('30.00', [{'user': self.user2.id, 'amount': '30.00'}])
+        expense = Expense.objects.create(title='Taxi', amount_cents=3000, split_type='EXACT', created_by=self.user2)
+        ledger.record_expense(expense, [ExpenseSplit.objects.create(expense=expense, user=user3, amount_cents=3000)])
+
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(f'/api/balances/settle/?users={self.user1.id},{self.user2.id},{user3.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['currency'], 'USD')
+        self.assertEqual(response.data['transfers'], [{'payer': user3.id, 'payee': self.user1.id, 'amount': '30.00'}])
+
+        response = self.client.get('/api/balances/settle/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_settle_only_uses_the_callers_balances(self):
+        # user2 owes user1 20 and user3 owes user2 50. user1 has no balance with
+        # user3 and must not learn about user2's.
+        user3 = User.objects.create_user(username='user3', password='password3')
+        self.create_expense('20.00', [{'user': self.user2.id, 'amount': '20.00'}])
+        expense = Expense.objects.create(title='Taxi', amount_cents=5000, split_type='EXACT', created_by=self.user2)
+        ledger.record_expense(expense, [ExpenseSplit.objects.create(expense=expense, user=user3, amount_cents=5000)])
+        url = f'/api/balances/settle/?users={self.user1.id},{self.user2.id},{user3.id}'
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['transfers'], [{'payer': self.user2.id, 'payee': self.user1.id, 'amount': '20.00'}])
+        self.client.force_authenticate(user=user3)
+        response = self.client.get(url)
+        self.assertEqual(response.data['transfers'], [{'payer': user3.id, 'payee': self.user2.id, 'amount': '50.00'}])
+        response = self.client.get(f'/api/balances/settle/?users={self.user1.id},{self.user2.id}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.authenticate_admin()
+        response = self.client.get(url)
+        self.assertEqual(response.data['transfers'], [
+            {'payer': user3.id, 'payee': self.user2.id, 'amount': '30.00'},
+            {'payer': user3.id, 'payee': self.user1.id, 'amount': '20.00'},
+        ])
+
+
+class SettlementTestCase(SimpleTestCase):
+    def assertSettles(self, positions, transfers):
+        remaining = dict(positions)
+        for payer, payee, cents in transfers:
+            self.assertGreater(cents, 0)
+            remaining[payer] += cents
+            remaining[payee] -= cents
+        self.assertFalse(any(remaining.values()))
+
+    def test_exact_settle_uses_zero_sum_subgroups(self):
+        positions = {1: 500, 2: -500, 3: 700, 4: -300, 5: -400}
+        transfers = settlement.exact_settle(positions)
+        self.assertSettles(positions, transfers)
+        self.assertEqual(len(transfers), 3)
+
+    def test_greedy_settle_needs_at_most_n_minus_one_transfers(self):
+        positions = {i: (i % 7) * 100 - 300 for i in range(1, 50)}
+        positions[0] = -sum(positions.values())
+        transfers = settlement.greedy_settle(positions)
+        self.assertSettles(positions, transfers)
+        self.assertLessEqual(len(transfers), len(positions) - 1)
+
+    def test_unbalanced_positions_are_rejected(self):
+        with self.assertRaises(ValueError):
+            settlement.settle({1: 100, 2: -50})
+
+
+class AllocationTestCase(SimpleTestCase):
+    def test_leftover_cents_go_to_largest_remainders(self):
+        self.assertEqual(allocation.allocate('EQUAL', 10000, [None] * 3), [3334, 3333, 3333])
+        # 33.33% / 33.33% / 33.34% of 1.00
+        self.assertEqual(allocation.allocate('PERCENTAGE', 100, [3333, 3333, 3334]), [33, 33, 34])
+        self.assertEqual(allocation.allocate('SHARES', 1000, [1, 2, 4]), [143, 286, 571])
+        self.assertEqual(allocation.allocate('ADJUSTMENT', 10000, [1000, 0, -500]), [4167, 3167, 2666])
+
+    def test_batch_mode_matches_single_allocation(self):
+        rows = [
+            ('EQUAL', total, [None] * count) for total in (1, 99, 10001) for count in (1, 3, 7)
+        ] + [('SHARES', 12345, [3, 1, 1, 2]), ('PERCENTAGE', 999, [2500, 2500, 5000])]
+        for (split_type, total, values), cents in zip(rows, allocation.allocate_many(rows)):
+            self.assertEqual(cents, allocation.allocate(split_type, total, values))
+            self.assertEqual(sum(cents), total)
+
+    def test_invalid_inputs_are_rejected(self):
+        for split_type, total, values in [
+            ('EXACT', 100, [60, 30]),
+            ('PERCENTAGE', 100, [6000, 3000]),
+            ('SHARES', 100, [0, 0]),
+            ('ADJUSTMENT', 100, [80, 30]),
+            ('EQUAL', 100, []),
+        ]:
+            with self.assertRaises(ValueError):
+                allocation.allocate(split_type, total, values)
+
+
+class BulkExpenseTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [User.objects.create_user(username=f'user{i}', password=f'password{i}') for i in range(5)]
+        self.client.force_authenticate(user=self.users[0])
+
+    def expense_data(self, index):
+        return {
+            'title': f'Expense {index}',
+            'amount': '90.00',
+            'split_type': 'EQUAL',
+            'splits': [{'user': user.id} for user in self.users[:3]],
+        }
+
+    def test_bulk_create_uses_constant_queries(self):
+        data = [self.expense_data(i) for i in range(50)]
+        # Fixed regardless of the number of items: user lookup, one insert per table
+        # (two for the splits, as SQLite caps the parameters per statement), ledger
+        # and rollup read and write, one change feed insert, plus savepoints.
+        with self.assertNumQueries(17):
+            response = self.client.post('/api/expenses/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 50)
+        self.assertEqual(Expense.objects.count(), 50)
+        self.assertEqual(ExpenseSplit.objects.filter(amount_cents=3000).count(), 150)
+        self.assertEqual(Balance.objects.get(creditor=self.users[0], debtor=self.users[1]).amount_cents, 150000)
+
+    def test_bulk_create_allocates_exact_cents(self):
+        data = [self.expense_data(i) for i in range(2)]
+        data[0]['amount'] = '100.00'
+        data[1].update(split_type='SHARES', splits=[{'user': user.id, 'shares': 1} for user in self.users[:3]])
+        data[1]['amount'] = '0.10'
+        response = self.client.post('/api/expenses/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        for expense_id, amounts in zip(response.data['ids'], [['33.34', '33.33', '33.33'], ['0.04', '0.03', '0.03']]):
+            splits = ExpenseSplit.objects.filter(expense_id=expense_id).order_by('id')
+            self.assertEqual([format_cents(split.amount_cents) for split in splits], amounts)
+
+    def test_bulk_create_reports_errors_per_item(self):
+        data = [self.expense_data(i) for i in range(3)]
+        data[1]['splits'].append({'user': 999})
+        data[2]['split_type'] = 'PERCENTAGE'
+        response = self.client.post('/api/expenses/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertEqual(Expense.objects.count(), 0)
+
+
+class BalanceSheetImportTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.client.force_authenticate(user=self.admin)
+        for username in ['viral', 'vaibhav', 'vaibhav2']:
+            User.objects.create_user(username=username, password='password')
+
+    def export(self):
+        response = self.client.get('/api/expenses/download_balance_sheet/')
+        return b''.join(response.streaming_content).decode()
+
+    def test_import_round_trips_export(self):
+        sample = Path(settings.BASE_DIR).parent / 'sample.csv'
+        out = StringIO()
+        call_command('import_balance_sheet', str(sample), '--chunk-size', '3', stdout=out)
+        self.assertIn('Imported 10 of 10 rows', out.getvalue())
+        self.assertEqual(ExpenseSplit.objects.count(), 20)
+
+        exported = self.export()
+        self.assertEqual(exported.splitlines(), sample.read_text().splitlines())
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+        Expense.objects.all().delete()
+        upload = SimpleUploadedFile('balance_sheet.csv', exported.encode(), content_type='text/csv')
+        response = self.client.post('/api/expenses/import_balance_sheet/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 10)
+        self.assertEqual(self.export(), exported)
+
+    def test_import_keeps_group_expenses_in_their_group(self):
+        viral, vaibhav, outsider = User.objects.filter(username__in=['viral', 'vaibhav', 'vaibhav2']).order_by('id')
+        group = Group.objects.create(name='Trip', created_by=viral)
+        GroupMembership.objects.create(group=group, user=viral, role=GroupMembership.ADMIN)
+        GroupMembership.objects.create(group=group, user=vaibhav)
+        expense = Expense.objects.create(
+            title='Hotel', amount_cents=9000, split_type='EQUAL', created_by=viral, group=group,
+        )
+        splits = [
+            ExpenseSplit.objects.create(expense=expense, user=user, amount_cents=4500, group=group)
+            for user in (viral, vaibhav)
+        ]
+        ledger.record_expense(expense, splits)
+        exported = self.export()
+        self.assertEqual(exported.splitlines()[1].rsplit(',', 1)[1], str(group.id))
+
+        Expense.objects.all().delete()
+        Balance.objects.all().delete()
+        upload = SimpleUploadedFile('balance_sheet.csv', exported.encode(), content_type='text/csv')
+        response = self.client.post('/api/expenses/import_balance_sheet/', {'file': upload}, format='multipart')
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(self.export(), exported)
+        self.assertEqual(ExpenseSplit.objects.filter(group=group).count(), 2)
+        self.assertEqual(ledger.current_balances(), {(group.id, viral.id, vaibhav.id, 'USD'): 4500})
+
+        header, row = exported.splitlines()
+        rows = [
+            row.replace('vaibhav:', 'vaibhav2:'),
+            row[:row.rindex(',') + 1] + str(group.id + 1),
+        ]
+        upload = SimpleUploadedFile('balance_sheet.csv', '\n'.join([header, *rows]).encode(), content_type='text/csv')
+        response = self.client.post('/api/expenses/import_balance_sheet/', {'file': upload}, format='multipart')
+        self.assertEqual(response.data['imported'], 0)
+        self.assertEqual([error['error'] for error in response.data['errors']], [
+            f'Users vaibhav2 are not members of group {group.id}', f'Unknown group: {group.id + 1}',
+        ])
+
+    def import_csv(self, content):
+        upload = SimpleUploadedFile('balance_sheet.csv', content.encode(), content_type='text/csv')
+        return self.client.post('/api/expenses/import_balance_sheet/', {'file': upload}, format='multipart')
+
+    def test_import_keeps_shares_and_adjustments(self):
+        viral, vaibhav = User.objects.filter(username__in=['viral', 'vaibhav']).order_by('id')
+        for split_type, splits in [
+            ('SHARES', [{'user': viral.id, 'shares': 1}, {'user': vaibhav.id, 'shares': 2}]),
+            ('ADJUSTMENT', [{'user': viral.id, 'adjustment': '2.00'}, {'user': vaibhav.id, 'adjustment': '0.00'}]),
+        ]:
+            response = self.client.post('/api/expenses/', {
+                'title': 'Taxi', 'amount': '10.00', 'split_type': split_type, 'splits': splits,
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        exported = self.export()
+        self.assertIn('viral: 3.33 (None%) shares=1; vaibhav: 6.67 (None%) shares=2', exported)
+        self.assertIn('viral: 6.00 (None%) adjustment=2.00; vaibhav: 4.00 (None%) adjustment=0.00', exported)
+
+        def splits():
+            fields = ('expense__split_type', 'amount_cents', 'shares', 'adjustment_cents')
+            return sorted(ExpenseSplit.objects.values_list(*fields))
+
+        exported_splits = splits()
+        Expense.objects.all().delete()
+        Balance.objects.all().delete()
+        self.assertEqual(self.import_csv(exported).data['imported'], 2)
+        self.assertEqual(self.export(), exported)
+        self.assertEqual(splits(), exported_splits)
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+        # Older exports carry neither; the amounts stand in for them.
+        legacy = exported
+        for suffix in [' shares=1', ' shares=2', ' adjustment=2.00', ' adjustment=0.00']:
+            legacy = legacy.replace(suffix, '')
+        Expense.objects.all().delete()
+        Balance.objects.all().delete()
+        self.assertEqual(self.import_csv(legacy).data['imported'], 2)
+        self.assertEqual(splits(), [
+            ('ADJUSTMENT', 400, None, 400), ('ADJUSTMENT', 600, None, 600),
+            ('SHARES', 333, 333, None), ('SHARES', 667, 667, None),
+        ])
+
+        header, row = exported.splitlines()[:2]
+        response = self.import_csv('\n'.join([header, row.replace(' shares=1', '')]))
+        self.assertEqual(response.data['errors'][0]['error'], 'Every SHARES split needs its shares')
+
+    def test_import_reports_bad_rows(self):
+        content = '\n'.join([
+            'Title,Amount,Split Type,Created By,Created At,Split Info',
+            'Lunch,20.00,Equal,viral,2024-10-19 15:18:03+00:00,viral: 10.00 (None%); nobody: 10.00 (None%)',
+            'Lunch,20.00,Sideways,viral,2024-10-19 15:18:03+00:00,viral: 20.00 (None%)',
+            'Lunch,20.00,Equal,viral,2024-10-19 15:18:03+00:00,viral: 20.00 (None%)',
+            # Checked like the API: splits that miss the total, repeated users.
+            'Lunch,100.00,Exact,viral,2024-10-19 15:18:03+00:00,viral: 5.00 (None%)',
+            'Lunch,20.00,Equal,viral,2024-10-19 15:18:03+00:00,viral: 10.00 (None%); viral: 10.00 (None%)',
+            'Lunch,20.00,Percentage,viral,2024-10-19 15:18:03+00:00,viral: 10.00 (40.00%); vaibhav: 10.00 (40.00%)',
+        ])
+        upload = SimpleUploadedFile('balance_sheet.csv', content.encode(), content_type='text/csv')
+        response = self.client.post('/api/expenses/import_balance_sheet/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 3, 5, 6, 7])
+        self.assertEqual([error['error'] for error in response.data['errors'][2:]], [
+            'Sum of split amounts must equal the total expense amount',
+            'Each user can only have one split',
+            'Sum of percentages must be 100%',
+        ])
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+
+class ExpenseQueryCountTestCase(TestCase):
+    # Guards against N+1 regressions: reads must cost the same number of queries
+    # however many expenses and splits they return.
+    def setUp(self):
+        caching.clear()
+        self.client = APIClient()
+        self.users = [User.objects.create_user(username=f'user{i}', password=f'password{i}') for i in range(10)]
+        self.owner = self.users[0]
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.expenses = [self.create_expense(self.owner, splits=len(self.users)) for _ in range(20)]
+
+    def create_expense(self, created_by, splits):
+        expense = Expense.objects.create(title='Dinner', amount_cents=10000, split_type='EQUAL', created_by=created_by)
+        ExpenseSplit.objects.bulk_create(
+            [ExpenseSplit(expense=expense, user=user, amount_cents=1000) for user in self.users[:splits]]
+        )
+        return expense
+
+    def test_retrieve_query_count(self):
+        self.client.force_authenticate(user=self.owner)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.owner).access_token))
+        # The expense and its splits; the user comes from authentication.
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/expenses/{self.expenses[0].id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['splits']), 10)
+
+        # Served from the cache.
+        with self.assertNumQueries(0):
+            cached = self.client.get(f'/api/expenses/{self.expenses[0].id}/')
+        self.assertEqual(cached.data, response.data)
+
+    def test_user_expenses_query_count(self):
+        self.client.force_authenticate(user=self.owner)
+        # One page of expenses and one query for all of their splits.
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/expenses/user_expenses/', {'page_size': 20})
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertTrue(all(len(expense['splits']) == 10 for expense in response.data['results']))
+
+    def test_overall_expenses_query_count(self):
+        self.client.force_authenticate(user=self.admin)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/expenses/overall_expenses/', {'page_size': 50})
+        self.assertEqual(len(response.data['results']), 20)
+
+
+class ExpenseCacheTestCase(TestCase):
+    def setUp(self):
+        caching.clear()
+        caching.reset_stats()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='password1')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.expense = Expense.objects.create(title='Dinner', amount_cents=10000, split_type='EQUAL', created_by=self.user)
+        ExpenseSplit.objects.create(expense=self.expense, user=self.user, amount_cents=10000)
+
+    def authenticate(self, user):
+        self.client.force_authenticate(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+
+    def test_update_invalidates_cached_expense(self):
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get(f'/api/expenses/{self.expense.id}/').data['title'], 'Dinner')
+
+        self.authenticate(self.admin)
+        response = self.client.patch(f'/api/expenses/{self.expense.id}/', {
+            'title': 'Lunch', 'amount': '100.00', 'split_type': 'EQUAL', 'splits': [{'user': self.user.id}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get(f'/api/expenses/{self.expense.id}/').data['title'], 'Lunch')
+        self.client.get(f'/api/expenses/{self.expense.id}/')
+
+        self.authenticate(self.admin)
+        stats = self.client.get('/api/expenses/cache_stats/').data
+        self.assertEqual(stats['expense'], {'hits': 1, 'misses': 2, 'hit_ratio': 1 / 3})
+
+    def test_cached_expense_still_checks_owner(self):
+        self.authenticate(self.user)
+        self.client.get(f'/api/expenses/{self.expense.id}/')
+
+        self.authenticate(self.admin)
+        response = self.client.get(f'/api/expenses/{self.expense.id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PermissionTestCase(TestCase):
+    def setUp(self):
+        caching.clear()
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username='user1', password='password1')
+        self.user2 = User.objects.create_user(username='user2', password='password2')
+        self.expense = Expense.objects.create(title='Dinner', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+
+    def test_user_detail_is_limited_to_self(self):
+        self.authenticate(self.user1)
+        # Token user and the requested user; the token is validated once.
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/users/{self.user1.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(f'/api/users/{self.user2.id}/').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.delete(f'/api/users/{self.user2.id}/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_expense_changes_are_admin_only(self):
+        self.authenticate(self.user1)
+        response = self.client.delete(f'/api/expenses/{self.expense.id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.data['detail'], 'Only admin can modify an expense')
+
+        self.client.credentials()
+        response = self.client.get(f'/api/expenses/{self.expense.id}/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AuthenticationTestCase(TestCase):
+    def setUp(self):
+        caching.clear()
+        user_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='password1')
+
+    def obtain_token(self):
+        response = self.client.post('/api/token/', {'username': 'user1', 'password': 'password1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['access']
+
+    @override_settings(EXPENSES_STATELESS_READS=True)
+    def test_reads_trust_token_claims(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.obtain_token())
+        # Only the ledger rows; the user comes from the token claims.
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/balances/')
+        self.assertEqual(response.data['user'], self.user.id)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/expenses/user_expenses/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_demoted_admin_loses_admin_reads(self):
+        # Without stateless reads, is_staff comes from the user, not the token.
+        self.user.is_staff = True
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.obtain_token())
+        self.assertEqual(self.client.get('/api/expenses/overall_expenses/').status_code, status.HTTP_200_OK)
+
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/expenses/overall_expenses/').status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(EXPENSES_STATELESS_READS=True):
+            self.assertEqual(self.client.get('/api/expenses/overall_expenses/').status_code, status.HTTP_200_OK)
+
+    def test_writes_use_cached_user_until_it_changes(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.user).access_token))
+        data = {'title': 'Lunch', 'amount': '10.00', 'split_type': 'EQUAL', 'splits': [{'user': self.user.id}]}
+        self.client.post('/api/expenses/', data, format='json')
+        self.assertIsNotNone(user_cache.get(self.user.id))
+
+        response = self.client.put(
+            f'/api/users/{self.user.id}/', {'username': 'renamed', 'password': 'password1'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(user_cache.get(self.user.id))
+
+        response = self.client.delete(f'/api/users/{self.user.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.post('/api/expenses/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        caching.clear()
+        user_cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password1')
+        self.user2 = User.objects.create_user(username='user2', password='password2')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.expense = Expense.objects.create(title='Dinner', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+        splits = [
+            ExpenseSplit.objects.create(expense=self.expense, user=self.user1, amount_cents=5000),
+            ExpenseSplit.objects.create(expense=self.expense, user=self.user2, amount_cents=5000),
+        ]
+        ledger.record_expense(self.expense, splits)
+
+    def headers(self, user):
+        token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+        return {'Authorization': f'Bearer {token}'}
+
+    async def test_expense_detail(self):
+        response = await self.async_client.get(f'/api/async/expenses/{self.expense.id}/', headers=self.headers(self.user1))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['title'], 'Dinner')
+        self.assertEqual(response.json()['splits'][0]['amount'], '50.00')
+
+        response = await self.async_client.get(f'/api/async/expenses/{self.expense.id}/', headers=self.headers(self.user2))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = await self.async_client.get('/api/async/expenses/0/', headers=self.headers(self.user1))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get(f'/api/async/expenses/{self.expense.id}/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_user_expenses_and_balances_match_sync_views(self):
+        response = await self.async_client.get('/api/async/expenses/user_expenses/', headers=self.headers(self.user1))
+        self.assertEqual([expense['id'] for expense in response.json()['results']], [self.expense.id])
+        self.assertIsNone(response.json()['next'])
+
+        response = await self.async_client.get('/api/async/balances/', headers=self.headers(self.user2))
+        self.assertEqual(response.json()['net'], '-50.00')
+        self.assertEqual(response.json()['balances'], [{'user': self.user1.id, 'username': 'user1', 'amount': '-50.00'}])
+
+    async def test_download_balance_sheet_streams_for_admin(self):
+        response = await self.async_client.get('/api/async/expenses/download_balance_sheet/', headers=self.headers(self.user1))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = await self.async_client.get('/api/async/expenses/download_balance_sheet/', headers=self.headers(self.admin))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertTrue(content.startswith('Title,Amount,Currency,Split Type'))
+        self.assertIn('user2: 50.00', content)
+
+    async def test_demoted_or_deactivated_user_is_read_from_the_database(self):
+        # Without stateless reads, the token's is_staff claim is not trusted.
+        headers = self.headers(self.admin)
+        self.admin.is_staff = False
+        await self.admin.asave()
+        url = '/api/async/expenses/download_balance_sheet/'
+        response = await self.async_client.get(url, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(EXPENSES_STATELESS_READS=True):
+            response = await self.async_client.get(url, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        headers = self.headers(self.user1)
+        self.user1.is_active = False
+        await self.user1.asave()
+        response = await self.async_client.get('/api/async/balances/', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ReportJobTestCase(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username='user1', password='password1')
+        self.user2 = User.objects.create_user(username='user2', password='password2')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        expense = Expense.objects.create(title='Dinner', amount_cents=10000, split_type='EQUAL', created_by=self.user1)
+        splits = [
+            ExpenseSplit.objects.create(expense=expense, user=self.user1, amount_cents=5000),
+            ExpenseSplit.objects.create(expense=expense, user=self.user2, amount_cents=5000),
+        ]
+        ledger.record_expense(expense, splits)
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+
+    def run_worker(self):
+        call_command('run_report_worker', '--once', '--processes', '1', stdout=StringIO())
+
+    def test_statement_pdf_lifecycle(self):
+        self.authenticate(self.user2)
+        response = self.client.post('/api/reports/', {'kind': 'STATEMENT_PDF'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data['id']
+        self.assertEqual(response.data['user'], self.user2.id)
+        self.assertEqual(response.data['status'], 'PENDING')
+        self.assertEqual(self.client.get(f'/api/reports/{job_id}/download/').status_code, status.HTTP_409_CONFLICT)
+
+        self.run_worker()
+        response = self.client.get(f'/api/reports/{job_id}/')
+        self.assertEqual(response.data['status'], 'DONE')
+        self.assertTrue(response.data['download_url'].endswith(f'/api/reports/{job_id}/download/'))
+
+        response = self.client.get(f'/api/reports/{job_id}/download/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        # Jobs are only visible to whoever requested them.
+        self.authenticate(self.user1)
+        self.assertEqual(self.client.get(f'/api/reports/{job_id}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/reports/').data['results'], [])
+
+    def test_balance_sheet_csv_is_admin_only(self):
+        self.authenticate(self.user1)
+        response = self.client.post('/api/reports/', {'kind': 'BALANCE_SHEET_CSV'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post('/api/reports/', {'kind': 'STATEMENT_PDF', 'user': self.user2.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.authenticate(self.admin)
+        job_id = self.client.post('/api/reports/', {'kind': 'BALANCE_SHEET_CSV'}, format='json').data['id']
+        self.run_worker()
+        content = b''.join(self.client.get(f'/api/reports/{job_id}/download/').streaming_content).decode()
+        self.assertTrue(content.startswith('Title,Amount,Currency,Split Type'))
+        self.assertIn('user2: 50.00', content)
+
+    def test_jobs_are_claimed_once_and_stale_jobs_retried(self):
+        job = ReportJob.objects.create(kind=ReportJob.STATEMENT_PDF, requested_by=self.user1, user=self.user1)
+        self.assertEqual(reports.claim_job(), job.id)
+        self.assertIsNone(reports.claim_job())
+
+        ReportJob.objects.filter(pk=job.id).update(started_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(reports.requeue_stale_jobs(), (1, 0))
+        self.assertEqual(reports.claim_job(), job.id)
+
+        ReportJob.objects.filter(pk=job.id).update(
+            started_at=timezone.now() - timedelta(days=1), attempts=settings.EXPENSES_REPORT_MAX_ATTEMPTS
+        )
+        self.assertEqual(reports.requeue_stale_jobs(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (ReportJob.FAILED, 'Timed out'))
+
+
+class GroupTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password1')
+        self.bob = User.objects.create_user(username='bob', password='password2')
+        self.carol = User.objects.create_user(username='carol', password='password3')
+        self.outsider = User.objects.create_user(username='dave', password='password4')
+
+        self.authenticate(self.alice)
+        self.group = self.client.post('/api/groups/', {'name': 'Trip'}, format='json').data['id']
+        for user in (self.bob, self.carol):
+            response = self.client.post(f'/api/groups/{self.group}/members/', {'user': user.id}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+
+    def add_expense(self, user, amount, users, in_group=True):
+        self.authenticate(user)
+        return self.client.post('/api/expenses/', {
+            'title': 'Expense',
+            'amount': amount,
+            'split_type': 'EQUAL',
+            'group': self.group if in_group else None,
+            'splits': [{'user': other.id} for other in users],
+        }, format='json')
+
+    def test_group_expenses_are_scoped_to_members(self):
+        response = self.add_expense(self.alice, '90.00', [self.alice, self.bob, self.carol])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ExpenseSplit.objects.filter(group_id=self.group).count(), 3)
+        self.add_expense(self.alice, '10.00', [self.alice, self.outsider], in_group=False)
+
+        response = self.add_expense(self.alice, '10.00', [self.alice, self.outsider])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('splits', response.data)
+        response = self.add_expense(self.outsider, '10.00', [self.outsider])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('group', response.data)
+
+        self.authenticate(self.bob)
+        response = self.client.get(f'/api/groups/{self.group}/expenses/')
+        self.assertEqual([expense['amount'] for expense in response.data['results']], ['90.00'])
+        self.authenticate(self.outsider)
+        response = self.client.get(f'/api/groups/{self.group}/expenses/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/api/groups/').data['results'], [])
+
+    def test_group_balances_are_kept_apart(self):
+        self.add_expense(self.alice, '90.00', [self.alice, self.bob, self.carol])
+        self.add_expense(self.bob, '30.00', [self.bob, self.carol])
+        # Outside the group: bob owes alice 5.00 more, which the group must not see.
+        self.add_expense(self.alice, '10.00', [self.alice, self.bob], in_group=False)
+        self.assertEqual(Balance.objects.filter(group_id=self.group).count(), 3)
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+        self.authenticate(self.carol)
+        response = self.client.get(f'/api/groups/{self.group}/balances/')
+        self.assertEqual(response.data['positions'], [
+            {'user': self.alice.id, 'net': '60.00'},
+            {'user': self.bob.id, 'net': '-15.00'},
+            {'user': self.carol.id, 'net': '-45.00'},
+        ])
+        self.assertEqual(sum(Decimal(transfer['amount']) for transfer in response.data['transfers']), Decimal('60.00'))
+
+        # The user-level view still nets across groups.
+        self.authenticate(self.bob)
+        self.assertEqual(self.client.get('/api/balances/').data['net'], '-20.00')
+
+        self.authenticate(self.alice)
+        response = self.client.get(f'/api/groups/{self.group}/download_balance_sheet/')
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(content.strip().splitlines()), 3)
+
+    def test_membership_management(self):
+        self.authenticate(self.bob)
+        response = self.client.post(f'/api/groups/{self.group}/members/', {'user': self.outsider.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(
+            self.client.delete(f'/api/groups/{self.group}/members/{self.carol.id}/').status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+        # Members may leave.
+        self.assertEqual(
+            self.client.delete(f'/api/groups/{self.group}/members/{self.bob.id}/').status_code,
+            status.HTTP_204_NO_CONTENT,
+        )
+
+        self.authenticate(self.alice)
+        response = self.client.delete(f'/api/groups/{self.group}/members/{self.alice.id}/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f'/api/groups/{self.group}/')
+        self.assertEqual({member['user'] for member in response.data['members']}, {self.alice.id, self.carol.id})
+
+
+class SpendingRollupTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username='user1', password='password1')
+        self.user2 = User.objects.create_user(username='user2', password='password2')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+
+    def authenticate(self, user):
+        token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def create_expense(self, amount, split_type='EQUAL', **split_fields):
+        self.authenticate(self.user1)
+        response = self.client.post('/api/expenses/', {
+            'title': 'Dinner',
+            'amount': amount,
+            'split_type': split_type,
+            'splits': [{'user': self.user1.id, **split_fields}, {'user': self.user2.id, **split_fields}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def monthly(self, user):
+        return {
+            rollup.split_type: (rollup.spent_cents, rollup.splits, rollup.paid_cents, rollup.expenses)
+            for rollup in SpendingRollup.objects.filter(period=SpendingRollup.MONTH, user=user)
+        }
+
+    def test_writes_keep_rollups_in_step(self):
+        expense_id = self.create_expense('100.00')
+        self.create_expense('30.00')
+        self.assertEqual(self.monthly(self.user1), {'EQUAL': (6500, 2, 13000, 2)})
+        self.assertEqual(self.monthly(self.user2), {'EQUAL': (6500, 2, 0, 0)})
+
+        self.authenticate(self.admin)
+        response = self.client.put(f'/api/expenses/{expense_id}/', {
+            'title': 'Dinner', 'amount': '60.00', 'split_type': 'SHARES',
+            'splits': [{'user': self.user1.id, 'shares': 1}, {'user': self.user2.id, 'shares': 2}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.monthly(self.user2)['SHARES'], (4000, 1, 0, 0))
+        self.assertEqual(self.monthly(self.user1)['EQUAL'], (1500, 1, 3000, 1))
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+
+        self.client.delete(f'/api/expenses/{expense_id}/')
+        self.assertEqual(self.monthly(self.user2)['SHARES'], (0, 0, 0, 0))
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+
+        SpendingRollup.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', '--verify', stdout=StringIO())
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.monthly(self.user1)['EQUAL'], (1500, 1, 3000, 1))
+
+    def test_group_and_user_deletes_keep_rollups_in_step(self):
+        self.authenticate(self.user1)
+        group = self.client.post('/api/groups/', {'name': 'Trip'}, format='json').data['id']
+        self.client.post(f'/api/groups/{group}/members/', {'user': self.user2.id}, format='json')
+        response = self.client.post('/api/expenses/', {
+            'title': 'Hotel', 'amount': '80.00', 'split_type': 'EQUAL', 'group': group,
+            'splits': [{'user': self.user1.id}, {'user': self.user2.id}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.create_expense('30.00')
+
+        response = self.client.delete(f'/api/groups/{group}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(rollups.current_rollups(), rollups.expected_rollups())
+        self.assertEqual(self.monthly(self.user2), {'EQUAL': (1500, 1, 0, 0)})
+
+        # user2 leaves: their own expense goes, user1's loses their split.
+        self.authenticate(self.user2)
+        self.client.post('/api/expenses/', {
+            'title': 'Taxi', 'amount': '20.00', 'split_type': 'EQUAL',
+            'splits': [{'user': self.user1.id}, {'user': self.user2.id}],
+        }, format='json')
+        response = self.client.delete(f'/api/users/{self.user2.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(rollups.current_rollups(), rollups.expected_rollups())
+        self.assertEqual(self.monthly(self.user1), {'EQUAL': (1500, 1, 3000, 1)})
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+    @override_settings(EXPENSES_STATELESS_READS=True)
+    def test_spending_endpoint(self):
+        self.create_expense('100.00')
+        self.create_expense('10.00', split_type='PERCENTAGE', percentage='50.00')
+        month = timezone.localdate().replace(day=1).isoformat()
+
+        self.authenticate(self.admin)
+        # One aggregate over the rollup table, however many splits exist.
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/analytics/spending/', {'group_by': 'split_type'})
+        self.assertEqual(response.data['results'], [
+            {
+                'period_start': month, 'split_type': 'EQUAL', 'currency': 'USD',
+                'spent': '100.00', 'splits': 2, 'paid': '100.00', 'expenses': 1,
+            },
+            {
+                'period_start': month, 'split_type': 'PERCENTAGE', 'currency': 'USD',
+                'spent': '10.00', 'splits': 2, 'paid': '10.00', 'expenses': 1,
+            },
+        ])
+
+        self.authenticate(self.user2)
+        response = self.client.get('/api/analytics/spending/', {'period': 'day', 'group_by': 'user'})
+        self.assertEqual(response.data['results'], [{
+            'period_start': timezone.localdate().isoformat(), 'user': self.user2.id, 'currency': 'USD',
+            'spent': '55.00', 'splits': 2, 'paid': '0.00', 'expenses': 0,
+        }])
+        response = self.client.get('/api/analytics/spending/', {'user': self.user1.id})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get('/api/analytics/spending/', {'group_by': 'title'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        caching.clear()
+        metrics.reset()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='password1')
+        self.expense = Expense.objects.create(title='Dinner', amount_cents=10000, split_type='EQUAL', created_by=self.user)
+        ExpenseSplit.objects.create(expense=self.expense, user=self.user, amount_cents=10000)
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    @override_settings(EXPENSES_STATELESS_READS=True)
+    def test_requests_are_recorded_per_view(self):
+        with override_settings(EXPENSES_SERVER_TIMING=True):
+            response = self.client.get(f'/api/expenses/{self.expense.id}/')
+        # The expense and its splits, as in ExpenseQueryCountTestCase.
+        self.assertTrue(response['Server-Timing'].startswith('db;desc="2 queries";dur='))
+
+        body = metrics.render()
+        self.assertIn('expenses_http_requests_total{view="expense-detail",method="GET",status="200"} 1\n', body)
+        self.assertIn('expenses_http_request_queries_bucket{view="expense-detail",method="GET",le="2"} 1\n', body)
+        self.assertIn('expenses_http_request_queries_sum{view="expense-detail",method="GET"} 2\n', body)
+        self.assertIn('expenses_cache_requests_total{cache="expense",result="miss"}', body)
+        self.assertNotIn('Server-Timing', self.client.get(f'/api/expenses/{self.expense.id}/'))
+
+    @override_settings(EXPENSES_STATELESS_READS=True)
+    async def test_async_view_queries_are_attributed(self):
+        # Async ORM queries run in a worker thread but still count for the request.
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        response = await self.async_client.get(
+            f'/api/async/expenses/{self.expense.id}/', headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            'expenses_http_request_queries_sum{view="async_expense_detail",method="GET"} 2\n', metrics.render()
+        )
+
+    @override_settings(EXPENSES_SLOW_QUERY_MS=0, EXPENSES_STATELESS_READS=True)
+    def test_slow_queries_are_logged(self):
+        with self.assertLogs('expenses.sql', 'WARNING') as logs:
+            self.client.get(f'/api/expenses/{self.expense.id}/')
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('in expense-detail: SELECT', logs.output[0])
+        self.assertIn('expenses_slow_queries_total{view="expense-detail"} 2\n', metrics.render())
+
+    def test_metrics_are_admin_only_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.credentials()
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer not-a-jwt')
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+
+        admin = User.objects.create_superuser(username='admin', password='adminpass')
+        token = ClaimsTokenObtainPairSerializer.get_token(admin).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_200_OK)
+
+    @override_settings(EXPENSES_METRICS_TOKEN='scrape-secret')
+    def test_metrics_token(self):
+        # A user's JWT is not the scrape token.
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer scrape-secret')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+
+class SplitUpdateTestCase(TestCase):
+    def setUp(self):
+        caching.clear()
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.users = [User.objects.create_user(username=f'user{i}', password=f'password{i}') for i in range(4)]
+        self.client.force_authenticate(user=self.admin)
+
+    def create_expense(self, users, split_type='SHARES', amount='90.00'):
+        response = self.client.post('/api/expenses/', {
+            'title': 'Trip', 'amount': amount, 'split_type': split_type,
+            'splits': [{'user': user.id, 'shares': 1} for user in users],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Expense.objects.get(pk=response.data['id'])
+
+    def assert_ledger_consistent(self):
+        self.assertEqual(ledger.current_balances(), ledger.expected_balances())
+        self.assertEqual(rollups.current_rollups(), rollups.expected_rollups())
+
+    def test_split_changes_update_rows_in_place(self):
+        expense = self.create_expense(self.users[:3])
+        split_ids = dict(expense.splits.values_list('user_id', 'id'))
+
+        response = self.client.patch(f'/api/expenses/{expense.id}/', {'split_changes': [
+            {'user': self.users[0].id, 'shares': 4},
+            {'user': self.users[1].id, 'remove': True},
+            {'user': self.users[3].id, 'shares': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        splits = {split['user']: split['amount'] for split in response.data['splits']}
+        self.assertEqual(splits, {self.users[0].id: '60.00', self.users[2].id: '15.00', self.users[3].id: '15.00'})
+        # Kept participants keep their rows.
+        remaining = dict(expense.splits.values_list('user_id', 'id'))
+        self.assertEqual(remaining[self.users[0].id], split_ids[self.users[0].id])
+        self.assertEqual(remaining[self.users[2].id], split_ids[self.users[2].id])
+        self.assert_ledger_consistent()
+
+        # Only the title: the splits are left alone.
+        response = self.client.patch(f'/api/expenses/{expense.id}/', {'title': 'Road trip'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(dict(expense.splits.values_list('user_id', 'id')), remaining)
+
+        # A new amount is reallocated over the current splits.
+        response = self.client.patch(f'/api/expenses/{expense.id}/', {'amount': '120.00'}, format='json')
+        self.assertEqual(sorted(split['amount'] for split in response.data['splits']), ['20.00', '20.00', '80.00'])
+        self.assert_ledger_consistent()
+
+    def test_invalid_split_changes(self):
+        expense = self.create_expense(self.users[:2])
+        cases = [
+            {'split_changes': [{'user': self.users[3].id, 'remove': True}]},
+            {'split_changes': [{'user': self.users[0].id, 'shares': 2}, {'user': self.users[0].id, 'shares': 3}]},
+            {'split_changes': [], 'splits': [{'user': self.users[0].id, 'shares': 1}]},
+            {'splits': [{'user': self.users[0].id, 'shares': 1}, {'user': self.users[0].id, 'shares': 1}]},
+        ]
+        for data in cases:
+            response = self.client.patch(f'/api/expenses/{expense.id}/', data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+
+    def test_update_queries_do_not_grow_with_splits(self):
+        users = User.objects.bulk_create([User(username=f'member{i}', password='!') for i in range(100)])
+        counts = []
+        for size, newcomer in [(10, self.users[0]), (100, self.users[1])]:
+            expense = self.create_expense(users[:size], split_type='EQUAL', amount='1000.00')
+            # One participant leaves, one joins and every share changes.
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch(f'/api/expenses/{expense.id}/', {'amount': '2000.00', 'split_changes': [
+                    {'user': users[0].id, 'remove': True}, {'user': newcomer.id},
+                ]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+        # Nothing runs per split; only SQLite's cap on parameters per statement
+        # splits the larger rollup update into two batches.
+        self.assertLessEqual(counts[1], counts[0] + 1)
+        self.assert_ledger_consistent()
+
+    def test_split_diff_deletes_extra_rows_of_a_user(self):
+        expense = self.create_expense(self.users[:2])
+        kept, extra = expense.splits.order_by('id')
+        # As a user's second row would have looked before unique_split_user.
+        extra.user_id = kept.user_id
+        new_splits = ExpenseSerializer(expense).apply_split_diff(
+            expense, [kept, extra], [{'user': self.users[0], 'amount_cents': 9000, 'shares': 1}]
+        )
+        self.assertEqual([split.pk for split in new_splits], [kept.pk])
+        self.assertEqual(list(expense.splits.values_list('pk', 'amount_cents')), [(kept.pk, 9000)])
+
+
+class DuplicateSplitMigrationTestCase(TransactionTestCase):
+    def test_duplicate_splits_are_merged(self):
+        before, after = [('expenses', '0012_expense_currency')], [('expenses', '0013_unique_split_user')]
+        executor = MigrationExecutor(connection)
+        executor.migrate(before)
+        apps = executor.loader.project_state(before).apps
+        users = [apps.get_model('auth', 'User').objects.create(username=f'user{i}') for i in range(2)]
+        expense = apps.get_model('expenses', 'Expense').objects.create(
+            title='Trip', amount_cents=1000, split_type='SHARES', created_by=users[0],
+        )
+        split = apps.get_model('expenses', 'ExpenseSplit')
+        split.objects.create(expense=expense, user=users[0], amount_cents=300, shares=1)
+        split.objects.create(expense=expense, user=users[0], amount_cents=200, shares=2)
+        split.objects.create(expense=expense, user=users[1], amount_cents=500, shares=3)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(after)
+        self.assertEqual(
+            sorted(ExpenseSplit.objects.values_list('user_id', 'amount_cents', 'shares')),
+            [(users[0].id, 500, 3), (users[1].id, 500, 3)],
+        )
+        with self.assertRaises(IntegrityError):
+            ExpenseSplit.objects.create(expense_id=expense.id, user_id=users[1].id, amount_cents=0)
+
+
+class ConditionalRequestTestCase(TestCase):
+    def setUp(self):
+        caching.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='password1')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.expense = Expense.objects.create(title='Dinner', amount_cents=10000, split_type='EQUAL', created_by=self.user)
+        split = ExpenseSplit.objects.create(expense=self.expense, user=self.user, amount_cents=10000)
+        rollups.record_expense(self.expense, [split])
+        self.url = f'/api/expenses/{self.expense.id}/'
+
+    def test_etags_on_retrieve_update_and_destroy(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(response.data['version'], 1)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='W/"1"')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.patch(self.url, {'title': 'Lunch'}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"2"')
+        # A second writer that read version 1 loses.
+        response = self.client.patch(self.url, {'title': 'Brunch'}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(self.url, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], 'Lunch')
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.delete(self.url, HTTP_IF_MATCH='"2"')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_update_racing_another_writer_fails(self):
+        # Both read version 1; the other writer commits first.
+        stale = Expense.objects.get(pk=self.expense.pk)
+        self.assertTrue(Expense.objects.bump_version(Expense.objects.get(pk=self.expense.pk)))
+
+        serializer = ExpenseSerializer(stale, data={'title': 'Lunch', 'amount': '50.00'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.assertRaises(PreconditionFailed):
+            serializer.save()
+        self.expense.refresh_from_db()
+        self.assertEqual((self.expense.title, self.expense.version), ('Dinner', 2))
+        self.assertEqual(list(self.expense.splits.values_list('amount_cents', flat=True)), [10000])
+
+    @override_settings(EXPENSES_REQUIRE_IF_MATCH=True)
+    def test_if_match_can_be_required(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.patch(self.url, {'title': 'Lunch'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_428_PRECONDITION_REQUIRED)
+        response = self.client.patch(self.url, {'title': 'Lunch'}, format='json', HTTP_IF_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    async def test_async_detail_not_modified(self):
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        response = await self.async_client.get(
+            f'/api/async/expenses/{self.expense.id}/', headers={'Authorization': f'Bearer {token}', 'If-None-Match': '"1"'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], '"1"')
+
+
+class ChangeFeedTestCase(TestCase):
+    def setUp(self):
+        caching.clear()
+        self.client = APIClient()
+        self.users = [User.objects.create_user(username=f'user{i}', password=f'password{i}') for i in range(3)]
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+
+    def sync(self, user, since=0, **params):
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/expenses/changes/', {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def create_expense(self, title, users):
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.post('/api/expenses/', {
+            'title': title, 'amount': '30.00', 'split_type': 'EQUAL', 'splits': [{'user': user.id} for user in users],
+        }, format='json')
+        return response.data['id']
+
+    def test_sync_returns_changes_and_tombstones(self):
+        dinner = self.create_expense('Dinner', self.users[:2])
+        taxi = self.create_expense('Taxi', self.users)
+
+        first = self.sync(self.users[1])
+        self.assertEqual([expense['id'] for expense in first['changed']], [dinner, taxi])
+        self.assertEqual(first['deleted'], [])
+        # Nothing new since.
+        self.assertEqual(self.sync(self.users[1], first['next_since'])['changed'], [])
+
+        self.client.force_authenticate(user=self.admin)
+        self.client.patch(f'/api/expenses/{dinner}/', {'split_changes': [{'user': self.users[1].id, 'remove': True}]},
+                          format='json')
+        self.client.patch(f'/api/expenses/{taxi}/', {'title': 'Cab'}, format='json')
+
+        # Only the churn comes back: the feed range scan, then the changed expenses and their splits.
+        with self.assertNumQueries(3):
+            delta = self.sync(self.users[1], first['next_since'])
+        self.assertEqual([expense['title'] for expense in delta['changed']], ['Cab'])
+        self.assertEqual(delta['deleted'], [dinner])
+
+        self.client.force_authenticate(user=self.admin)
+        self.client.delete(f'/api/expenses/{taxi}/')
+        for user in self.users:
+            self.assertEqual(self.sync(user, delta['next_since'])['deleted'], [taxi])
+        self.assertEqual([expense['id'] for expense in self.sync(self.users[0])['changed']], [dinner])
+
+    def test_group_and_user_deletes_leave_tombstones(self):
+        self.client.force_authenticate(user=self.users[0])
+        group = self.client.post('/api/groups/', {'name': 'Trip'}, format='json').data['id']
+        self.client.post(f'/api/groups/{group}/members/', {'user': self.users[1].id}, format='json')
+        hotel = self.client.post('/api/expenses/', {
+            'title': 'Hotel', 'amount': '80.00', 'split_type': 'EQUAL', 'group': group,
+            'splits': [{'user': user.id} for user in self.users[:2]],
+        }, format='json').data['id']
+        dinner = self.create_expense('Dinner', self.users)
+        since = self.sync(self.users[1])['next_since']
+
+        self.client.force_authenticate(user=self.users[0])
+        self.assertEqual(self.client.delete(f'/api/groups/{group}/').status_code, status.HTTP_204_NO_CONTENT)
+        delta = self.sync(self.users[1], since)
+        self.assertEqual((delta['changed'], delta['deleted']), ([], [hotel]))
+
+        # users[2] leaves: dinner changes for the others, their own expense is gone.
+        self.client.force_authenticate(user=self.users[2])
+        taxi = self.client.post('/api/expenses/', {
+            'title': 'Taxi', 'amount': '20.00', 'split_type': 'EQUAL',
+            'splits': [{'user': user.id} for user in self.users[1:]],
+        }, format='json').data['id']
+        since = self.sync(self.users[1], delta['next_since'])['next_since']
+        self.client.force_authenticate(user=self.users[2])
+        self.assertEqual(self.client.delete(f'/api/users/{self.users[2].id}/').status_code, status.HTTP_204_NO_CONTENT)
+        delta = self.sync(self.users[1], since)
+        self.assertEqual([expense['id'] for expense in delta['changed']], [dinner])
+        self.assertEqual(len(delta['changed'][0]['splits']), 2)
+        self.assertEqual(delta['deleted'], [taxi])
+
+    def test_sync_pages_and_rebuild(self):
+        ids = [self.create_expense(f'Expense {i}', self.users[:1]) for i in range(5)]
+        page = self.sync(self.users[0], limit=3)
+        self.assertTrue(page['has_more'])
+        rest = self.sync(self.users[0], page['next_since'], limit=3)
+        self.assertFalse(rest['has_more'])
+        self.assertEqual([expense['id'] for expense in page['changed'] + rest['changed']], ids)
+
+        call_command('rebuild_changes', stdout=StringIO())
+        self.assertEqual([expense['id'] for expense in self.sync(self.users[0])['changed']], ids)
+        response = self.client.get('/api/expenses/changes/', {'since': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class MoneyTestCase(SimpleTestCase):
+    def test_parse_and_format_cents(self):
+        for value, cents in [('12.34', 1234), ('-0.5', -50), ('.05', 5), ('7', 700), (7, 700), (Decimal('1.10'), 110)]:
+            self.assertEqual(parse_cents(value), cents)
+        for value in ['1.234', '', 'abc', '1e3', '--1', True]:
+            with self.assertRaises(ValueError):
+                parse_cents(value)
+        self.assertEqual([format_cents(cents) for cents in [1234, 5, 0, -5, -1200]], ['12.34', '0.05', '0.00', '-0.05', '-12.00'])
+
+    def test_money_formats_with_its_currency(self):
+        self.assertEqual(str(Money(175, 'EUR')), '1.75 EUR')
+        self.assertEqual(str(Money(-5, 'USD')), '-0.05 USD')
+
+    def test_api_amounts_round_trip_through_cents(self):
+        serializer = ExpenseSerializer(data={
+            'title': 'Dinner', 'amount': '10.005', 'split_type': 'EQUAL', 'splits': [],
+        })
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('amount', serializer.errors)
+        serializer = ExpenseSerializer(data={'title': 'Dinner', 'amount': '100000000.00', 'split_type': 'EQUAL'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('no more than 10 digits', str(serializer.errors['amount']))
+
+class FxTestCase(TestCase):
+    RATES = 'date,currency,rate\n2000-01-01,EUR,1.25\n2020-01-01,EUR,1.50\n'
+
+    def setUp(self):
+        caching.clear()
+        rates = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        rates.write(self.RATES)
+        rates.close()
+        self.addCleanup(Path(rates.name).unlink)
+        rates_settings = override_settings(EXPENSES_FX_RATES_FILE=rates.name)
+        rates_settings.enable()
+        self.addCleanup(rates_settings.disable)
+
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username='user1', password='password1')
+        self.user2 = User.objects.create_user(username='user2', password='password2')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+
+    def create_expense(self, payer, debtor, amount, currency):
+        self.client.force_authenticate(user=payer)
+        response = self.client.post('/api/expenses/', {
+            'title': f'Paid by {payer.username}', 'amount': amount, 'currency': currency, 'split_type': 'EXACT',
+            'splits': [{'user': debtor.id, 'amount': amount}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return response.data
+
+    def get(self, user, url, params=None):
+        self.client.force_authenticate(user=user)
+        return self.client.get(url, params or {})
+
+    def test_rate_table(self):
+        table = fx.RateTable.from_csv(StringIO(self.RATES), 'USD')
+        self.assertEqual(table.currencies, {'USD', 'EUR'})
+        self.assertEqual(table.convert(1000, 'EUR', 'USD', timezone.localdate()), 1500)
+        self.assertEqual(table.convert(1000, 'EUR', 'USD', date(2019, 12, 31)), 1250)
+        self.assertEqual(table.convert(1001, 'USD', 'EUR', date(2020, 1, 1)), 667)
+        with self.assertRaises(fx.UnknownRate):
+            table.convert(1000, 'EUR', 'USD', date(1999, 12, 31))
+        with self.assertRaises(ValueError):
+            fx.RateTable.from_csv(StringIO('date,currency,rate\n2000-01-01,EUR,-1\n'), 'USD')
+
+    def test_balances_are_kept_per_currency_and_converted_on_read(self):
+        # user2 owes user1 40 EUR, user1 owes user2 30 USD.
+        self.assertEqual(self.create_expense(self.user1, self.user2, '40.00', 'eur')['currency'], 'EUR')
+        self.create_expense(self.user2, self.user1, '30.00', 'USD')
+        self.assertEqual(Balance.objects.count(), 2)
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+        response = self.get(self.user2, '/api/balances/')
+        self.assertEqual((response.data['currency'], response.data['net']), ('USD', '-30.00'))
+        response = self.get(self.user2, '/api/balances/', {'currency': 'EUR'})
+        self.assertEqual((response.data['currency'], response.data['net']), ('EUR', '-20.00'))
+        response = self.get(self.user2, '/api/balances/', {'date': '2010-01-01'})
+        self.assertEqual(response.data['net'], '-20.00')
+        response = self.get(self.user2, '/api/balances/', {'date': '1999-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.get(self.user2, '/api/balances/settle/', {'users': f'{self.user1.id},{self.user2.id}'})
+        self.assertEqual(response.data, {
+            'currency': 'USD', 'transfers': [{'payer': self.user2.id, 'payee': self.user1.id, 'amount': '30.00'}],
+        })
+
+    def test_unknown_currency_is_rejected(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.post('/api/expenses/', {
+            'title': 'Dinner', 'amount': '10.00', 'currency': 'XYZ', 'split_type': 'EQUAL',
+            'splits': [{'user': self.user1.id}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('currency', response.data)
+        response = self.get(self.user1, '/api/balances/', {'currency': 'XYZ'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_balance_sheet_converts_and_round_trips_currency(self):
+        self.create_expense(self.user1, self.user2, '40.00', 'EUR')
+        response = self.get(self.admin, '/api/expenses/download_balance_sheet/', {'currency': 'USD'})
+        header, row = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(header.endswith(',Amount (USD)'))
+        self.assertEqual(row.split(',')[1:3] + row.split(',')[-1:], ['40.00', 'EUR', '60.00'])
+
+        exported = b''.join(self.get(self.admin, '/api/expenses/download_balance_sheet/').streaming_content)
+        Expense.objects.all().delete()
+        Balance.objects.all().delete()
+        upload = SimpleUploadedFile('balance_sheet.csv', exported, content_type='text/csv')
+        response = self.client.post('/api/expenses/import_balance_sheet/', {'file': upload}, format='multipart')
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(Expense.objects.get().currency, 'EUR')
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+    def test_async_views_convert_like_the_sync_ones(self):
+        self.create_expense(self.user1, self.user2, '40.00', 'EUR')
+
+        def get(user, url, params):
+            headers = {'Authorization': f'Bearer {ClaimsTokenObtainPairSerializer.get_token(user).access_token}'}
+            return async_to_sync(self.async_client.get)(url, params, headers=headers)
+
+        for params, net in [({}, '-60.00'), ({'currency': 'EUR'}, '-40.00'), ({'date': '2010-01-01'}, '-50.00')]:
+            response = get(self.user2, '/api/async/balances/', params)
+            self.assertEqual(response.json()['net'], net)
+            self.assertEqual(response.json(), self.get(self.user2, '/api/balances/', params).data)
+        response = get(self.user2, '/api/async/balances/', {'date': '1999-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = get(self.admin, '/api/async/expenses/download_balance_sheet/', {'currency': 'USD'})
+        header, row = async_to_sync(self.collect)(response).splitlines()
+        self.assertTrue(header.endswith(',Amount (USD)'))
+        self.assertEqual(row.split(',')[-1], '60.00')
+
+    async def collect(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+
+@override_settings(EXPENSES_READ_REPLICA='replica', EXPENSES_REPLICA_STICKY_SECONDS=5)
+class ReadReplicaTestCase(TestCase):
+    # The replica is a second, in-memory SQLite database, added here rather than
+    # in settings and written only by replicate(), so it lags behind the primary
+    # until then.
+
+    @classmethod
+    def setUpClass(cls):
+        # Before super(), which checks `databases` against the configured
+        # aliases, and before the replica becomes the read alias, which the
+        # router never migrates. The test runner reads `databases` before any of
+        # this, so the replica is only listed once it exists.
+        connections.settings['replica'] = connections.configure_settings(
+            {**connections.settings, 'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
+        )['replica']
+        connections['replica'].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        cls.databases = {'default', 'replica'}
+        try:
+            super().setUpClass()
+        except Exception:
+            cls.drop_replica()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.drop_replica()
+
+    @classmethod
+    def drop_replica(cls):
+        cls.databases = {'default'}
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def setUp(self):
+        caching.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='password1')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+
+    def replicate(self):
+        for model in [User, Expense, ExpenseSplit]:
+            model.objects.using('replica').all().delete()
+            model.objects.using('replica').bulk_create(model.objects.using('default').order_by('pk'))
+
+    def create_expense(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.post('/api/expenses/', {
+            'title': 'Dinner', 'amount': '10.00', 'split_type': 'EQUAL', 'splits': [{'user': user.id}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def get(self, user, url):
+        self.client.force_authenticate(user=user)
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(url)
+        return response, len(replica_queries)
+
+    def test_reads_use_replica_and_writes_use_primary(self):
+        self.replicate()
+        expense_id = self.create_expense(self.admin)
+        self.assertFalse(Expense.objects.using('replica').exists())
+
+        response, replica_queries = self.get(self.user, '/api/expenses/user_expenses/')
+        self.assertEqual(response.data['results'], [])
+        self.assertGreater(replica_queries, 0)
+        response, replica_queries = self.get(self.user, '/api/balances/')
+        self.assertEqual(replica_queries, 0)
+
+        # The admin wrote within the sticky window, so they read their own write.
+        response, replica_queries = self.get(self.admin, '/api/expenses/overall_expenses/')
+        self.assertEqual([expense['id'] for expense in response.data['results']], [expense_id])
+        self.assertEqual(replica_queries, 0)
+
+        caching.clear()
+        response, _ = self.get(self.admin, '/api/expenses/overall_expenses/')
+        self.assertEqual(response.data['results'], [])
+        self.replicate()
+        response, _ = self.get(self.admin, '/api/expenses/overall_expenses/')
+        self.assertEqual([expense['id'] for expense in response.data['results']], [expense_id])
+
+    def test_retrieve_and_export_read_replica(self):
+        expense_id = self.create_expense(self.user)
+        self.replicate()
+        Expense.objects.filter(pk=expense_id).update(title='Lunch')
+        caching.clear()
+
+        response, replica_queries = self.get(self.user, f'/api/expenses/{expense_id}/')
+        self.assertEqual(response.data['title'], 'Dinner')
+        self.assertGreater(replica_queries, 0)
+
+        response, _ = self.get(self.admin, '/api/expenses/download_balance_sheet/')
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[1].startswith('Dinner,'))
+        self.assertGreater(len(replica_queries), 0)
+
+    def test_replica_is_never_migrated(self):
+        router = routers.ReadReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'expenses'))
+        self.assertIsNone(router.allow_migrate('default', 'expenses'))
+        self.assertEqual(router.db_for_write(Expense), 'default')
+
+
+class SqliteTuningTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='password1')
+
+    def test_connections_get_pragmas(self):
+        def pragma(name):
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA {name}')
+                return cursor.fetchone()[0]
+
+        # The test database is in memory, which has no WAL; 1 is NORMAL.
+        self.assertEqual(pragma('synchronous'), 1)
+        self.assertEqual(pragma('busy_timeout'), settings.EXPENSES_SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(pragma('cache_size'), settings.EXPENSES_SQLITE_PRAGMAS['cache_size'])
+
+    def create_expense(self):
+        serializer = ExpenseSerializer(data={
+            'title': 'Dinner', 'amount': '10.00', 'split_type': 'EQUAL', 'splits': [{'user': self.user.id}],
+        })
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as queries:
+            serializer.save(created_by=self.user)
+        return [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+
+    def test_expense_writes_begin_immediate(self):
+        self.assertEqual(self.create_expense(), ['BEGIN IMMEDIATE'])
+        self.assertIsNone(connection.transaction_mode)
+        with override_settings(EXPENSES_SQLITE_IMMEDIATE_WRITES=False):
+            self.assertEqual(self.create_expense(), ['BEGIN'])
@@ -1,20 +1,51 @@
 # expenses/views.py
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django.contrib.auth.models import User
-from .models import Expense
-from .serializers import UserSerializer, ExpenseSerializer
-import csv
-from django.http import HttpResponse
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework.exceptions import AuthenticationFailed
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from .models import Expense, ExpenseChange, ExpenseSplit, Group, GroupMembership, ReportJob, SpendingRollup
+from .serializers import (
+    UserSerializer, ExpenseSerializer, BulkExpenseListSerializer, BalanceSummarySerializer, TransferSerializer,
+    ReportJobSerializer, GroupSerializer, GroupMembershipSerializer, GroupBalancesSerializer,
+    SpendingQuerySerializer, SpendingRowSerializer, ChangesQuerySerializer, ConversionQuerySerializer,
+)
+from . import cascades, caching, changes, conditional, fx, importers, ledger, metrics, rollups, routers, settlement
+import io
+import secrets
+from contextlib import contextmanager
+from datetime import timedelta
+from django.utils import timezone
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from .exports import balance_sheet_queryset, iter_balance_sheet
+from .pagination import KeysetPagination
+from .authentication import CachedJWTAuthentication, StatelessReadsMixin
+from .routers import ReplicaReadsMixin
+from .sqlite import write_transaction
+from rest_framework.exceptions import AuthenticationFailed, NotFound, PermissionDenied, ValidationError
+from .permissions import IsExpenseOwner, IsGroupAdmin, IsGroupMember, IsSelf, IsStaff, group_role
+
+def conversion_params(request):
+    # (currency, date) from ?currency= and ?date=, None when not given.
+    query = ConversionQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    return query.validated_data.get('currency'), query.validated_data.get('date')
+
+@contextmanager
+def converting():
+    # A balance in a currency without a rate on the requested date is a bad request.
+    try:
+        yield
+    except fx.UnknownRate as error:
+        raise ValidationError({'date': str(error)})
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
 
     def get_permissions(self):
         if self.action == 'create':
@@ -22,35 +53,11 @@ class UserViewSet(viewsets.ModelViewSet):
         elif self.action in ['list']:
             permission_classes = [IsAuthenticated, IsAdminUser]
         else:
-            permission_classes = [IsAuthenticated]
+            permission_classes = [IsAuthenticated, IsSelf]
         return [permission() for permission in permission_classes]
 
-    def retrieve(self, request, *args, **kwargs):
-        user = self.get_object()
-        jwt_authenticator = JWTAuthentication()
-        try:
-            validated_token = jwt_authenticator.get_validated_token(request.headers.get('Authorization').split()[1])
-            user_from_token = jwt_authenticator.get_user(validated_token)
-        except Exception as e:
-            raise AuthenticationFailed('Invalid token')
-
-        if user != user_from_token:
-            raise AuthenticationFailed('Token does not match the requested user')
-
-        return super().retrieve(request, *args, **kwargs)
-    
-    # update UserViewSet class to enforce condition like retrieve on the put and delete methods
     def update(self, request, *args, **kwargs):
         user = self.get_object()
-        jwt_authenticator = JWTAuthentication()
-        try:
-            validated_token = jwt_authenticator.get_validated_token(request.headers.get('Authorization').split()[1])
-            user_from_token = jwt_authenticator.get_user(validated_token)
-        except Exception as e:
-            raise AuthenticationFailed('Invalid token')
-
-        if user != user_from_token:
-            raise AuthenticationFailed('Token does not match the requested user')
 
         # Ensure password is hashed if it is being updated
         if 'password' in request.data:
@@ -59,135 +66,461 @@ class UserViewSet(viewsets.ModelViewSet):
             request.data['password'] = user.password
 
         return super().update(request, *args, **kwargs)
-    
-    def destroy(self, request, *args, **kwargs):
-        user = self.get_object()
-        jwt_authenticator = JWTAuthentication()
-        try:
-            validated_token = jwt_authenticator.get_validated_token(request.headers.get('Authorization').split()[1])
-            user_from_token = jwt_authenticator.get_user(validated_token)
-        except Exception as e:
-            raise AuthenticationFailed('Invalid token')
-
-        if user != user_from_token:
-            raise AuthenticationFailed('Token does not match the requested user')
 
-        return super().destroy(request, *args, **kwargs)
+    def perform_destroy(self, instance):
+        cascades.delete_user(instance)
 
-class ExpenseViewSet(viewsets.ModelViewSet):
-    queryset = Expense.objects.all()
+class ExpenseViewSet(ReplicaReadsMixin, StatelessReadsMixin, viewsets.ModelViewSet):
+    queryset = Expense.objects.with_splits()
     serializer_class = ExpenseSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    replica_actions = ('retrieve', 'user_expenses', 'overall_expenses', 'download_balance_sheet')
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
+    def get_permissions(self):
+        if self.action == 'retrieve':
+            permission_classes = [IsAuthenticated, IsExpenseOwner]
+        elif self.action in ['update', 'partial_update', 'destroy']:
+            permission_classes = [IsAuthenticated, IsStaff]
+        else:
+            permission_classes = self.permission_classes
+        return [permission() for permission in permission_classes]
+
     def retrieve(self, request, *args, **kwargs):
-        expense = self.get_object()
-        jwt_authenticator = JWTAuthentication()
-        try:
-            validated_token = jwt_authenticator.get_validated_token(request.headers.get('Authorization').split()[1])
-            user_from_token = jwt_authenticator.get_user(validated_token)
-        except Exception as e:
-            raise AuthenticationFailed('Invalid token')
+        # The cached entry keeps the owner next to the payload so the permission
+        # check does not need the database either.
+        cached = caching.get_expense(kwargs['pk'])
+        if cached is None:
+            expense = self.get_object()
+            cached = {'created_by': expense.created_by_id, 'data': self.get_serializer(expense).data}
+            # A replica may still return a version the primary has replaced, so
+            # cache what it returns only for as long as it may lag.
+            timeout = settings.EXPENSES_REPLICA_STICKY_SECONDS if routers.reading_from_replica() else None
+            caching.set_expense(expense.id, cached, timeout)
+        else:
+            self.check_object_permissions(request, Expense(pk=kwargs['pk'], created_by_id=cached['created_by']))
 
-        if expense.created_by != user_from_token:
-            raise AuthenticationFailed('You do not have permission to view this expense')
+        version = cached['data']['version']
+        headers = {'ETag': conditional.etag(version)}
+        if conditional.not_modified(request, version):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(cached['data'], headers=headers)
 
-        return super().retrieve(request, *args, **kwargs)
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request):
+        # Create many expenses in one request. All split users are fetched with a
+        # single query, and either every expense is created or none is.
+        users = User.objects.in_bulk(BulkExpenseListSerializer.referenced_user_ids(request.data))
+        groups = Group.objects.in_bulk(BulkExpenseListSerializer.referenced_group_ids(request.data))
+        context = {**self.get_serializer_context(), 'users': users, 'groups': groups}
+        serializer = self.get_serializer(
+            data=request.data, many=True, context=context, max_length=settings.EXPENSES_BULK_MAX_ITEMS
+        )
+        if not serializer.is_valid():
+            errors = serializer.errors
+            if isinstance(errors, list):
+                # Report only the items that failed, keyed by their position in the request.
+                errors = [{'index': index, 'errors': item} for index, item in enumerate(errors) if item]
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        expenses = serializer.save(created_by=request.user)
+        return Response(
+            {'created': len(expenses), 'ids': [expense.id for expense in expenses]},
+            status=status.HTTP_201_CREATED,
+        )
 
     @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated])
     def user_expenses(self, request):
-        user_expenses = Expense.objects.filter(created_by=request.user)
-        serializer = self.get_serializer(user_expenses, many=True)
-        return Response(serializer.data)
+        user_expenses = self.get_queryset().filter(created_by_id=request.user.id)
+        page = self.paginate_queryset(user_expenses)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated])
+    def participating(self, request):
+        # Expenses the user created or has a split in. Each side is its own index
+        # range scan (created_by, created_at, id) and (user, expense); an OR across
+        # the join would scan every split instead.
+        queryset = self.get_queryset()
+        split_expense_ids = ExpenseSplit.objects.filter(user_id=request.user.id).values('expense_id')
+        page = self.paginator.paginate_querysets(
+            [queryset.filter(created_by_id=request.user.id), queryset.filter(id__in=split_expense_ids)],
+            request,
+            view=self,
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated])
+    def changes(self, request):
+        # Delta sync: expenses the user takes part in that changed after `since`,
+        # in change order, read from the (user, id) index of the change feed.
+        params = ChangesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        since = params.validated_data['since']
+        limit = params.validated_data.get('limit', settings.EXPENSES_PAGE_SIZE)
+
+        feed = ExpenseChange.objects.filter(user_id=request.user.id, id__gt=since)
+        settle = settings.EXPENSES_CHANGES_SETTLE_SECONDS
+        if settle:
+            feed = feed.filter(changed_at__lte=timezone.now() - timedelta(seconds=settle))
+        rows = list(feed.order_by('id').values_list('id', 'expense_id', 'deleted')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        expenses = self.get_queryset().in_bulk([expense_id for _, expense_id, deleted in rows if not deleted])
+        changed, deleted = [], []
+        for _, expense_id, is_deleted in rows:
+            # An expense deleted after its row was read counts as deleted too.
+            if is_deleted or expense_id not in expenses:
+                deleted.append(expense_id)
+            else:
+                changed.append(expenses[expense_id])
+        return Response({
+            'changed': self.get_serializer(changed, many=True).data,
+            'deleted': deleted,
+            'next_since': rows[-1][0] if rows else since,
+            'has_more': has_more,
+        })
 
     @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated, IsAdminUser])
     def overall_expenses(self, request):
-        overall_expenses = Expense.objects.all()
-        serializer = self.get_serializer(overall_expenses, many=True)
-        return Response(serializer.data)
+        overall_expenses = self.get_queryset()
+        page = self.paginate_queryset(overall_expenses)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated, IsAdminUser])
     def download_balance_sheet(self, request):
-        # Create the HttpResponse object with the appropriate CSV header.
-        response = HttpResponse(content_type='text/csv')
+        # Stream the CSV row by row so memory stays flat regardless of the number of expenses.
+        # ?currency=EUR adds each amount converted at the rate of its expense's date.
+        currency, _ = conversion_params(request)
+        response = StreamingHttpResponse(
+            iter_balance_sheet(routers.pinned(balance_sheet_queryset()), currency=currency), content_type='text/csv'
+        )
         response['Content-Disposition'] = 'attachment; filename="balance_sheet.csv"'
+        return response
 
-        writer = csv.writer(response)
-        writer.writerow(['Title', 'Amount', 'Split Type', 'Created By', 'Created At', 'Split Info'])
+    @action(detail=False, methods=['POST'], permission_classes=[IsAuthenticated, IsAdminUser])
+    def import_balance_sheet(self, request):
+        # Load a CSV in the download_balance_sheet format, sent as the `file` field
+        # of a multipart upload. Large uploads are spooled to disk by Django and
+        # read back as a stream.
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'No file was submitted.'})
 
-        expenses = Expense.objects.all()
-        for expense in expenses:
-            split_info = "; ".join(
-                [f"{split.user.username}: {split.amount} ({split.percentage}%)" for split in expense.splits.all()]
-            )
-            writer.writerow([
-                expense.title, 
-                expense.amount, 
-                expense.get_split_type_display(), 
-                expense.created_by.username, 
-                expense.created_at,
-                split_info
-            ])
-
-        return response
+        stream = io.TextIOWrapper(upload.open('rb'), encoding='utf-8', newline='')
+        try:
+            result = importers.import_balance_sheet(stream)
+        except ValueError as error:
+            raise ValidationError({'file': str(error)})
+        finally:
+            stream.detach()
+        return Response(result.as_dict(), status=status.HTTP_201_CREATED)
 
-    # update ExpenseViewSet class to enforce condition like retrieve on the put and delete methods and can be modified by admin only
     def update(self, request, *args, **kwargs):
         expense = self.get_object()
-        jwt_authenticator = JWTAuthentication()
-        try:
-            validated_token = jwt_authenticator.get_validated_token(request.headers.get('Authorization').split()[1])
-            user_from_token = jwt_authenticator.get_user(validated_token)
-        except Exception as e:
-            raise AuthenticationFailed('Invalid token')
-
-        if not user_from_token.is_staff:
-            raise AuthenticationFailed('Only admin can update an expense')
+        conditional.check_if_match(request, expense.version)
 
-        # Ensure nested fields are handled properly
+        # Split users are fetched with one query, however many splits are sent.
+        users = User.objects.in_bulk(BulkExpenseListSerializer.referenced_user_ids([request.data]))
+        context = {**self.get_serializer_context(), 'users': users}
         partial = kwargs.pop('partial', False)
-        serializer = self.get_serializer(expense, data=request.data, partial=partial)
+        serializer = self.get_serializer(expense, data=request.data, partial=partial, context=context)
         serializer.is_valid(raise_exception=True)
-        
-        # Explicitly handle nested fields update
         self.perform_update(serializer)
 
         if getattr(expense, '_prefetched_objects_cache', None):
             # If 'prefetched_objects_cache' is not None, it means that the prefetch cache needs to be invalidated.
             expense._prefetched_objects_cache = {}
 
-        return Response(serializer.data)
+        return Response(serializer.data, headers={'ETag': conditional.etag(expense.version)})
 
-    def perform_update(self, serializer):
-        # Custom update method to handle nested fields
-        validated_data = serializer.validated_data
-        splits_data = validated_data.pop('splits', None)
-        
-        # Update the expense instance
-        expense = serializer.save()
-        
-        # Handle nested splits if provided
-        if splits_data:
-            expense.splits.all().delete()
-            for split_data in splits_data:
-                expense.splits.create(**split_data)
-    
-    def destroy(self, request, *args, **kwargs):
-        expense = self.get_object()
-        jwt_authenticator = JWTAuthentication()
-        try:
-            validated_token = jwt_authenticator.get_validated_token(request.headers.get('Authorization').split()[1])
-            user_from_token = jwt_authenticator.get_user(validated_token)
-        except Exception as e:
-            raise AuthenticationFailed('Invalid token')
+    def perform_destroy(self, instance):
+        conditional.check_if_match(self.request, instance.version)
+        with write_transaction():
+            if not Expense.objects.bump_version(instance):
+                raise conditional.PreconditionFailed()
+            splits = list(instance.splits.all())
+            ledger.revert_expense(instance, splits)
+            rollups.revert_expense(instance, splits)
+            changes.revert_expense(instance, splits)
+            caching.invalidate_expenses([instance.id])
+            instance.delete()
 
-        if not user_from_token.is_staff:
-            raise AuthenticationFailed('Only admin can delete an expense')
+    @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated, IsAdminUser])
+    def cache_stats(self, request):
+        # Hit/miss counters of the expense and balance caches in this worker process.
+        return Response(caching.stats())
 
-        return super().destroy(request, *args, **kwargs)
-    
     def list(self, request, *args, **kwargs):
         return Response(status=status.HTTP_403_FORBIDDEN)
-    
+
+class BalanceViewSet(StatelessReadsMixin, viewsets.ViewSet):
+    permission_classes = [IsAuthenticated]
+
+    def list(self, request):
+        # Net balance against every counterparty, read straight from the ledger and
+        # converted into ?currency= at the rates of ?date= (see conversion_params).
+        # Only the default conversion is cached.
+        currency, on = conversion_params(request)
+        default = currency is None and on is None
+        cached = caching.get_balances(request.user.id) if default else None
+        if cached is not None:
+            return Response(cached)
+
+        with converting():
+            balances = ledger.net_balances(request.user.id, currency, on)
+        serializer = BalanceSummarySerializer(ledger.balance_summary(request.user.id, balances, currency))
+        if default:
+            caching.set_balances(request.user.id, serializer.data)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['GET'])
+    def settle(self, request):
+        # Minimal set of transfers that clears the balances among ?users=1,2,3.
+        # Other users only settle their own balances with the listed users; what
+        # those users owe each other is not theirs to see. Without the parameter
+        # the whole ledger is settled, which is admin only.
+        users_param = request.query_params.get('users')
+        if users_param:
+            try:
+                user_ids = {int(user_id) for user_id in users_param.split(',')}
+            except ValueError:
+                raise ValidationError({'users': 'Expected a comma separated list of user ids.'})
+            if request.user.id not in user_ids and not request.user.is_staff:
+                raise PermissionDenied('You can only settle groups you belong to')
+        elif request.user.is_staff:
+            user_ids = None
+        else:
+            raise PermissionDenied('Only admin can settle the whole ledger')
+
+        # Balances in several currencies are converted into ?currency= at the
+        # rates of ?date= and settled together.
+        currency, on = conversion_params(request)
+        with converting():
+            positions = settlement.net_positions(ledger.pair_balances_in_cents(
+                user_ids, currency=currency, on=on, party=None if request.user.is_staff else request.user.id,
+            ))
+        currency = currency or settings.EXPENSES_CURRENCY
+        transfers = settlement.settle(positions)
+        serializer = TransferSerializer(
+            [
+                {'payer': payer, 'payee': payee, 'cents': cents}
+                for payer, payee, cents in transfers
+            ],
+            many=True,
+        )
+        return Response({'currency': currency, 'transfers': serializer.data})
+
+class ReportJobViewSet(StatelessReadsMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                       mixins.ListModelMixin, viewsets.GenericViewSet):
+    # Reports are rendered by the run_report_worker command. Clients submit a job,
+    # poll it until its status is DONE and then fetch the file from `download`.
+    queryset = ReportJob.objects.all()
+    serializer_class = ReportJobSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list' or not self.request.user.is_staff:
+            queryset = queryset.filter(requested_by_id=self.request.user.id)
+        return queryset
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    def perform_create(self, serializer):
+        kind = serializer.validated_data['kind']
+        if kind == ReportJob.BALANCE_SHEET_CSV:
+            if not self.request.user.is_staff:
+                raise PermissionDenied('Only admin can export the balance sheet')
+            serializer.save(requested_by=self.request.user, user=None)
+            return
+
+        user = serializer.validated_data.get('user') or self.request.user
+        if user.pk != self.request.user.pk and not self.request.user.is_staff:
+            raise PermissionDenied('You can only request your own statement')
+        serializer.save(requested_by=self.request.user, user=user)
+
+    @action(detail=True, methods=['GET'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ReportJob.DONE:
+            return Response({'detail': f'Report is {job.get_status_display().lower()}'}, status=status.HTTP_409_CONFLICT)
+        return FileResponse(job.file.open('rb'), as_attachment=True, filename=job.file.name.rsplit('/', 1)[-1])
+
+class GroupViewSet(ReplicaReadsMixin, StatelessReadsMixin, viewsets.ModelViewSet):
+    # Groups and their expenses, balances and balance sheet. Everything below a
+    # group is filtered by group id first, which the group-leading indexes serve.
+    queryset = Group.objects.prefetch_related('memberships')
+    serializer_class = GroupSerializer
+    pagination_class = KeysetPagination
+    replica_actions = ('download_balance_sheet',)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = queryset.filter(memberships__user_id=self.request.user.id)
+        return queryset
+
+    def get_permissions(self):
+        if self.action in ['create', 'list']:
+            permission_classes = [IsAuthenticated]
+        elif self.action in ['retrieve', 'expenses', 'balances', 'remove_member']:
+            permission_classes = [IsAuthenticated, IsGroupMember]
+        else:
+            permission_classes = [IsAuthenticated, IsGroupAdmin]
+        return [permission() for permission in permission_classes]
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            group = serializer.save(created_by=self.request.user)
+            GroupMembership.objects.create(group=group, user=self.request.user, role=GroupMembership.ADMIN)
+
+    def perform_destroy(self, instance):
+        cascades.delete_group(instance)
+
+    @action(detail=True, methods=['POST'])
+    def members(self, request, pk=None):
+        group = self.get_object()
+        serializer = GroupMembershipSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if group_role(group, serializer.validated_data['user'].pk) is not None:
+            raise ValidationError({'user': 'Already a member of this group.'})
+        serializer.save(group=group)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['DELETE'], url_path=r'members/(?P<user_id>\d+)')
+    def remove_member(self, request, pk=None, user_id=None):
+        # Group admins can remove anyone; members can remove themselves (leave).
+        group = self.get_object()
+        user_id = int(user_id)
+        is_admin = request.user.is_staff or group_role(group, request.user.id) == GroupMembership.ADMIN
+        if user_id != request.user.id and not is_admin:
+            raise PermissionDenied(IsGroupAdmin.message)
+        memberships = {membership.user_id: membership for membership in group.memberships.all()}
+        if user_id not in memberships:
+            raise NotFound('Not a member of this group.')
+        admins = [membership for membership in memberships.values() if membership.role == GroupMembership.ADMIN]
+        if admins == [memberships[user_id]]:
+            raise ValidationError({'user': 'A group needs at least one admin.'})
+        memberships[user_id].delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['GET'])
+    def expenses(self, request, pk=None):
+        group = self.get_object()
+        page = self.paginate_queryset(Expense.objects.with_splits().filter(group_id=group.pk))
+        serializer = ExpenseSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['GET'])
+    def balances(self, request, pk=None):
+        # Net position of every member within the group, and the fewest transfers
+        # that settle them.
+        group = self.get_object()
+        currency, on = conversion_params(request)
+        with converting():
+            positions = settlement.net_positions(
+                ledger.pair_balances_in_cents(group_id=group.pk, currency=currency, on=on)
+            )
+        currency = currency or settings.EXPENSES_CURRENCY
+        serializer = GroupBalancesSerializer({
+            'group': group.pk,
+            'currency': currency,
+            'positions': [
+                {'user': user_id, 'net_cents': cents}
+                for user_id, cents in sorted(positions.items())
+            ],
+            'transfers': [
+                {'payer': payer, 'payee': payee, 'cents': cents}
+                for payer, payee, cents in settlement.settle(positions)
+            ],
+        })
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['GET'])
+    def download_balance_sheet(self, request, pk=None):
+        group = self.get_object()
+        currency, _ = conversion_params(request)
+        response = StreamingHttpResponse(
+            iter_balance_sheet(routers.pinned(balance_sheet_queryset().filter(group_id=group.pk)), currency=currency),
+            content_type='text/csv',
+        )
+        response['Content-Disposition'] = f'attachment; filename="balance_sheet_group_{group.pk}.csv"'
+        return response
+
+class AnalyticsViewSet(ReplicaReadsMixin, StatelessReadsMixin, viewsets.ViewSet):
+    permission_classes = [IsAuthenticated]
+    replica_actions = ('spending',)
+
+    @action(detail=False, methods=['GET'])
+    def spending(self, request):
+        # Spending per day or month, read from the SpendingRollup buckets rather
+        # than aggregated over the splits. Admins see everyone; other users only
+        # themselves.
+        query = SpendingQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        rows = SpendingRollup.objects.filter(period=params['period'])
+        if 'start' in params:
+            rows = rows.filter(period_start__gte=params['start'])
+        if 'end' in params:
+            rows = rows.filter(period_start__lte=params['end'])
+        if not request.user.is_staff:
+            if params.get('user', request.user.id) != request.user.id:
+                raise PermissionDenied('You can only see your own spending')
+            rows = rows.filter(user_id=request.user.id)
+        elif 'user' in params:
+            rows = rows.filter(user_id=params['user'])
+        if 'split_type' in params:
+            rows = rows.filter(split_type=params['split_type'])
+
+        # Amounts in different currencies are never added up: every row is in one.
+        group_by = [*params['group_by'], 'currency']
+        rows = (
+            rows
+            .values('period_start', *group_by)
+            .annotate(
+                spent_total=Sum('spent_cents'),
+                split_count=Sum('splits'),
+                paid_total=Sum('paid_cents'),
+                expense_count=Sum('expenses'),
+            )
+            .order_by('period_start', *group_by)
+        )
+        return Response({
+            'period': params['period'],
+            'results': SpendingRowSerializer(rows, many=True).data,
+        })
+
+
+def metrics_view(request):
+    # Prometheus scrape endpoint. A plain Django view: scrapers send a static
+    # bearer token (settings.EXPENSES_METRICS_TOKEN), not a JWT. Until a token is
+    # set, only admins can read it, with their JWT.
+    token = settings.EXPENSES_METRICS_TOKEN
+    if token is not None:
+        header = request.headers.get('Authorization', '')
+        if not secrets.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    else:
+        try:
+            authenticated = CachedJWTAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            authenticated = None
+        if authenticated is None:
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+        if not authenticated[0].is_staff:
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
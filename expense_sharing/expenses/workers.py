@@ -0,0 +1,18 @@
+# expenses/workers.py
+# Entry points for worker pool processes. Pool processes are spawned rather than
+# forked, so they never share a database connection with the parent, and they
+# import this module before Django is set up: keep model imports inside the
+# functions.
+import django
+from django.db import connections
+
+
+def init_process():
+    django.setup()
+    connections.close_all()
+
+
+def run_report_job(job_id):
+    from .reports import run_job
+
+    return run_job(job_id)